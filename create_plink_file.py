@@ -2,6 +2,7 @@ import argparse
 from pathlib import Path
 
 from src.plink import create_plink_bcfile
+from src.progress import create_progress_printer
 
 
 def parse_arguments():
@@ -16,6 +17,10 @@ def parse_arguments():
     parser.add_argument("--out", "-o",
                         type=str, help=help_output,
                         required=True)
+    help_progress = "(Optional) print the plink2 progress and ETA every given seconds"
+    parser.add_argument("--progress", "-p",
+                        type=float, help=help_progress,
+                        default=60)
     return parser
 
 
@@ -25,11 +30,13 @@ def get_options():
     vcf_fpath = Path(options.vcf)
     output_dir = Path(options.out)
     return {'vcf_fpath': vcf_fpath,
-            'out_dir': output_dir}
+            'out_dir': output_dir,
+            'progress_interval': options.progress}
 
 
 if __name__ == '__main__':
     options = get_options()
     vcf_path = options["vcf_fpath"]
     base_path = options["vcf_fpath"].parent / options["vcf_fpath"].stem.replace(".vcf", "")
-    create_plink_bcfile(vcf_path, base_path)
\ No newline at end of file
+    progress_callback = create_progress_printer(min_interval=options["progress_interval"])
+    create_plink_bcfile(vcf_path, base_path, progress_callback=progress_callback)
\ No newline at end of file
@@ -4,7 +4,10 @@ from pathlib import Path
 import pandas as pd
 
 from src.gwas import do_gwas_analysis
+from src.plink import VariantFilters
 from src import normalization 
+from src import shards
+from src import progress
 
 def parse_arguments():
     desc = "Create PLINK format file for GWAS"
@@ -19,15 +22,23 @@ def parse_arguments():
                         "-t", type=str,
                         help=help_traits,
                         required=True)
-    help_normalization = "(Optional) traits normalization method. Available methods are yeo-johnson, quantile"
+    help_normalization = "(Optional) traits normalization method. Available methods are yeo-johnson, box-cox, quantile, rank-inverse-normal"
     parser.add_argument("--normalization", 
                         "-n", type=str,
                         help=help_normalization,
                         default="None")
+    help_workers = "(Optional) number of processes used to normalize the traits and to run the variant ranges"
+    parser.add_argument("--workers", "-w",
+                        type=int, help=help_workers,
+                        default=1)
     help_pca = "(Optional) Add PCA poblation structure to GWAs analysis"
     parser.add_argument("--pca",
                         "-p", type=str, help=help_pca,
                         default="False")
+    help_n_pcs = "(Optional) number of top PCs from the PCA file used as covariates"
+    parser.add_argument("--n_pcs",
+                        type=int, help=help_n_pcs,
+                        default=None)
     help_output = "(Required) GWAs output path"
     parser.add_argument("--out", "-o",
                         type=str, help=help_output,
@@ -48,6 +59,78 @@ def parse_arguments():
     parser.add_argument("--qualitative", "-q",
                         help=help_qualitative,
                         action="store_true")
+    help_permutations = "(Optional) number of phenotype permutations used to compute empirical genome-wide thresholds, only for quantitative traits"
+    parser.add_argument("--permutations",
+                        type=int, help=help_permutations,
+                        default=None)
+    help_clump = "(Optional) clump significant variants into independent loci"
+    parser.add_argument("--clump", "-c",
+                        help=help_clump,
+                        action="store_true")
+    help_gff = "(Optional) GFF3 gene models used to annotate the hits"
+    parser.add_argument("--gff", "-g",
+                        type=str, help=help_gff,
+                        default=None)
+    help_zstd = "(Optional) ask plink2 for zstd compressed association outputs"
+    parser.add_argument("--zstd", "-z",
+                        help=help_zstd,
+                        action="store_true")
+    help_accessions = "(Optional) file with the accessions to analyze, one per line"
+    parser.add_argument("--accessions", "-a",
+                        type=str, help=help_accessions,
+                        default=None)
+    help_subset_cache = "(Optional) dir to cache the PLINK files of the accessions subset"
+    parser.add_argument("--subset_cache",
+                        type=str, help=help_subset_cache,
+                        default=None)
+    help_shard = "(Optional) run only the i-th of N trait shards, given as i/N (0 <= i < N)"
+    parser.add_argument("--shard",
+                        type=str, help=help_shard,
+                        default=None)
+    help_variant_ranges = "(Optional) split every trait GWAS in this number of genome ranges run in parallel"
+    parser.add_argument("--variant_ranges",
+                        type=int, help=help_variant_ranges,
+                        default=1)
+    help_native_adjust = "(Optional) compute the multiple testing corrections without plink2 --adjust"
+    parser.add_argument("--native_adjust",
+                        help=help_native_adjust,
+                        action="store_true")
+    help_manhattan_tiles = "(Optional) export a zoomable Manhattan plot viewer for every trait"
+    parser.add_argument("--manhattan_tiles",
+                        help=help_manhattan_tiles,
+                        action="store_true")
+    help_no_plots = "(Optional) do not draw any plot, matplotlib is not even loaded"
+    parser.add_argument("--no_plots",
+                        help=help_no_plots,
+                        action="store_true")
+    help_maf = "(Optional) minimum MAF of the tested variants, the filtered PLINK files are written once and reused"
+    parser.add_argument("--maf",
+                        type=float, help=help_maf,
+                        default=None)
+    help_native_logistic = "(Optional) fit the qualitative traits with the built-in batched logistic regression (Firth fallback) instead of plink2"
+    parser.add_argument("--native_logistic",
+                        help=help_native_logistic,
+                        action="store_true")
+    help_conditional = "(Optional) stepwise conditional analysis inside the significant regions, quantitative traits only"
+    parser.add_argument("--conditional",
+                        help=help_conditional,
+                        action="store_true")
+    help_region_tests = "(Optional) burden and SKAT tests of the rare variants grouped in windows or in the --gff genes"
+    parser.add_argument("--region_tests",
+                        choices=["windows", "genes"], help=help_region_tests,
+                        default=None)
+    help_region_window = "(Optional) window size in kb for the window region tests"
+    parser.add_argument("--region_window_kb",
+                        type=int, help=help_region_window,
+                        default=50)
+    help_region_max_maf = "(Optional) maximum MAF of the variants included in the region tests"
+    parser.add_argument("--region_max_maf",
+                        type=float, help=help_region_max_maf,
+                        default=0.01)
+    help_progress = "(Optional) print the plink2 progress and ETA every given seconds"
+    parser.add_argument("--progress",
+                        type=float, help=help_progress,
+                        default=None)
     return parser
     
 
@@ -62,7 +145,7 @@ def get_options():
         pca_structure = False
     else:
         pca_structure = Path(pca_structure)
-    if normalization_method not in ["yeo-johnson", "quantile", "None"]:
+    if normalization_method not in normalization.NORMALIZATION_METHODS + ("None",):
         raise ValueError ("Normalization method not available: {}".format(normalization_method))
     
     output_path = Path(options.out)
@@ -70,6 +153,31 @@ def get_options():
     faidx = Path(options.faidx)
     select_traits = options.select_traits
     is_qualitative = options.qualitative
+    n_workers = options.workers
+    n_pcs = options.n_pcs
+    clump = options.clump
+    gff_path = Path(options.gff) if options.gff else None
+    compress_outputs = options.zstd
+    desired_accs = None
+    if options.accessions:
+        desired_accs = Path(options.accessions).read_text().split()
+    subset_cache_dir = Path(options.subset_cache) if options.subset_cache else None
+    n_permutations = options.permutations
+    n_variant_ranges = options.variant_ranges
+    plink_adjust = not options.native_adjust
+    export_manhattan_tiles = options.manhattan_tiles
+    plots = not options.no_plots
+    logistic_engine = "native" if options.native_logistic else "plink2"
+    progress_interval = options.progress
+    conditional = options.conditional
+    region_tests = options.region_tests
+    region_window_kb = options.region_window_kb
+    region_max_maf = options.region_max_maf
+    variant_filters = None
+    if options.maf is not None:
+        variant_filters = VariantFilters(max_major_freq=options.maf,
+                                         max_missing_rate=None)
+    shard = shards.parse_shard(options.shard) if options.shard else None
     return {'base_plink_path': base_plink_path,
             'traits_path': traits_path,
             'normalization_method': normalization_method,
@@ -79,32 +187,79 @@ def get_options():
             "select_traits": select_traits,
             "is_qualitative": is_qualitative,
             "pca": pca_structure,
+            "n_permutations": n_permutations,
+            "n_workers": n_workers,
+            "n_pcs": n_pcs,
+            "clump": clump,
+            "gff_path": gff_path,
+            "compress_outputs": compress_outputs,
+            "desired_accs": desired_accs,
+            "subset_cache_dir": subset_cache_dir,
+            "shard": shard,
+            "n_variant_ranges": n_variant_ranges,
+            "plink_adjust": plink_adjust,
+            "export_manhattan_tiles": export_manhattan_tiles,
+            "plots": plots,
+            "variant_filters": variant_filters,
+            "logistic_engine": logistic_engine,
+            "progress_interval": progress_interval,
+            "conditional": conditional,
+            "region_tests": region_tests,
+            "region_window_kb": region_window_kb,
+            "region_max_maf": region_max_maf,
             }
 
 
 if __name__ == "__main__":
     options = get_options()
-    phenotype_dframe = pd.read_csv(options["traits_path"], sep="\t").dropna()
+    if options["progress_interval"] is not None:
+        progress.set_default_progress_callback(
+            progress.create_progress_printer(min_interval=options["progress_interval"]))
+    phenotype_dframe = pd.read_csv(options["traits_path"], sep="\t", dtype={"SAMPLE_NAME": str})
     normalization_method = options["normalization_method"]
     output_dir = options["output_path"]
     if not output_dir.exists():
          output_dir.mkdir()
-    if normalization_method:
-        if normalization_method == "yeo_johnson":
-            phenotype_dframe = normalization.normalize_dframe(
-            phenotype_dframe, method=normalization_method)
-        elif normalization_method == "quantile":
-            phenotype_dframe = normalization.quantile_transform_dframe(
-                phenotype_dframe, n_quantiles=10
-                )
+    traits = options["select_traits"]
+    gwas_output_dir = output_dir
+    if options["shard"] is not None:
+        if traits is None:
+            traits = [trait for trait in phenotype_dframe.columns if trait != "SAMPLE_NAME"]
+        shard_idx, n_shards = options["shard"]
+        traits = shards.select_shard_traits(traits, shard_idx, n_shards)
+        gwas_output_dir = shards.get_shard_dir(output_dir, shard_idx, n_shards)
+    if normalization_method != "None":
+        phenotype_dframe = normalization.normalize_traits(
+            phenotype_dframe, method=normalization_method,
+            traits=traits, n_quantiles=10,
+            n_workers=options["n_workers"],
+            cache_dir=output_dir / "normalization_cache")
     gwas_kwargs = {
             "bfiles_base_path": options["base_plink_path"],
             "phenotype_dframe": phenotype_dframe,
             "out_base_name": options["output_base"],
-            "out_dir": options["output_path"],
-            "traits": options["select_traits"],
+            "out_dir": gwas_output_dir,
+            "traits": traits,
             "genome_fai_path": open(options["faidx"]).read(),
             "qualitative": options["is_qualitative"],
+            "n_permutations": options["n_permutations"],
+            "n_pcs": options["n_pcs"],
+            "clump": options["clump"],
+            "gff_path": options["gff_path"],
+            "compress_outputs": options["compress_outputs"],
+            "desired_accs": options["desired_accs"],
+            "subset_cache_dir": options["subset_cache_dir"],
+            "n_variant_ranges": options["n_variant_ranges"],
+            "n_processes": options["n_workers"],
+            "plink_adjust": options["plink_adjust"],
+            "export_manhattan_tiles": options["export_manhattan_tiles"],
+            "plots": options["plots"],
+            "variant_filters": options["variant_filters"],
+            "logistic_engine": options["logistic_engine"],
+            "conditional": options["conditional"],
+            "region_tests": options["region_tests"],
+            "region_window_kb": options["region_window_kb"],
+            "region_max_maf": options["region_max_maf"],
         }
     if options["pca"]:
             gwas_kwargs["covars_path"] = options["pca"]
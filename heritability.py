@@ -0,0 +1,65 @@
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+from src.grm import build_grm, estimate_heritability
+
+
+def parse_arguments():
+    desc = "Build a GRM from PLINK files and estimate trait heritability by REML"
+    parser = argparse.ArgumentParser(description=desc)
+    help_plink_input = "(Required) PLINK basename path"
+    parser.add_argument("--plink",
+                        "-i", type=str,
+                        help=help_plink_input,
+                        required=True)
+    help_traits = "(Required) traits path"
+    parser.add_argument("--traits",
+                        "-t", type=str,
+                        help=help_traits,
+                        required=True)
+    help_grm = "(Required) GRM path. It is reused if it already exists"
+    parser.add_argument("--grm", "-g",
+                        type=str, help=help_grm,
+                        required=True)
+    help_output = "(Required) heritability output path"
+    parser.add_argument("--out", "-o",
+                        type=str, help=help_output,
+                        required=True)
+    help_pca = "(Optional) covariates file to use as fixed effects"
+    parser.add_argument("--pca",
+                        "-p", type=str, help=help_pca,
+                        default=None)
+    help_workers = "(Optional) number of processes used to build the GRM"
+    parser.add_argument("--workers", "-w",
+                        type=int, help=help_workers,
+                        default=1)
+    help_traits_to_analyze = "(Optional) traits to analyze"
+    parser.add_argument("--select_traits", "-s",
+                        help=help_traits_to_analyze,
+                        nargs="*", required=False)
+    return parser
+
+
+def get_options():
+    parser = parse_arguments()
+    options = parser.parse_args()
+    return {"base_plink_path": Path(options.plink),
+            "traits_path": Path(options.traits),
+            "grm_path": Path(options.grm),
+            "output_path": Path(options.out),
+            "covars_path": Path(options.pca) if options.pca else None,
+            "n_workers": options.workers,
+            "select_traits": options.select_traits}
+
+
+if __name__ == "__main__":
+    options = get_options()
+    phenotype_dframe = pd.read_csv(options["traits_path"], sep="\t", dtype={"SAMPLE_NAME": str})
+    grm_res = build_grm(options["base_plink_path"], options["grm_path"],
+                        n_workers=options["n_workers"])
+    heritabilities = estimate_heritability(grm_res, phenotype_dframe,
+                                           traits=options["select_traits"],
+                                           covars_path=options["covars_path"])
+    heritabilities.to_csv(options["output_path"], sep="\t")
@@ -0,0 +1,50 @@
+import argparse
+from pathlib import Path
+
+from src.shards import launch_local_shards, merge_shards
+
+GWAS_SCRIPT_PATH = Path(__file__).parent / "gwas.py"
+
+
+def parse_arguments():
+    desc = "Run gwas.py split in trait shards with local processes and merge them"
+    epilog = "Any other argument is passed to every gwas.py invocation"
+    parser = argparse.ArgumentParser(description=desc, epilog=epilog)
+    help_n_shards = "(Required) number of trait shards"
+    parser.add_argument("--n_shards", "-n",
+                        type=int, help=help_n_shards,
+                        required=True)
+    help_processes = "(Optional) number of shards run at the same time"
+    parser.add_argument("--processes", "-j",
+                        type=int, help=help_processes,
+                        default=1)
+    help_output = "(Required) GWAs output path"
+    parser.add_argument("--out", "-o",
+                        type=str, help=help_output,
+                        required=True)
+    help_base_output = "(Required) GWAs output base name"
+    parser.add_argument("--base", "-b",
+                        type=str, help=help_base_output,
+                        required=True)
+    return parser
+
+
+def get_options():
+    parser = parse_arguments()
+    options, gwas_args = parser.parse_known_args()
+    gwas_args = gwas_args + ["--out", options.out, "--base", options.base]
+    return {"n_shards": options.n_shards,
+            "n_processes": options.processes,
+            "output_path": Path(options.out),
+            "output_base": options.base,
+            "gwas_args": gwas_args}
+
+
+if __name__ == "__main__":
+    options = get_options()
+    launch_local_shards(GWAS_SCRIPT_PATH, options["gwas_args"],
+                        n_shards=options["n_shards"],
+                        n_processes=options["n_processes"])
+    merge_res = merge_shards(options["output_path"], options["output_base"])
+    for output_path in merge_res.values():
+        print(output_path)
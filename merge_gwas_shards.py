@@ -0,0 +1,32 @@
+import argparse
+from pathlib import Path
+
+from src.shards import merge_shards
+
+
+def parse_arguments():
+    desc = "Merge the outputs of a GWAS run split in trait shards"
+    parser = argparse.ArgumentParser(description=desc)
+    help_output = "(Required) GWAs output path used by the shards"
+    parser.add_argument("--out", "-o",
+                        type=str, help=help_output,
+                        required=True)
+    help_base_output = "(Required) GWAs output base name"
+    parser.add_argument("--base", "-b",
+                        type=str, help=help_base_output,
+                        required=True)
+    return parser
+
+
+def get_options():
+    parser = parse_arguments()
+    options = parser.parse_args()
+    return {"output_path": Path(options.out),
+            "output_base": options.base}
+
+
+if __name__ == "__main__":
+    options = get_options()
+    merge_res = merge_shards(options["output_path"], options["output_base"])
+    for output_path in merge_res.values():
+        print(output_path)
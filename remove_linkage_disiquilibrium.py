@@ -38,6 +38,10 @@ def parse_arguments():
     help_bad_ld = "(Optional) allow --bad-ld in plink."
     parser.add_argument("--bad_ld", "-b",
                         action="store_true", help=help_bad_ld)
+    help_keep = "(Optional) plink2 --keep file with the samples to use"
+    parser.add_argument("--keep", "-k",
+                        type=str, help=help_keep,
+                        default=None)
     return parser
 
 
@@ -51,13 +55,15 @@ def get_options():
     windows_size = options.windows_size
     step_size = options.step_size
     bad_ld = options.bad_ld
+    keep_path = Path(options.keep) if options.keep else None
     return {'base_plink_path': base_plink_path,
             'pruned_vars': pruned_vars,
             "pruned_plink_path": pruned_plink_path,
             "max_missing_rate": max_missing_rate,
             "windows_size": windows_size,
             "step_size": step_size,
-            "bad_ld": bad_ld}
+            "bad_ld": bad_ld,
+            "keep_path": keep_path}
 
 
 if __name__ == '__main__':
@@ -68,5 +74,6 @@ if __name__ == '__main__':
             variant_filters=VariantFilters(max_missing_rate=options["max_missing_rate"]),
             window_size=options["windows_size"],
             step_size=options["step_size"],
-            bad_ld=options["bad_ld"]
+            bad_ld=options["bad_ld"],
+            keep_path=options["keep_path"]
         )
\ No newline at end of file
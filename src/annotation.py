@@ -0,0 +1,228 @@
+import json
+import os
+from pathlib import Path
+
+import numpy
+import pandas
+
+
+def _parse_gff3_attributes(attributes):
+    parsed = {}
+    for item in attributes.strip().split(";"):
+        if "=" not in item:
+            continue
+        key, value = item.split("=", 1)
+        parsed[key] = value
+    return parsed
+
+
+def parse_gff3_features(gff_path, feature_types=("gene",)):
+    chroms, starts, ends, ids, names = [], [], [], [], []
+    with Path(gff_path).open("rt") as fhand:
+        for line in fhand:
+            if line.startswith("##FASTA"):
+                break
+            if line.startswith("#") or not line.strip():
+                continue
+            items = line.rstrip("\n").split("\t")
+            if items[2] not in feature_types:
+                continue
+            attributes = _parse_gff3_attributes(items[8])
+            feature_id = attributes.get("ID", f"{items[0]}:{items[3]}-{items[4]}")
+            chroms.append(items[0])
+            starts.append(int(items[3]))
+            ends.append(int(items[4]))
+            ids.append(feature_id)
+            names.append(attributes.get("Name", feature_id))
+    return pandas.DataFrame(
+        {"chrom": chroms, "start": starts, "end": ends, "gene_id": ids, "gene_name": names}
+    )
+
+
+class GeneIndex:
+    def __init__(self, chroms, chrom_bounds, starts, ends, gene_ids, gene_names):
+        self._chrom_bounds = {
+            chrom: (bounds[0], bounds[1]) for chrom, bounds in zip(chroms, chrom_bounds)
+        }
+        self._starts = starts
+        self._ends = ends
+        self._gene_ids = gene_ids
+        self._gene_names = gene_names
+        # running max of the ends of the genes sorted by start, this makes
+        # the leftmost gene that could overlap a position searchable
+        self._max_ends = numpy.empty_like(ends)
+        self._max_end_idxs = numpy.empty(ends.shape[0], dtype=numpy.int64)
+        for start_idx, end_idx in self._chrom_bounds.values():
+            chrom_ends = ends[start_idx:end_idx]
+            max_ends = numpy.maximum.accumulate(chrom_ends)
+            self._max_ends[start_idx:end_idx] = max_ends
+            is_new_max = numpy.r_[True, chrom_ends[1:] >= max_ends[:-1]]
+            self._max_end_idxs[start_idx:end_idx] = start_idx + numpy.maximum.accumulate(
+                numpy.where(is_new_max, numpy.arange(chrom_ends.shape[0]), 0)
+            )
+
+    @classmethod
+    def from_gff3(cls, gff_path, feature_types=("gene",)):
+        features = parse_gff3_features(gff_path, feature_types=feature_types)
+        features = features.sort_values(["chrom", "start", "end"], kind="stable")
+        chroms, first_idxs, counts = numpy.unique(
+            features["chrom"].values, return_index=True, return_counts=True
+        )
+        return cls(
+            chroms=numpy.asarray(chroms, dtype=str),
+            chrom_bounds=numpy.column_stack([first_idxs, first_idxs + counts]),
+            starts=features["start"].values.astype(numpy.int64),
+            ends=features["end"].values.astype(numpy.int64),
+            gene_ids=numpy.asarray(features["gene_id"], dtype=str),
+            gene_names=numpy.asarray(features["gene_name"], dtype=str),
+        )
+
+    def save(self, path, cache_key=None):
+        chroms = list(self._chrom_bounds.keys())
+        metadata = {} if cache_key is None else {"cache_key": numpy.array(cache_key)}
+        numpy.savez(
+            path,
+            **metadata,
+            chroms=numpy.array(chroms, dtype=str),
+            chrom_bounds=numpy.array([self._chrom_bounds[chrom] for chrom in chroms]),
+            starts=self._starts,
+            ends=self._ends,
+            gene_ids=numpy.asarray(self._gene_ids, dtype=str),
+            gene_names=numpy.asarray(self._gene_names, dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(path) as arrays:
+            return cls(
+                chroms=arrays["chroms"],
+                chrom_bounds=arrays["chrom_bounds"].reshape(-1, 2),
+                starts=arrays["starts"],
+                ends=arrays["ends"],
+                gene_ids=arrays["gene_ids"],
+                gene_names=arrays["gene_names"],
+            )
+
+    def _annotate_chrom(self, chrom, poss):
+        n_poss = poss.shape[0]
+        overlapping = numpy.full(n_poss, "", dtype=object)
+        nearest_idxs = numpy.full(n_poss, -1, dtype=numpy.int64)
+        distances = numpy.full(n_poss, -1, dtype=numpy.int64)
+        if chrom not in self._chrom_bounds:
+            return overlapping, nearest_idxs, distances
+
+        start_idx, end_idx = self._chrom_bounds[chrom]
+        starts = self._starts[start_idx:end_idx]
+        max_ends = self._max_ends[start_idx:end_idx]
+
+        # genes in [first_candidates, n_started) are the only ones that can
+        # overlap each position
+        n_started = numpy.searchsorted(starts, poss, side="right")
+        first_candidates = numpy.searchsorted(max_ends, poss, side="left")
+        has_overlap = first_candidates < n_started
+        for pos_idx in numpy.nonzero(has_overlap)[0]:
+            candidate_idxs = numpy.arange(first_candidates[pos_idx], n_started[pos_idx])
+            candidate_idxs = start_idx + candidate_idxs
+            candidate_idxs = candidate_idxs[self._ends[candidate_idxs] >= poss[pos_idx]]
+            overlapping[pos_idx] = ",".join(self._gene_ids[candidate_idxs])
+            nearest_idxs[pos_idx] = candidate_idxs[0]
+            distances[pos_idx] = 0
+
+        no_overlap = numpy.nonzero(~has_overlap)[0]
+        n_genes = end_idx - start_idx
+        prev_idxs = n_started[no_overlap] - 1
+        next_idxs = n_started[no_overlap]
+        prev_distances = numpy.full(no_overlap.shape[0], numpy.iinfo(numpy.int64).max)
+        has_prev = prev_idxs >= 0
+        prev_distances[has_prev] = poss[no_overlap][has_prev] - max_ends[prev_idxs[has_prev]]
+        next_distances = numpy.full(no_overlap.shape[0], numpy.iinfo(numpy.int64).max)
+        has_next = next_idxs < n_genes
+        next_distances[has_next] = starts[next_idxs[has_next]] - poss[no_overlap][has_next]
+
+        prev_gene_idxs = numpy.full(no_overlap.shape[0], -1)
+        prev_gene_idxs[has_prev] = self._max_end_idxs[start_idx + prev_idxs[has_prev]]
+        use_prev = prev_distances <= next_distances
+        nearest_idxs[no_overlap] = numpy.where(
+            use_prev, prev_gene_idxs, start_idx + next_idxs
+        )
+        distances[no_overlap] = numpy.minimum(prev_distances, next_distances)
+        no_genes = ~(has_prev | has_next)
+        nearest_idxs[no_overlap[no_genes]] = -1
+        distances[no_overlap[no_genes]] = -1
+        return overlapping, nearest_idxs, distances
+
+    def annotate(self, chroms, poss):
+        chroms = numpy.asarray(chroms, dtype=str)
+        poss = numpy.asarray(poss, dtype=numpy.int64)
+        overlapping = numpy.full(poss.shape[0], "", dtype=object)
+        nearest_idxs = numpy.full(poss.shape[0], -1, dtype=numpy.int64)
+        distances = numpy.full(poss.shape[0], -1, dtype=numpy.int64)
+        for chrom in numpy.unique(chroms):
+            mask = chroms == chrom
+            chrom_res = self._annotate_chrom(chrom, poss[mask])
+            overlapping[mask], nearest_idxs[mask], distances[mask] = chrom_res
+
+        has_nearest = nearest_idxs >= 0
+        nearest_ids = numpy.full(poss.shape[0], "", dtype=object)
+        nearest_ids[has_nearest] = self._gene_ids[nearest_idxs[has_nearest]]
+        nearest_names = numpy.full(poss.shape[0], "", dtype=object)
+        nearest_names[has_nearest] = self._gene_names[nearest_idxs[has_nearest]]
+        return pandas.DataFrame(
+            {
+                "overlapping_genes": overlapping,
+                "nearest_gene": nearest_ids,
+                "nearest_gene_name": nearest_names,
+                "nearest_gene_distance": distances,
+            }
+        )
+
+
+def _create_gene_index_cache_key(gff_path, feature_types):
+    stat = Path(gff_path).stat()
+    return json.dumps(
+        {
+            "feature_types": sorted(feature_types),
+            "gff_size": stat.st_size,
+            "gff_mtime_ns": stat.st_mtime_ns,
+        },
+        sort_keys=True,
+    )
+
+
+def _read_gene_index_cache_key(cache_path):
+    with numpy.load(cache_path) as arrays:
+        if "cache_key" not in arrays.files:
+            return None
+        return str(arrays["cache_key"])
+
+
+def load_gene_index(gff_path, cache_path=None, feature_types=("gene",)):
+    gff_path = Path(gff_path)
+    if cache_path is None:
+        cache_path = Path(str(gff_path) + ".gene_index.npz")
+    cache_path = Path(cache_path)
+    # the cached index is only valid for the same gff and feature types
+    cache_key = _create_gene_index_cache_key(gff_path, feature_types)
+    if cache_path.exists() and _read_gene_index_cache_key(cache_path) == cache_key:
+        return GeneIndex.load(cache_path)
+    gene_index = GeneIndex.from_gff3(gff_path, feature_types=feature_types)
+    # several shards could be writing it, the rename is atomic
+    tmp_path = Path(f"{cache_path}.{os.getpid()}.tmp")
+    with tmp_path.open("wb") as fhand:
+        gene_index.save(fhand, cache_key=cache_key)
+    tmp_path.replace(cache_path)
+    return gene_index
+
+
+def annotate_hits(hits_dframe, gene_index, id_col="variant_id"):
+    if "chrom" in hits_dframe and "pos" in hits_dframe:
+        chroms = hits_dframe["chrom"].values
+        poss = hits_dframe["pos"].values
+    else:
+        # variant ids are created by plink as chrom:pos
+        chrom_poss = hits_dframe[id_col].astype(str).str.rsplit(":", n=1, expand=True)
+        chroms = chrom_poss[0].values
+        poss = chrom_poss[1].astype(int).values
+    annotations = gene_index.annotate(chroms, poss)
+    annotations.index = hits_dframe.index
+    return pandas.concat([hits_dframe, annotations], axis=1)
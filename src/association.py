@@ -0,0 +1,41 @@
+import numpy
+
+from src.bed import impute_missing_with_mean
+
+
+def create_covariate_basis(n_samples, covars=None):
+    # orthonormal basis of the intercept plus the covariates, used to
+    # project them out of phenotypes and genotypes
+    design = numpy.ones((n_samples, 1))
+    if covars is not None:
+        design = numpy.column_stack([design, numpy.asarray(covars, dtype=float)])
+    basis, _ = numpy.linalg.qr(design)
+    return basis
+
+
+def residualize(matrix, covariate_basis):
+    return matrix - covariate_basis @ (covariate_basis.T @ matrix)
+
+
+def _scale_columns_to_unit_norm(matrix):
+    norms = numpy.sqrt((matrix * matrix).sum(axis=0))
+    return numpy.divide(matrix, norms, out=numpy.zeros_like(matrix), where=norms > 0)
+
+
+def prepare_genotypes_for_scoring(genotypes, covariate_basis):
+    genotypes = impute_missing_with_mean(genotypes)
+    genotypes = residualize(genotypes, covariate_basis.astype(genotypes.dtype))
+    return _scale_columns_to_unit_norm(genotypes)
+
+
+def prepare_phenotypes_for_scoring(phenotypes, covariate_basis):
+    phenotypes = residualize(numpy.asarray(phenotypes, dtype=float), covariate_basis)
+    return _scale_columns_to_unit_norm(phenotypes)
+
+
+def correlations_to_pvalues(correlations, dof):
+    from scipy import stats
+
+    r2 = numpy.clip(numpy.asarray(correlations, dtype=float) ** 2, 0, 1 - 1e-15)
+    t_stats = numpy.sqrt(dof * r2 / (1 - r2))
+    return 2 * stats.t.sf(t_stats, dof)
@@ -0,0 +1,119 @@
+from pathlib import Path
+
+import numpy
+import pandas
+
+BED_MAGIC_NUMBER = b"\x6c\x1b\x01"
+FAM_COLUMNS = ["fid", "iid", "father", "mother", "sex", "phenotype"]
+BIM_COLUMNS = ["chrom", "variant_id", "cm", "pos", "allele1", "allele2"]
+
+
+def _create_decoding_table():
+    # every .bed byte holds 4 genotypes, 2 bits each, lowest bits first.
+    # 00 -> hom allele1, 01 -> missing, 10 -> het, 11 -> hom allele2
+    dosages = numpy.array([2, numpy.nan, 1, 0], dtype=numpy.float32)
+    bytes_ = numpy.arange(256, dtype=numpy.uint8)
+    shifts = numpy.array([0, 2, 4, 6], dtype=numpy.uint8)
+    return dosages[(bytes_[:, None] >> shifts) & 3]
+
+
+_DECODING_TABLE = _create_decoding_table()
+
+
+def read_fam(bfiles_base_path):
+    return pandas.read_csv(
+        str(bfiles_base_path) + ".fam",
+        sep=r"\s+",
+        header=None,
+        names=FAM_COLUMNS,
+        dtype=str,
+    )
+
+
+def read_bim(bfiles_base_path):
+    return pandas.read_csv(
+        str(bfiles_base_path) + ".bim",
+        sep=r"\s+",
+        header=None,
+        names=BIM_COLUMNS,
+        dtype={
+            "chrom": str,
+            "variant_id": str,
+            "cm": float,
+            "pos": int,
+            "allele1": str,
+            "allele2": str,
+        },
+    )
+
+
+class BedReader:
+    def __init__(self, bfiles_base_path):
+        self.bfiles_base_path = Path(bfiles_base_path)
+        self.samples = read_fam(bfiles_base_path)
+        self.variants = read_bim(bfiles_base_path)
+        self.n_samples = self.samples.shape[0]
+        self.n_variants = self.variants.shape[0]
+        self._bytes_per_variant = (self.n_samples + 3) // 4
+
+        bed_path = Path(str(bfiles_base_path) + ".bed")
+        with bed_path.open("rb") as fhand:
+            magic_number = fhand.read(len(BED_MAGIC_NUMBER))
+        if magic_number != BED_MAGIC_NUMBER:
+            raise ValueError(f"Not a variant-major plink .bed file: {bed_path}")
+        self._bed = numpy.memmap(
+            bed_path,
+            dtype=numpy.uint8,
+            mode="r",
+            offset=len(BED_MAGIC_NUMBER),
+            shape=(self.n_variants, self._bytes_per_variant),
+        )
+
+    def get_sample_idxs(self, sample_names):
+        idxs_by_name = pandas.Series(
+            numpy.arange(self.n_samples), index=self.samples["iid"].values
+        )
+        sample_names = pandas.Index(sample_names)
+        unknown = sample_names.difference(idxs_by_name.index)
+        if len(unknown):
+            raise ValueError(f"Samples not found in the bfileset: {list(unknown)[:10]}")
+        return idxs_by_name.loc[sample_names].values
+
+    def read_genotypes(self, variant_idxs=None, sample_idxs=None):
+        # returns a (samples x variants) float32 matrix with allele1 dosages
+        # and NaN for missing genotypes
+        if variant_idxs is None:
+            variant_idxs = slice(None)
+        packed = self._bed[variant_idxs]
+        if packed.ndim == 1:
+            packed = packed[None, :]
+        genotypes = _DECODING_TABLE[packed].reshape(packed.shape[0], -1)
+        genotypes = genotypes[:, : self.n_samples].T
+        if sample_idxs is not None:
+            genotypes = genotypes[sample_idxs, :]
+        return numpy.ascontiguousarray(genotypes)
+
+    def iterate_blocks(self, block_size=2000, start=0, stop=None, sample_idxs=None):
+        if stop is None:
+            stop = self.n_variants
+        for block_start in range(start, stop, block_size):
+            block_stop = min(block_start + block_size, stop)
+            yield {
+                "start": block_start,
+                "stop": block_stop,
+                "genotypes": self.read_genotypes(
+                    slice(block_start, block_stop), sample_idxs=sample_idxs
+                ),
+            }
+
+
+def impute_missing_with_mean(genotypes):
+    is_missing = numpy.isnan(genotypes)
+    n_called = genotypes.shape[0] - is_missing.sum(axis=0)
+    sums = numpy.nansum(genotypes, axis=0)
+    means = numpy.divide(
+        sums, n_called, out=numpy.zeros_like(sums), where=n_called > 0
+    )
+    missing_rows, missing_cols = numpy.nonzero(is_missing)
+    genotypes[missing_rows, missing_cols] = means[missing_cols]
+    return genotypes
@@ -0,0 +1,273 @@
+import numpy
+import pandas
+
+from src import association
+from src import logistic
+from src.annotation import parse_gff3_features
+from src.bed import BedReader, impute_missing_with_mean
+from src.plink import read_covars
+
+# SKAT default weights, rarer variants weight more
+BETA_WEIGHTS_PARAMS = (1, 25)
+GROUP_COLUMNS = ["group_id", "chrom", "start", "end", "variant_start", "variant_stop"]
+
+
+def _get_chrom_variant_ranges(variants):
+    # the groups are variant index ranges, so the .bim has to be sorted by
+    # position inside every chromosome
+    chroms = variants["chrom"].values
+    poss = variants["pos"].values
+    is_chrom_start = numpy.r_[True, chroms[1:] != chroms[:-1]]
+    starts = numpy.nonzero(is_chrom_start)[0]
+    stops = numpy.r_[starts[1:], chroms.shape[0]]
+    if len(set(chroms[starts])) != starts.shape[0]:
+        raise ValueError("The variants of every chromosome should be contiguous")
+    if numpy.any(numpy.diff(poss)[~is_chrom_start[1:]] < 0):
+        raise ValueError("The variants should be sorted by position")
+    return {chrom: (start, stop) for chrom, start, stop in zip(chroms[starts], starts, stops)}
+
+
+def _locate_groups(chrom_start, chrom_poss, starts, ends):
+    return (
+        chrom_start + numpy.searchsorted(chrom_poss, starts, side="left"),
+        chrom_start + numpy.searchsorted(chrom_poss, ends, side="right"),
+    )
+
+
+def create_window_groups(variants, window_kb=50, step_kb=None):
+    window = window_kb * 1000
+    step = window if step_kb is None else step_kb * 1000
+    poss = variants["pos"].values
+    groups = []
+    for chrom, (chrom_start, chrom_stop) in _get_chrom_variant_ranges(variants).items():
+        chrom_poss = poss[chrom_start:chrom_stop]
+        starts = numpy.arange(1, chrom_poss[-1] + 1, step)
+        ends = starts + window - 1
+        variant_starts, variant_stops = _locate_groups(chrom_start, chrom_poss, starts, ends)
+        has_variants = variant_stops > variant_starts
+        groups.append(
+            pandas.DataFrame(
+                {
+                    "group_id": [
+                        f"{chrom}:{start}-{end}"
+                        for start, end in zip(starts[has_variants], ends[has_variants])
+                    ],
+                    "chrom": chrom,
+                    "start": starts[has_variants],
+                    "end": ends[has_variants],
+                    "variant_start": variant_starts[has_variants],
+                    "variant_stop": variant_stops[has_variants],
+                }
+            )
+        )
+    if not groups:
+        return pandas.DataFrame(columns=GROUP_COLUMNS)
+    return pandas.concat(groups, ignore_index=True)
+
+
+def create_gene_groups(variants, gff_path, flank_kb=0, feature_types=("gene",)):
+    features = parse_gff3_features(gff_path, feature_types=feature_types)
+    flank = flank_kb * 1000
+    poss = variants["pos"].values
+    groups = []
+    for chrom, (chrom_start, chrom_stop) in _get_chrom_variant_ranges(variants).items():
+        genes = features.loc[features["chrom"] == chrom]
+        if not genes.shape[0]:
+            continue
+        starts = numpy.maximum(genes["start"].values - flank, 1)
+        ends = genes["end"].values + flank
+        variant_starts, variant_stops = _locate_groups(
+            chrom_start, poss[chrom_start:chrom_stop], starts, ends
+        )
+        has_variants = variant_stops > variant_starts
+        groups.append(
+            pandas.DataFrame(
+                {
+                    "group_id": genes["gene_id"].values[has_variants],
+                    "gene_name": genes["gene_name"].values[has_variants],
+                    "chrom": chrom,
+                    "start": starts[has_variants],
+                    "end": ends[has_variants],
+                    "variant_start": variant_starts[has_variants],
+                    "variant_stop": variant_stops[has_variants],
+                }
+            )
+        )
+    if not groups:
+        return pandas.DataFrame(columns=GROUP_COLUMNS)
+    return pandas.concat(groups, ignore_index=True)
+
+
+def _fit_null_model(bed_reader, phenotypes, covars_path, qualitative):
+    phenotypes = phenotypes.dropna()
+    if qualitative:
+        # plink coding: 1 control, 2 case, anything else missing
+        phenotypes = phenotypes.loc[phenotypes.isin([1, 2])] == 2
+    phenotypes = phenotypes.loc[phenotypes.index.isin(bed_reader.samples["iid"])]
+    covars = None
+    if covars_path:
+        covars = read_covars(covars_path)
+        phenotypes = phenotypes.loc[phenotypes.index.isin(covars.index)]
+        covars = covars.loc[phenotypes.index].values
+    values = phenotypes.values.astype(float)
+    design = logistic.create_null_design(values.shape[0], covars=covars)
+
+    # the scores are G'r and their covariance Gt'Gt, Gt being the genotypes
+    # weighted by the null model variances and projected out of the covariates
+    if qualitative:
+        etas = design @ logistic.fit_null_logistic(values, design)
+        mus = 1 / (1 + numpy.exp(-etas))
+        score_residuals = values - mus
+        sqrt_weights = numpy.sqrt(mus * (1 - mus))
+    else:
+        betas = numpy.linalg.lstsq(design, values, rcond=None)[0]
+        residuals = values - design @ betas
+        variance = residuals @ residuals / (values.shape[0] - design.shape[1])
+        score_residuals = residuals / variance
+        sqrt_weights = numpy.full(values.shape[0], 1 / numpy.sqrt(variance))
+    basis, _ = numpy.linalg.qr(design * sqrt_weights[:, None])
+    return {
+        "sample_idxs": bed_reader.get_sample_idxs(phenotypes.index),
+        "score_residuals": score_residuals,
+        "sqrt_weights": sqrt_weights,
+        "basis": basis,
+    }
+
+
+def _plan_blocks(groups, block_size):
+    # consecutive groups share a decoded block while it fits in block_size
+    # variants, a larger group gets its own block
+    blocks = []
+    block_groups = []
+    for group_idx, start, stop in zip(
+        groups.index, groups["variant_start"].values, groups["variant_stop"].values
+    ):
+        if block_groups and max(block_stop, stop) - block_start > block_size:
+            blocks.append((block_start, block_stop, block_groups))
+            block_groups = []
+        if not block_groups:
+            block_start, block_stop = start, stop
+        block_stop = max(block_stop, stop)
+        block_groups.append(group_idx)
+    if block_groups:
+        blocks.append((block_start, block_stop, block_groups))
+    return blocks
+
+
+def calc_liu_pvalues(q_stats, cumulants):
+    # moment matching of a weighted sum of chi2(1) by a scaled non-central
+    # chi2, the modified Liu method used by SKAT. cumulants are the sums of
+    # the first four powers of the mixture eigenvalues
+    from scipy import stats
+
+    c1, c2, c3, c4 = cumulants
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        s1 = c3 / c2**1.5
+        s2 = c4 / c2**2
+        is_skewed = s1**2 > s2
+        a = numpy.where(
+            is_skewed,
+            1 / (s1 - numpy.sqrt(numpy.maximum(s1**2 - s2, 0))),
+            numpy.sqrt(1 / s2),
+        )
+        deltas = numpy.where(is_skewed, s1 * a**3 - a**2, 0)
+        dofs = numpy.where(is_skewed, a**2 - 2 * deltas, 1 / s2)
+        normalized = (q_stats - c1) / numpy.sqrt(2 * c2) * numpy.sqrt(2) * a
+        return stats.ncx2.sf(normalized + dofs + deltas, dofs, deltas)
+
+
+def _test_block(genotypes, group_ranges, null_model, max_maf):
+    from scipy import stats
+
+    genotypes = impute_missing_with_mean(numpy.array(genotypes, dtype=float))
+    # dosages are counted for the minor allele
+    freqs = genotypes.mean(axis=0) / 2
+    is_flipped = freqs > 0.5
+    genotypes[:, is_flipped] = 2 - genotypes[:, is_flipped]
+    mafs = numpy.minimum(freqs, 1 - freqs)
+    rare_idxs = numpy.nonzero((mafs > 0) & (mafs <= max_maf))[0]
+    weights = stats.beta.pdf(mafs[rare_idxs], *BETA_WEIGHTS_PARAMS)
+
+    rare_genotypes = genotypes[:, rare_idxs]
+    scores = rare_genotypes.T @ null_model["score_residuals"]
+    projected = association.residualize(
+        rare_genotypes * null_model["sqrt_weights"][:, None], null_model["basis"]
+    )
+
+    # group x rare variant weight matrix, the burden statistics of all the
+    # groups of the block come from two matrix products
+    n_groups = len(group_ranges)
+    group_weights = numpy.zeros((rare_idxs.shape[0], n_groups))
+    rare_ranges = []
+    for group_pos, (start, stop) in enumerate(group_ranges):
+        first, last = numpy.searchsorted(rare_idxs, [start, stop])
+        group_weights[first:last, group_pos] = weights[first:last]
+        rare_ranges.append((first, last))
+    burden_scores = group_weights.T @ scores
+    burden_genotypes = projected @ group_weights
+    burden_variances = (burden_genotypes * burden_genotypes).sum(axis=0)
+    skat_q_stats = (group_weights * group_weights).T @ (scores * scores)
+
+    cumulants = numpy.zeros((4, n_groups))
+    for group_pos, (first, last) in enumerate(rare_ranges):
+        if last == first:
+            continue
+        weighted = projected[:, first:last] * weights[first:last]
+        eigenvals = numpy.clip(
+            numpy.linalg.eigvalsh(weighted.T @ weighted), 0, None
+        )
+        cumulants[:, group_pos] = [(eigenvals**power).sum() for power in (1, 2, 3, 4)]
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        burden_pvalues = stats.chi2.sf(burden_scores**2 / burden_variances, 1)
+    skat_pvalues = calc_liu_pvalues(skat_q_stats, cumulants)
+    n_rare = numpy.array([last - first for first, last in rare_ranges])
+    burden_pvalues[n_rare == 0] = numpy.nan
+    skat_pvalues[n_rare == 0] = numpy.nan
+    return {
+        "n_rare_variants": n_rare,
+        "burden_score": burden_scores,
+        "burden_pval": burden_pvalues,
+        "skat_q": skat_q_stats,
+        "skat_pval": skat_pvalues,
+    }
+
+
+def do_region_tests(
+    bfiles_base_path,
+    phenotypes: pandas.Series,
+    groups,
+    covars_path=None,
+    qualitative=False,
+    max_maf=0.01,
+    block_size=5000,
+):
+    bed_reader = BedReader(bfiles_base_path)
+    null_model = _fit_null_model(bed_reader, phenotypes, covars_path, qualitative)
+    groups = groups.sort_values("variant_start", kind="stable")
+
+    results = {}
+    for block_start, block_stop, group_idxs in _plan_blocks(groups, block_size):
+        # every block is decoded once for all the groups it contains
+        genotypes = bed_reader.read_genotypes(
+            slice(block_start, block_stop), sample_idxs=null_model["sample_idxs"]
+        )
+        block_groups = groups.loc[group_idxs]
+        group_ranges = list(
+            zip(
+                block_groups["variant_start"].values - block_start,
+                block_groups["variant_stop"].values - block_start,
+            )
+        )
+        block_res = _test_block(genotypes, group_ranges, null_model, max_maf)
+        for col, values in block_res.items():
+            results.setdefault(col, []).append(
+                pandas.Series(values, index=block_groups.index)
+            )
+
+    tested = groups.drop(columns=["variant_start", "variant_stop"]).assign(
+        n_variants=groups["variant_stop"] - groups["variant_start"]
+    )
+    for col in ("n_rare_variants", "burden_score", "burden_pval", "skat_q", "skat_pval"):
+        tested[col] = pandas.concat(results[col]) if col in results else numpy.nan
+    return tested.sort_values("skat_pval", kind="stable").reset_index(drop=True)
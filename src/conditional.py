@@ -0,0 +1,171 @@
+import numpy
+import pandas
+
+from src import association
+from src.bed import BedReader, impute_missing_with_mean
+from src.plink import read_covars
+
+# a variant whose residual norm falls under this fraction of its original
+# one is collinear with the variants already conditioned on
+COLLINEARITY_TOL = 1e-6
+
+
+def create_regions(chroms, poss, window_kb=250):
+    # the windows around the lead variants are merged when they overlap,
+    # nearby leads are analysed together
+    window = window_kb * 1000
+    leads = pandas.DataFrame(
+        {"chrom": numpy.asarray(chroms), "pos": numpy.asarray(poss, dtype=numpy.int64)}
+    )
+    regions = []
+    for chrom, chrom_leads in leads.groupby("chrom", sort=True):
+        region_start = None
+        for pos in numpy.sort(chrom_leads["pos"].values):
+            start, end = max(pos - window, 0), pos + window
+            if region_start is not None and start <= region_end:
+                region_end = max(region_end, end)
+                continue
+            if region_start is not None:
+                regions.append((chrom, region_start, region_end))
+            region_start, region_end = start, end
+        if region_start is not None:
+            regions.append((chrom, region_start, region_end))
+    return pandas.DataFrame(regions, columns=["chrom", "start", "end"])
+
+
+def _prepare_samples(bed_reader, phenotypes, covars_path):
+    phenotypes = phenotypes.dropna()
+    phenotypes = phenotypes.loc[phenotypes.index.isin(bed_reader.samples["iid"])]
+    covars = None
+    if covars_path:
+        covars = read_covars(covars_path)
+        phenotypes = phenotypes.loc[phenotypes.index.isin(covars.index)]
+        covars = covars.loc[phenotypes.index].values
+    return {
+        "phenotypes": phenotypes.values.astype(float),
+        "sample_idxs": bed_reader.get_sample_idxs(phenotypes.index),
+        "covariate_basis": association.create_covariate_basis(
+            phenotypes.shape[0], covars=covars
+        ),
+    }
+
+
+def _score_region(genotypes, phenotypes, original_norms, n_covars, excluded):
+    norms = numpy.sqrt((genotypes * genotypes).sum(axis=0))
+    is_testable = ~excluded & (norms > COLLINEARITY_TOL * original_norms)
+    correlations = numpy.zeros(genotypes.shape[1])
+    scores = genotypes[:, is_testable].T @ phenotypes
+    correlations[is_testable] = scores / (
+        norms[is_testable] * numpy.sqrt(phenotypes @ phenotypes)
+    )
+    dof = genotypes.shape[0] - n_covars - 1
+    pvalues = association.correlations_to_pvalues(correlations, dof)
+    pvalues[~is_testable] = numpy.nan
+    return pvalues
+
+
+def condition_region(
+    genotypes, phenotypes, covariate_basis, pval_threshold=5e-8, max_signals=10
+):
+    # genotypes and phenotype are kept residualized on the covariates plus
+    # the variants already selected, every new variant only adds one more
+    # projection instead of refitting the model
+    genotypes = association.residualize(
+        impute_missing_with_mean(numpy.array(genotypes, dtype=float)), covariate_basis
+    )
+    phenotypes = association.residualize(phenotypes[:, None], covariate_basis)[:, 0]
+    original_norms = numpy.sqrt((genotypes * genotypes).sum(axis=0))
+    n_covars = covariate_basis.shape[1]
+    selected = numpy.zeros(genotypes.shape[1], dtype=bool)
+
+    steps = []
+    marginal_pvalues = None
+    for _ in range(max_signals):
+        pvalues = _score_region(
+            genotypes, phenotypes, original_norms, n_covars, selected
+        )
+        if marginal_pvalues is None:
+            marginal_pvalues = pvalues
+        if numpy.all(numpy.isnan(pvalues)):
+            break
+        best_idx = int(numpy.nanargmin(pvalues))
+        if pvalues[best_idx] > pval_threshold:
+            break
+        steps.append({"variant_idx": best_idx, "conditional_pval": pvalues[best_idx]})
+
+        selected[best_idx] = True
+        direction = genotypes[:, best_idx] / numpy.sqrt(
+            genotypes[:, best_idx] @ genotypes[:, best_idx]
+        )
+        phenotypes = phenotypes - direction * (direction @ phenotypes)
+        genotypes -= numpy.outer(direction, direction @ genotypes)
+        n_covars += 1
+    return {"steps": steps, "marginal_pvalues": marginal_pvalues}
+
+
+def do_conditional_analysis(
+    bfiles_base_path,
+    phenotypes: pandas.Series,
+    lead_chroms,
+    lead_poss,
+    covars_path=None,
+    window_kb=250,
+    pval_threshold=5e-8,
+    max_signals=10,
+):
+    bed_reader = BedReader(bfiles_base_path)
+    samples = _prepare_samples(bed_reader, phenotypes, covars_path)
+    variants = bed_reader.variants
+    regions = create_regions(lead_chroms, lead_poss, window_kb=window_kb)
+
+    signals = []
+    for region_idx, region in enumerate(regions.itertuples(index=False)):
+        variant_idxs = numpy.nonzero(
+            (variants["chrom"].values == region.chrom)
+            & (variants["pos"].values >= region.start)
+            & (variants["pos"].values <= region.end)
+        )[0]
+        if not variant_idxs.shape[0]:
+            continue
+        # only the regional block is decoded from the .bed
+        genotypes = bed_reader.read_genotypes(
+            variant_idxs, sample_idxs=samples["sample_idxs"]
+        )
+        res = condition_region(
+            genotypes,
+            samples["phenotypes"],
+            samples["covariate_basis"],
+            pval_threshold=pval_threshold,
+            max_signals=max_signals,
+        )
+        for step_idx, step in enumerate(res["steps"], start=1):
+            variant = variants.iloc[variant_idxs[step["variant_idx"]]]
+            signals.append(
+                {
+                    "region": region_idx,
+                    "region_chrom": region.chrom,
+                    "region_start": region.start,
+                    "region_end": region.end,
+                    "n_region_variants": variant_idxs.shape[0],
+                    "step": step_idx,
+                    "variant_id": variant["variant_id"],
+                    "chrom": variant["chrom"],
+                    "pos": variant["pos"],
+                    "marginal_pval": res["marginal_pvalues"][step["variant_idx"]],
+                    "conditional_pval": step["conditional_pval"],
+                }
+            )
+    columns = [
+        "region",
+        "region_chrom",
+        "region_start",
+        "region_end",
+        "n_region_variants",
+        "step",
+        "variant_id",
+        "chrom",
+        "pos",
+        "marginal_pval",
+        "conditional_pval",
+    ]
+    return pandas.DataFrame(signals, columns=columns)
@@ -0,0 +1,149 @@
+import os
+import sys
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy
+
+from src.bed import BedReader
+
+
+def _unlink_segments(segments):
+    for segment in segments.values():
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+    segments.clear()
+
+
+class SharedGenotypeBlockCache:
+    # the owner process decodes every .bed block once into shared memory and
+    # the workers attach to the blocks by name, without copying them
+    def __init__(
+        self,
+        bfiles_base_path,
+        block_size=2000,
+        max_cached_blocks=16,
+        sample_idxs=None,
+    ):
+        if max_cached_blocks < 1:
+            raise ValueError("At least one block should fit in the cache")
+        self._bed_reader = BedReader(bfiles_base_path)
+        self.block_size = block_size
+        self.max_cached_blocks = max_cached_blocks
+        self._sample_idxs = sample_idxs
+        self.n_samples = (
+            self._bed_reader.n_samples if sample_idxs is None else len(sample_idxs)
+        )
+        self.n_variants = self._bed_reader.n_variants
+        self.n_blocks = -(-self.n_variants // block_size)
+        self._name_prefix = f"gwas_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self._segments = OrderedDict()
+        # the finalizer also runs at interpreter exit, and the multiprocessing
+        # resource tracker unlinks the segments left by a killed owner
+        self._finalizer = weakref.finalize(self, _unlink_segments, self._segments)
+
+    def _get_block_bounds(self, block_idx):
+        if not 0 <= block_idx < self.n_blocks:
+            raise IndexError(f"Block out of range: {block_idx}")
+        start = block_idx * self.block_size
+        return start, min(start + self.block_size, self.n_variants)
+
+    def get_block(self, block_idx):
+        start, stop = self._get_block_bounds(block_idx)
+        shape = (self.n_samples, stop - start)
+        name = f"{self._name_prefix}_{block_idx}"
+        if block_idx in self._segments:
+            self._segments.move_to_end(block_idx)
+        else:
+            while len(self._segments) >= self.max_cached_blocks:
+                _, segment = self._segments.popitem(last=False)
+                segment.close()
+                segment.unlink()
+            genotypes = self._bed_reader.read_genotypes(
+                slice(start, stop), sample_idxs=self._sample_idxs
+            )
+            segment = shared_memory.SharedMemory(
+                name=name, create=True, size=max(genotypes.nbytes, 1)
+            )
+            cached = numpy.ndarray(shape, dtype=numpy.float32, buffer=segment.buf)
+            cached[:] = genotypes
+            del cached
+            self._segments[block_idx] = segment
+        return {
+            "block_idx": block_idx,
+            "name": name,
+            "shape": shape,
+            "start": start,
+            "stop": stop,
+        }
+
+    def close(self):
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@contextmanager
+def attach_genotype_block(block_ref):
+    # the owner is the only one that unlinks the segment. Before python 3.13
+    # attaching registers the segment again, but the pool workers share the
+    # owner resource tracker, so that registration is a no-op
+    if sys.version_info >= (3, 13):
+        segment = shared_memory.SharedMemory(name=block_ref["name"], track=False)
+    else:
+        segment = shared_memory.SharedMemory(name=block_ref["name"])
+    genotypes = numpy.ndarray(
+        block_ref["shape"], dtype=numpy.float32, buffer=segment.buf
+    )
+    genotypes.flags.writeable = False
+    try:
+        yield genotypes
+    finally:
+        # the view has to be released before the segment can be closed, so
+        # the callers should not keep references to it
+        del genotypes
+        segment.close()
+
+
+def _run_task_on_block(func, block_ref, task):
+    with attach_genotype_block(block_ref) as genotypes:
+        return func(genotypes, block_ref["start"], block_ref["stop"], task)
+
+
+def map_tasks_over_blocks(func, block_cache, tasks, n_workers=1, block_idxs=None):
+    # func(genotypes, start, stop, task) is run for every task on every
+    # block, results are yielded in block order as
+    # (block_idx, task_idx, result)
+    if block_idxs is None:
+        block_idxs = range(block_cache.n_blocks)
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        for block_idx in block_idxs:
+            # a block can only be evicted once all its tasks are done
+            while len(in_flight) >= block_cache.max_cached_blocks:
+                yield from _collect_block_results(in_flight.popleft())
+            block_ref = block_cache.get_block(block_idx)
+            futures = [
+                executor.submit(_run_task_on_block, func, block_ref, task)
+                for task in tasks
+            ]
+            in_flight.append((block_idx, futures))
+        while in_flight:
+            yield from _collect_block_results(in_flight.popleft())
+
+
+def _collect_block_results(block_futures):
+    block_idx, futures = block_futures
+    for task_idx, future in enumerate(futures):
+        yield block_idx, task_idx, future.result()
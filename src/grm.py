@@ -0,0 +1,270 @@
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy
+import pandas
+
+from src.bed import BedReader, impute_missing_with_mean
+from src.manifest import fingerprint_bfiles
+from src.plink import read_covars
+
+
+def _standardize_genotypes(genotypes, min_maf):
+    genotypes = impute_missing_with_mean(genotypes)
+    freqs = genotypes.mean(axis=0) / 2
+    mafs = numpy.minimum(freqs, 1 - freqs)
+    is_polymorphic = mafs >= max(min_maf, 1e-12)
+    genotypes = genotypes[:, is_polymorphic]
+    freqs = freqs[is_polymorphic]
+    genotypes -= 2 * freqs
+    genotypes /= numpy.sqrt(2 * freqs * (1 - freqs))
+    return genotypes
+
+
+def _accumulate_grm(
+    bfiles_base_path,
+    grm_path,
+    start,
+    stop,
+    sample_idxs,
+    block_size,
+    row_chunk_size,
+    min_maf,
+):
+    bed_reader = BedReader(bfiles_base_path)
+    n_samples = bed_reader.n_samples if sample_idxs is None else len(sample_idxs)
+    grm = numpy.lib.format.open_memmap(
+        grm_path, mode="w+", dtype=numpy.float32, shape=(n_samples, n_samples)
+    )
+    n_variants_used = 0
+    blocks = bed_reader.iterate_blocks(
+        block_size, start=start, stop=stop, sample_idxs=sample_idxs
+    )
+    for block in blocks:
+        genotypes = _standardize_genotypes(block["genotypes"], min_maf=min_maf)
+        n_variants_used += genotypes.shape[1]
+        # row chunks keep the temporary product small for big sample sizes
+        for row_start in range(0, n_samples, row_chunk_size):
+            row_stop = min(row_start + row_chunk_size, n_samples)
+            grm[row_start:row_stop] += genotypes[row_start:row_stop] @ genotypes.T
+    grm.flush()
+    del grm
+    return n_variants_used
+
+
+def _get_grm_ids_path(grm_path):
+    return Path(str(grm_path) + ".id")
+
+
+def _get_grm_fingerprint_path(grm_path):
+    return Path(str(grm_path) + ".fingerprint")
+
+
+def _create_grm_fingerprint(bfiles_base_path, sample_names, min_maf):
+    fingerprint = {
+        "bfiles": fingerprint_bfiles(bfiles_base_path),
+        "samples": None if sample_names is None else list(map(str, sample_names)),
+        "min_maf": min_maf,
+    }
+    return hashlib.sha1(json.dumps(fingerprint).encode()).hexdigest()
+
+
+def _is_grm_current(grm_path, fingerprint):
+    # the fingerprint is written last, a GRM without it is not finished
+    fingerprint_path = _get_grm_fingerprint_path(grm_path)
+    return (
+        grm_path.exists()
+        and _get_grm_ids_path(grm_path).exists()
+        and fingerprint_path.exists()
+        and fingerprint_path.read_text().strip() == fingerprint
+    )
+
+
+def build_grm(
+    bfiles_base_path,
+    grm_path,
+    sample_names=None,
+    n_workers=1,
+    block_size=2000,
+    row_chunk_size=1024,
+    min_maf=0.01,
+    overwrite=False,
+):
+    grm_path = Path(grm_path)
+    ids_path = _get_grm_ids_path(grm_path)
+    # the GRM is reused only if it comes from the same genotypes, samples
+    # and filters
+    fingerprint = _create_grm_fingerprint(bfiles_base_path, sample_names, min_maf)
+    if not overwrite and _is_grm_current(grm_path, fingerprint):
+        return load_grm(grm_path)
+    _get_grm_fingerprint_path(grm_path).unlink(missing_ok=True)
+
+    bed_reader = BedReader(bfiles_base_path)
+    if sample_names is None:
+        sample_names = bed_reader.samples["iid"].values
+        sample_idxs = None
+    else:
+        sample_idxs = bed_reader.get_sample_idxs(sample_names)
+
+    n_workers = max(1, min(n_workers, bed_reader.n_variants))
+    range_edges = numpy.linspace(0, bed_reader.n_variants, n_workers + 1).astype(int)
+    partial_paths = [
+        grm_path.with_name(f"{grm_path.name}.part{idx}.npy") for idx in range(n_workers)
+    ]
+    job_kwargs = [
+        {
+            "bfiles_base_path": bfiles_base_path,
+            "grm_path": partial_path,
+            "start": start,
+            "stop": stop,
+            "sample_idxs": sample_idxs,
+            "block_size": block_size,
+            "row_chunk_size": row_chunk_size,
+            "min_maf": min_maf,
+        }
+        for partial_path, start, stop in zip(
+            partial_paths, range_edges[:-1], range_edges[1:]
+        )
+    ]
+    if n_workers == 1:
+        n_variants_used = [_accumulate_grm(**job_kwargs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_accumulate_grm, **kwargs) for kwargs in job_kwargs]
+            n_variants_used = [future.result() for future in futures]
+    n_variants_used = sum(n_variants_used)
+    if not n_variants_used:
+        raise RuntimeError("No polymorphic variants available to build the GRM")
+
+    # the first partial matrix becomes the final one and the rest are
+    # added to it by row chunks, so only one matrix is ever mapped in full
+    grm = numpy.load(partial_paths[0], mmap_mode="r+")
+    for partial_path in partial_paths[1:]:
+        partial_grm = numpy.load(partial_path, mmap_mode="r")
+        for row_start in range(0, grm.shape[0], row_chunk_size):
+            row_stop = row_start + row_chunk_size
+            grm[row_start:row_stop] += partial_grm[row_start:row_stop]
+        del partial_grm
+        partial_path.unlink()
+    for row_start in range(0, grm.shape[0], row_chunk_size):
+        grm[row_start : row_start + row_chunk_size] /= n_variants_used
+    grm.flush()
+    del grm
+    partial_paths[0].replace(grm_path)
+
+    with ids_path.open("wt") as fhand:
+        fhand.write("\n".join(map(str, sample_names)) + "\n")
+    _get_grm_fingerprint_path(grm_path).write_text(fingerprint + "\n")
+    return load_grm(grm_path)
+
+
+def load_grm(grm_path):
+    grm_path = Path(grm_path)
+    sample_names = _get_grm_ids_path(grm_path).read_text().split()
+    return {
+        "grm": numpy.load(grm_path, mmap_mode="r"),
+        "sample_names": sample_names,
+        "grm_path": grm_path,
+    }
+
+
+def _calc_reml_log_likelihood(log_delta, eigenvals, rotated_phenotypes, rotated_covars):
+    n_samples, n_covars = rotated_covars.shape
+    weights = 1 / (eigenvals + numpy.exp(log_delta))
+    xtwx = rotated_covars.T @ (rotated_covars * weights[:, None])
+    xtwy = rotated_covars.T @ (rotated_phenotypes * weights)
+    betas = numpy.linalg.solve(xtwx, xtwy)
+    residuals = rotated_phenotypes - rotated_covars @ betas
+    dof = n_samples - n_covars
+    sigma2 = (weights * residuals**2).sum() / dof
+    _, logdet_xtwx = numpy.linalg.slogdet(xtwx)
+    _, logdet_xtx = numpy.linalg.slogdet(rotated_covars.T @ rotated_covars)
+    log_likelihood = -0.5 * (
+        dof * numpy.log(2 * numpy.pi * sigma2)
+        - numpy.log(weights).sum()
+        + logdet_xtwx
+        - logdet_xtx
+        + dof
+    )
+    return log_likelihood, sigma2
+
+
+def _fit_reml(eigenvals, rotated_phenotypes, rotated_covars, log_delta_bounds=(-10, 10)):
+    from scipy import optimize
+
+    def neg_log_likelihood(log_delta):
+        return -_calc_reml_log_likelihood(
+            log_delta, eigenvals, rotated_phenotypes, rotated_covars
+        )[0]
+
+    # coarse grid first, the REML surface is not always unimodal
+    grid = numpy.linspace(log_delta_bounds[0], log_delta_bounds[1], 41)
+    grid_values = [neg_log_likelihood(log_delta) for log_delta in grid]
+    best_idx = int(numpy.argmin(grid_values))
+    lower = grid[max(best_idx - 1, 0)]
+    upper = grid[min(best_idx + 1, len(grid) - 1)]
+    res = optimize.minimize_scalar(
+        neg_log_likelihood, bounds=(lower, upper), method="bounded"
+    )
+    log_delta = res.x if res.fun < grid_values[best_idx] else grid[best_idx]
+
+    log_likelihood, sigma2 = _calc_reml_log_likelihood(
+        log_delta, eigenvals, rotated_phenotypes, rotated_covars
+    )
+    delta = numpy.exp(log_delta)
+    return {
+        "h2": 1 / (1 + delta),
+        "genetic_variance": sigma2,
+        "residual_variance": sigma2 * delta,
+        "log_likelihood": log_likelihood,
+    }
+
+
+def _eigendecompose_grm(grm, sample_idxs):
+    grm = numpy.asarray(grm[numpy.ix_(sample_idxs, sample_idxs)], dtype=float)
+    return numpy.linalg.eigh(grm)
+
+
+def estimate_heritability(grm_res, phenotype_dframe, traits=None, covars_path=None):
+    grm_samples = pandas.Series(
+        numpy.arange(len(grm_res["sample_names"])), index=grm_res["sample_names"]
+    )
+    phenotype_dframe = phenotype_dframe.astype({"SAMPLE_NAME": str}).set_index("SAMPLE_NAME")
+    phenotype_dframe = phenotype_dframe.loc[
+        phenotype_dframe.index.isin(grm_samples.index)
+    ]
+    if traits is None:
+        traits = list(phenotype_dframe.columns)
+
+    covars = None
+    if covars_path:
+        covars = read_covars(covars_path)
+        phenotype_dframe = phenotype_dframe.loc[
+            phenotype_dframe.index.isin(covars.index)
+        ]
+
+    # traits sharing the same non missing samples share the eigendecomposition
+    traits_by_samples = {}
+    for trait in traits:
+        sample_names = tuple(phenotype_dframe.index[phenotype_dframe[trait].notna()])
+        traits_by_samples.setdefault(sample_names, []).append(trait)
+
+    results = {}
+    for sample_names, traits_with_these_samples in traits_by_samples.items():
+        sample_names = list(sample_names)
+        eigenvals, eigenvecs = _eigendecompose_grm(
+            grm_res["grm"], grm_samples.loc[sample_names].values
+        )
+        eigenvals = numpy.clip(eigenvals, 0, None)
+        design = numpy.ones((len(sample_names), 1))
+        if covars is not None:
+            design = numpy.column_stack([design, covars.loc[sample_names].values])
+        rotated_design = eigenvecs.T @ design
+        for trait in traits_with_these_samples:
+            phenotypes = phenotype_dframe.loc[sample_names, trait].values.astype(float)
+            res = _fit_reml(eigenvals, eigenvecs.T @ phenotypes, rotated_design)
+            res["n_samples"] = len(sample_names)
+            results[trait] = res
+    return pandas.DataFrame.from_dict(results, orient="index").loc[traits]
@@ -1,12 +1,15 @@
-from pathlib import Path
-
 import numpy
+import pandas
 
-import qmplot
-
-from src import normalization
+from src import annotation
+from src import burden
+from src import hits
+from src import manhattan_tiles
+from src import manifest
+from src import permutation
 from src import plink
-from src import plot
+from src.bed import BedReader, impute_missing_with_mean, read_bim
+from src.conditional import do_conditional_analysis
 
 from src.genome_coord_transform import (
     GenomeCoordinateConverter,
@@ -15,12 +18,144 @@ from src.genome_coord_transform import (
 
 
 def create_phenotype_from_df(df, trait):
-    print(df.keys())
-    print(df)
-    names = [name for key, name in df["SAMPLE_NAME"].items()]
-    values = [value for key, value in df[trait].items()]
-    return {accesion[0]: int(accesion[1]) for accesion in zip(names, values)}
+    phenotypes = df.set_index("SAMPLE_NAME")[trait].dropna()
+    return phenotypes.to_dict()
+
+
+def _calc_r2_with_index_variant(genotypes):
+    genotypes = impute_missing_with_mean(genotypes)
+    genotypes = genotypes - genotypes.mean(axis=0)
+    norms = numpy.sqrt((genotypes * genotypes).sum(axis=0))
+    covs = genotypes[:, 0] @ genotypes
+    norm_products = norms[0] * norms
+    corrs = numpy.divide(
+        covs, norm_products, out=numpy.zeros_like(covs), where=norm_products > 0
+    )
+    return corrs**2
+
+
+def clump_hits(
+    gwas_result,
+    bfiles_base_path,
+    pval_threshold=5e-8,
+    r2_threshold=0.1,
+    window_kb=250,
+    sample_names=None,
+    pval_col="pval",
+):
+    bed_reader = BedReader(bfiles_base_path)
+    sample_idxs = None
+    if sample_names is not None:
+        sample_names = pandas.Index(sample_names)
+        sample_names = sample_names[sample_names.isin(bed_reader.samples["iid"])]
+        sample_idxs = bed_reader.get_sample_idxs(sample_names)
+
+    if gwas_result.variant_table.n_variants != bed_reader.n_variants:
+        raise ValueError("The GWAS result does not come from this bfileset")
+    # the result variant indexes are the .bed ones
+    significant_idxs = gwas_result.select_under_threshold(pval_threshold, col=pval_col)
+    significant = gwas_result.to_dframe(significant_idxs, cols=[pval_col])
+    significant["variant_idx"] = gwas_result.variant_idxs[significant_idxs]
+    significant = significant.sort_values(pval_col, kind="stable")
+
+    variant_ids = significant.index.values
+    chroms = significant["chrom"].values
+    poss = significant["pos"].values.astype(numpy.int64)
+    variant_idxs = significant["variant_idx"].values
+    is_clumped = numpy.zeros(significant.shape[0], dtype=bool)
+    window = window_kb * 1000
+
+    loci = []
+    for lead_idx in range(significant.shape[0]):
+        if is_clumped[lead_idx]:
+            continue
+        is_clumped[lead_idx] = True
+        candidate_idxs = numpy.nonzero(
+            ~is_clumped
+            & (chroms == chroms[lead_idx])
+            & (numpy.abs(poss - poss[lead_idx]) <= window)
+        )[0]
+
+        clumped_idxs = numpy.array([], dtype=int)
+        if candidate_idxs.shape[0]:
+            # only the lead and its candidates are decoded from the .bed
+            genotypes = bed_reader.read_genotypes(
+                numpy.concatenate([[variant_idxs[lead_idx]], variant_idxs[candidate_idxs]]),
+                sample_idxs=sample_idxs,
+            )
+            r2s = _calc_r2_with_index_variant(genotypes)[1:]
+            clumped_idxs = candidate_idxs[r2s >= r2_threshold]
+            is_clumped[clumped_idxs] = True
+
+        locus_poss = poss[numpy.append(clumped_idxs, lead_idx)]
+        loci.append(
+            {
+                "variant_id": variant_ids[lead_idx],
+                "chrom": chroms[lead_idx],
+                "pos": poss[lead_idx],
+                pval_col: significant[pval_col].values[lead_idx],
+                "n_clumped_variants": clumped_idxs.shape[0],
+                "locus_start": locus_poss.min(),
+                "locus_end": locus_poss.max(),
+                "clumped_variant_ids": ",".join(variant_ids[clumped_idxs]),
+            }
+        )
+    columns = [
+        "variant_id",
+        "chrom",
+        "pos",
+        pval_col,
+        "n_clumped_variants",
+        "locus_start",
+        "locus_end",
+        "clumped_variant_ids",
+    ]
+    return pandas.DataFrame(loci, columns=columns)
+
 
+def _create_top_pvalues_table(top_hits, pval_cols, gene_index=None):
+    # chrom and pos go to the annotation, the variant ids are not always
+    # chrom:pos
+    top_pvalues = top_hits[["variant_id", "chrom", "pos"] + list(pval_cols)]
+    if gene_index is not None:
+        top_pvalues = annotation.annotate_hits(top_pvalues, gene_index)
+    return top_pvalues.set_index("variant_id")
+
+
+def _plot_trait_pvalues(
+    pvalues,
+    log_pvalues,
+    chroms,
+    poss,
+    coord_converter,
+    trait,
+    pval_tag,
+    plot_qq,
+    out_base_path,
+):
+    # matplotlib and qmplot are slow to import, only the runs that draw
+    # plots pay for them
+    import qmplot
+
+    from src import plot
+
+    if plot_qq:
+        fig_qq = plot.SimpleFigure()
+        qmplot.qqplot(data=pvalues, title=trait, ax=fig_qq.axes)
+        fig_qq.save_fig(f"{out_base_path}_qq_plot.png")
+
+    fig = plot.SimpleFigure(fig_size=(10, 6))
+    plot.plot_values_along_genome(
+        log_pvalues,
+        chroms,
+        poss,
+        coord_converter=coord_converter,
+        axes=fig.axes,
+        chroms_are_sorted=True,
+    )
+    fig.axes.set_title(trait)
+    fig.axes.set_ylabel(f"-log10({pval_tag})")
+    fig.save_fig(f"{out_base_path}_along_genome.png")
 
 
 def _do_gwas_analysis(
@@ -33,22 +168,140 @@ def _do_gwas_analysis(
     covars_path=None,
     traits=None,
     desired_accs=None,
+    n_permutations=None,
+    n_pcs=None,
+    n_top_hits=100,
+    hits_pval_threshold=5e-8,
+    clump=False,
+    gff_path=None,
+    compress_outputs=False,
+    subset_cache_dir=None,
+    subset_variant_filters=None,
+    n_variant_ranges=1,
+    n_processes=None,
+    plink_adjust=True,
+    export_manhattan_tiles=False,
+    plots=True,
+    variant_filters=None,
+    logistic_engine="plink2",
+    conditional=False,
+    region_tests=None,
+    region_window_kb=50,
+    region_max_maf=0.01,
 ):
+    if conditional and qualitative:
+        raise ValueError("The conditional analysis is only available for quantitative traits")
+    if n_permutations and qualitative:
+        # the permuted scores come from the linear model
+        raise ValueError("The permutation test is only available for quantitative traits")
+    if region_tests not in (None, "windows", "genes"):
+        raise ValueError(f"Unknown region tests: {region_tests}")
+    if region_tests == "genes" and not gff_path:
+        raise ValueError("A GFF file is required to test the gene regions")
+
     out_dir.mkdir(exist_ok=True, parents=True)
 
+    # the sample names are compared with the .fam ids, that are strings
+    phenotype_dframe = phenotype_dframe.astype({"SAMPLE_NAME": str})
+    keep_path = None
+    if desired_accs is not None:
+        desired_accs = {str(acc) for acc in desired_accs}
+        phenotype_dframe = phenotype_dframe.loc[
+            phenotype_dframe["SAMPLE_NAME"].isin(desired_accs)
+        ]
+        if subset_cache_dir is not None:
+            bfiles_base_path = plink.create_subset_bfiles(
+                bfiles_base_path,
+                desired_accs,
+                cache_dir=subset_cache_dir,
+                variant_filters=subset_variant_filters,
+            )["bfiles_base_path"]
+        else:
+            keep_path = plink.write_keep_file(
+                desired_accs, bfiles_base_path, out_dir / f"{out_base_name}.keep"
+            )
+
+    # the region tests need the rare variants that the GWAS filters remove
+    region_bfiles_base_path = bfiles_base_path
+    region_groups = None
+    if region_tests == "windows":
+        region_groups = burden.create_window_groups(
+            read_bim(region_bfiles_base_path), window_kb=region_window_kb
+        )
+    elif region_tests == "genes":
+        region_groups = burden.create_gene_groups(
+            read_bim(region_bfiles_base_path), gff_path
+        )
+
+    # the variants to test are written once, every trait GWAS reads only them
+    if variant_filters is not None:
+        bfiles_base_path = plink.create_filtered_bfiles(
+            bfiles_base_path,
+            variant_filters,
+            cache_dir=subset_cache_dir,
+            keep_path=keep_path,
+        )["bfiles_base_path"]
+        keep_path = None
+
+    gene_index = None
+    if gff_path:
+        gene_index = annotation.load_gene_index(gff_path)
+
     if traits is None:
-        traits = list(phenotype_dframe.keys())
+        traits = [trait for trait in phenotype_dframe.keys() if trait != "SAMPLE_NAME"]
+
+    # all traits go to a single multi-column file, plink2 picks each one
+    # with --pheno-name
+    phenotypes_path = out_dir / f"{out_base_name}.pheno"
+    plink.write_plink2_pheno_file(
+        phenotype_dframe,
+        bfiles_base_path,
+        phenotypes_path,
+        traits=traits,
+        qualitative=qualitative,
+    )
+    if covars_path:
+        covars_path = plink.write_plink2_covars_file(
+            covars_path, bfiles_base_path, out_dir / f"{out_base_name}.cov", n_pcs=n_pcs
+        )["cov_path"]
+
+    run_manifest = manifest.RunManifest(out_dir / f"{out_base_name}.manifest.json")
+    run_options = {
+        "qualitative": qualitative,
+        "n_pcs": n_pcs,
+        "n_permutations": n_permutations,
+        "n_top_hits": n_top_hits,
+        "hits_pval_threshold": hits_pval_threshold,
+        "clump": clump,
+        "gff": manifest.fingerprint_file(gff_path) if gff_path else None,
+        "compress_outputs": compress_outputs,
+        "plink_adjust": plink_adjust,
+        "logistic_engine": logistic_engine,
+        "n_variant_ranges": n_variant_ranges,
+        "export_manhattan_tiles": export_manhattan_tiles,
+        "plots": plots,
+        "conditional": conditional,
+        "region_tests": region_tests,
+        "region_window_kb": region_window_kb,
+        "region_max_maf": region_max_maf,
+    }
 
     for trait in traits:
-        print(f"Doing GWAS for trait: {trait}")
         trait_out_dir = out_dir / trait
-        trait_out_dir.mkdir(exist_ok=True, parents=True)
-
-        phenotypes = create_phenotype_from_df(phenotype_dframe, trait)
+        fingerprint = manifest.create_trait_fingerprint(
+            bfiles_base_path,
+            phenotype_dframe.set_index("SAMPLE_NAME")[trait],
+            covars_path=covars_path,
+            keep_path=keep_path,
+            options=run_options,
+        )
+        if run_manifest.is_done(trait, fingerprint):
+            print(f"GWAS already done for trait: {trait}")
+            continue
+        manifest.remove_partial_trait_dir(trait_out_dir)
 
-        phenotypes_path = trait_out_dir / "phenotypes.pheno"
-        with phenotypes_path.open("wt") as fhand:
-            plink.write_phenotype_file(phenotypes, fhand, quantitative=qualitative)
+        print(f"Doing GWAS for trait: {trait}")
+        trait_out_dir.mkdir(exist_ok=True, parents=True)
 
         if qualitative:
             test_type = "logistic"
@@ -61,6 +314,13 @@ def _do_gwas_analysis(
             "phenotypes_path": phenotypes_path,
             "test_type": test_type,
             "out_base_path": out_base_path,
+            "pheno_name": trait,
+            "compress_outputs": compress_outputs,
+            "keep_path": keep_path,
+            "n_variant_ranges": n_variant_ranges,
+            "n_processes": n_processes,
+            "plink_adjust": plink_adjust,
+            "logistic_engine": logistic_engine,
         }
         if covars_path:
             kwargs["covars_path"] = covars_path
@@ -74,55 +334,152 @@ def _do_gwas_analysis(
             ("benjamini_yekutieli_pval", "benjamini_yekutieli_pval"),
         ]
 
-        pvalues_dframe = res.get("adjusted_pvalues")
-        if pvalues_dframe is None:
+        gwas_result = res.get("gwas_result")
+        if gwas_result is None:
             print(f"{trait}: Zero valid tests")
+            run_manifest.mark_done(
+                trait, fingerprint, summary={"status": "zero_valid_tests"}
+            )
             continue
 
+        csv_columns = [pval for pval, _ in pvals]
+        if n_permutations:
+            perm_res = permutation.do_permutation_test(
+                bfiles_base_path,
+                phenotype_dframe.set_index("SAMPLE_NAME")[trait],
+                gwas_result,
+                n_permutations=n_permutations,
+                covars_path=covars_path,
+            )
+            # the hits get their permutation_fwer_pval from the result
+            gwas_result = perm_res["gwas_result"]
+            perm_res["empirical_thresholds"].to_csv(
+                trait_out_dir / f"{out_base_name}_{trait}_permutation_thresholds.csv"
+            )
+            csv_columns.append("permutation_fwer_pval")
+
         for pval, pval_tag in pvals:
-            pvalues = pvalues_dframe[pval]
-
-            chroms, poss = zip(*[snp_id.split(":") for snp_id in pvalues.index])
-            chroms = numpy.array(chroms)
-            poss = numpy.array(poss, dtype=int)
-
-            index_to_sort = chroms.argsort()
-            chroms = chroms[index_to_sort]
-            poss = poss[index_to_sort]
-            pvalues = pvalues[index_to_sort]
-
-            if pval == "pval":
-                fig_qq = plot.SimpleFigure()
-                qmplot.qqplot(data=pvalues, title=trait, ax=fig_qq.axes)
-                fig_qq.save_fig(
-                    trait_out_dir / f"{out_base_name}_{trait}_{pval_tag}_qq_plot.png"
-                )
+            if not plots and not (export_manhattan_tiles and pval == "pval"):
+                continue
+            # the result is already in genome order
+            chroms = gwas_result.chroms
+            poss = gwas_result.poss.astype(numpy.int64)
+            pvalues = gwas_result.get_pvalues(pval)
 
             coord_converter = GenomeCoordinateConverter(
                 chrom_lens=get_genome_sizes(genome_fai_path=genome_fai_path)
             )
-            fig = plot.SimpleFigure(fig_size=(10, 6))
-            log_pvalues = -numpy.log10(pvalues)
-            plot.plot_values_along_genome(
-                log_pvalues,
-                chroms,
-                poss,
-                coord_converter=coord_converter,
-                axes=fig.axes,
-                chroms_are_sorted=True,
+            log_pvalues = gwas_result.get_log_pvalues(pval)
+            if plots:
+                _plot_trait_pvalues(
+                    pvalues,
+                    log_pvalues,
+                    chroms,
+                    poss,
+                    coord_converter,
+                    trait=trait,
+                    pval_tag=pval_tag,
+                    plot_qq=pval == "pval",
+                    out_base_path=trait_out_dir / f"{out_base_name}_{trait}_{pval_tag}",
+                )
+
+            if export_manhattan_tiles and pval == "pval":
+                manhattan_tiles.create_manhattan_tiles(
+                    log_pvalues,
+                    manhattan_tiles.calc_genome_xs(chroms, poss, coord_converter),
+                    trait_out_dir / f"{out_base_name}_{trait}_manhattan",
+                    chrom_spans=coord_converter.chrom_spans,
+                    labels=gwas_result.variant_ids,
+                    title=trait,
+                )
+
+        trait_hits = hits.extract_trait_hits_from_result(
+            gwas_result,
+            k=n_top_hits,
+            pval_threshold=hits_pval_threshold,
+        )
+
+        if clump:
+            loci = clump_hits(
+                gwas_result,
+                bfiles_base_path,
+                pval_threshold=hits_pval_threshold,
+                sample_names=create_phenotype_from_df(phenotype_dframe, trait).keys(),
+            )
+            if gene_index is not None:
+                loci = annotation.annotate_hits(loci, gene_index)
+            loci.to_csv(
+                trait_out_dir / f"{out_base_name}_{trait}_clumped_loci.csv", index=False
+            )
+
+        if conditional:
+            significant_idxs = gwas_result.select_under_threshold(hits_pval_threshold)
+            signals = do_conditional_analysis(
+                bfiles_base_path,
+                phenotype_dframe.set_index("SAMPLE_NAME")[trait],
+                gwas_result.chroms[significant_idxs],
+                gwas_result.poss[significant_idxs],
+                covars_path=covars_path,
+                pval_threshold=hits_pval_threshold,
+            )
+            if gene_index is not None:
+                signals = annotation.annotate_hits(signals, gene_index)
+            signals.to_csv(
+                trait_out_dir / f"{out_base_name}_{trait}_conditional_signals.csv",
+                index=False,
             )
-            fig.axes.set_title(trait)
-            fig.axes.set_ylabel(f"-log10({pval_tag})")
-            fig.save_fig(
-                trait_out_dir / f"{out_base_name}_{trait}_{pval_tag}_along_genome.png"
+
+        if region_groups is not None:
+            region_res = burden.do_region_tests(
+                region_bfiles_base_path,
+                phenotype_dframe.set_index("SAMPLE_NAME")[trait],
+                region_groups,
+                covars_path=covars_path,
+                qualitative=qualitative,
+                max_maf=region_max_maf,
+            )
+            region_res.to_csv(
+                trait_out_dir / f"{out_base_name}_{trait}_region_tests.csv",
+                index=False,
             )
 
         csv_path = trait_out_dir / f"{out_base_name}_{trait}_pvalues_along_genome.csv"
-        pvalues = pvalues_dframe
-        last_row_idx = pvalues.iloc[99:100, 0].index[0]
-        some_pvalues = pvalues_dframe.loc[:last_row_idx, [pval for pval, _ in pvals]]
+        some_pvalues = _create_top_pvalues_table(
+            trait_hits["top_hits"], csv_columns, gene_index=gene_index
+        )
         some_pvalues.to_csv(csv_path)
 
+        trait_hits = hits.merge_trait_hits({trait: trait_hits})
+        if gene_index is not None:
+            trait_hits = annotation.annotate_hits(trait_hits, gene_index)
+        trait_hits_path = trait_out_dir / f"{out_base_name}_{trait}_hits.csv"
+        trait_hits.to_csv(trait_hits_path, index=False)
+        summary = {
+            "status": "done",
+            "min_pval": gwas_result.get_min_pvalue("pval"),
+            "n_significant_variants": int(
+                gwas_result.select_under_threshold(hits_pval_threshold).shape[0]
+            ),
+        }
+        run_manifest.mark_done(
+            trait, fingerprint, summary=summary, hits_path=trait_hits_path
+        )
+
+    # finished traits from previous runs contribute through their hit files
+    trait_hits_paths = []
+    for trait in traits:
+        outputs = run_manifest.get_record(trait)["outputs"]
+        if "hits_path" in outputs:
+            trait_hits_paths.append(outputs["hits_path"])
+    genome_wide_hits = hits.concat_hits_files(trait_hits_paths)
+    genome_wide_hits.to_csv(
+        out_dir / f"{out_base_name}_genome_wide_hits.csv", index=False
+    )
+    run_manifest.create_summary(traits).to_csv(
+        out_dir / f"{out_base_name}_trait_summary.csv", index=False
+    )
+    run_manifest.save()
+
 
 def do_gwas_analysis(
     bfiles_base_path,
@@ -134,6 +491,26 @@ def do_gwas_analysis(
     covars_path=None,
     traits=None,
     desired_accs=None,
+    n_permutations=None,
+    n_pcs=None,
+    n_top_hits=100,
+    hits_pval_threshold=5e-8,
+    clump=False,
+    gff_path=None,
+    compress_outputs=False,
+    subset_cache_dir=None,
+    subset_variant_filters=None,
+    n_variant_ranges=1,
+    n_processes=None,
+    plink_adjust=True,
+    export_manhattan_tiles=False,
+    plots=True,
+    variant_filters=None,
+    logistic_engine="plink2",
+    conditional=False,
+    region_tests=None,
+    region_window_kb=50,
+    region_max_maf=0.01,
 ):
     return _do_gwas_analysis(
         bfiles_base_path,
@@ -145,6 +522,26 @@ def do_gwas_analysis(
         covars_path=covars_path,
         genome_fai_path=genome_fai_path,
         qualitative=qualitative,
+        n_permutations=n_permutations,
+        n_pcs=n_pcs,
+        n_top_hits=n_top_hits,
+        hits_pval_threshold=hits_pval_threshold,
+        clump=clump,
+        gff_path=gff_path,
+        compress_outputs=compress_outputs,
+        subset_cache_dir=subset_cache_dir,
+        subset_variant_filters=subset_variant_filters,
+        n_variant_ranges=n_variant_ranges,
+        n_processes=n_processes,
+        plink_adjust=plink_adjust,
+        export_manhattan_tiles=export_manhattan_tiles,
+        plots=plots,
+        variant_filters=variant_filters,
+        logistic_engine=logistic_engine,
+        conditional=conditional,
+        region_tests=region_tests,
+        region_window_kb=region_window_kb,
+        region_max_maf=region_max_maf,
     )
 
 
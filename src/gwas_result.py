@@ -0,0 +1,190 @@
+from pathlib import Path
+
+import numpy
+import pandas
+
+from src.bed import read_bim
+from src.manifest import fingerprint_bfiles
+
+# the p-values are kept as float32 -log10 values, float32 p-values would
+# underflow for the strongest associations
+STAT_COLS = ("pval_quantile",)
+
+_VARIANT_TABLES = {}
+
+
+def _get_chrom_code_dtype(n_chroms):
+    if n_chroms <= numpy.iinfo(numpy.int8).max:
+        return numpy.int8
+    return numpy.int16
+
+
+class VariantTable:
+    # the variants of a bfileset, shared by the results of all its traits
+    def __init__(self, chroms, poss, variant_ids):
+        chrom_names, chrom_codes = numpy.unique(
+            numpy.asarray(chroms, dtype=str), return_inverse=True
+        )
+        self.chrom_names = chrom_names
+        self.chrom_codes = chrom_codes.astype(_get_chrom_code_dtype(len(chrom_names)))
+        self.poss = numpy.asarray(poss, dtype=numpy.uint32)
+        self.variant_ids = numpy.char.encode(numpy.asarray(variant_ids, dtype=str))
+        if not (
+            self.chrom_codes.shape == self.poss.shape == self.variant_ids.shape
+        ):
+            raise ValueError("chroms, poss and variant_ids should have the same length")
+        self._sorted_id_idxs = None
+
+    @classmethod
+    def from_bfiles(cls, bfiles_base_path):
+        variants = read_bim(bfiles_base_path)
+        return cls(variants["chrom"].values, variants["pos"].values, variants["variant_id"].values)
+
+    @property
+    def n_variants(self):
+        return self.poss.shape[0]
+
+    def get_variant_idxs(self, variant_ids):
+        # a binary search over the sorted ids, a dict with millions of ids
+        # would use more memory than the table itself
+        if self._sorted_id_idxs is None:
+            self._sorted_id_idxs = numpy.argsort(self.variant_ids, kind="stable")
+        variant_ids = numpy.char.encode(numpy.asarray(variant_ids, dtype=str))
+        sorted_ids = self.variant_ids[self._sorted_id_idxs]
+        positions = numpy.searchsorted(sorted_ids, variant_ids)
+        positions = numpy.minimum(positions, self.n_variants - 1)
+        variant_idxs = self._sorted_id_idxs[positions]
+        if not numpy.array_equal(self.variant_ids[variant_idxs], variant_ids):
+            raise ValueError("Some variants are not in the bfileset")
+        return variant_idxs
+
+
+def get_variant_table(bfiles_base_path):
+    key = (str(Path(bfiles_base_path).resolve()), str(fingerprint_bfiles(bfiles_base_path)))
+    if key not in _VARIANT_TABLES:
+        _VARIANT_TABLES[key] = VariantTable.from_bfiles(bfiles_base_path)
+    return _VARIANT_TABLES[key]
+
+
+def _calc_log_pvalues(pvalues):
+    with numpy.errstate(divide="ignore"):
+        return (-numpy.log10(numpy.asarray(pvalues, dtype=float))).astype(numpy.float32)
+
+
+class GwasResult:
+    # the variants are kept in genome order, as indexes into the shared table
+    def __init__(self, variant_table, variant_idxs, log_pvalues, stats=None):
+        variant_idxs = numpy.asarray(variant_idxs, dtype=numpy.uint32)
+        order = numpy.lexsort(
+            (variant_table.poss[variant_idxs], variant_table.chrom_codes[variant_idxs])
+        )
+        self.variant_table = variant_table
+        self.variant_idxs = variant_idxs[order]
+        self._log_pvalues = {
+            col: numpy.asarray(values, dtype=numpy.float32)[order]
+            for col, values in log_pvalues.items()
+        }
+        self._stats = {
+            col: numpy.asarray(values, dtype=numpy.float32)[order]
+            for col, values in (stats or {}).items()
+        }
+
+    @classmethod
+    def from_pvalue_chunks(cls, variant_table, chunks, pvalue_cols, stat_cols=STAT_COLS):
+        # chunks are dataframes with a variant_id column, only the given
+        # p-value and statistic columns are kept, in their compact version
+        variant_idxs = []
+        log_pvalues = {}
+        stats = {}
+        for chunk in chunks:
+            chunk = chunk.loc[chunk["pval"].notna()]
+            variant_idxs.append(variant_table.get_variant_idxs(chunk["variant_id"].values))
+            for col in chunk.columns:
+                if col in stat_cols:
+                    stats.setdefault(col, []).append(
+                        chunk[col].values.astype(numpy.float32)
+                    )
+                elif col in pvalue_cols:
+                    log_pvalues.setdefault(col, []).append(
+                        _calc_log_pvalues(chunk[col].values)
+                    )
+        if not variant_idxs:
+            raise ValueError("No p-values to create the GWAS result")
+        return cls(
+            variant_table,
+            numpy.concatenate(variant_idxs),
+            {col: numpy.concatenate(values) for col, values in log_pvalues.items()},
+            {col: numpy.concatenate(values) for col, values in stats.items()},
+        )
+
+    @property
+    def n_variants(self):
+        return self.variant_idxs.shape[0]
+
+    @property
+    def pvalue_cols(self):
+        return list(self._log_pvalues)
+
+    @property
+    def chrom_codes(self):
+        return self.variant_table.chrom_codes[self.variant_idxs]
+
+    @property
+    def chroms(self):
+        return self.variant_table.chrom_names[self.chrom_codes]
+
+    @property
+    def poss(self):
+        return self.variant_table.poss[self.variant_idxs]
+
+    @property
+    def variant_ids(self):
+        return numpy.char.decode(self.variant_table.variant_ids[self.variant_idxs])
+
+    def get_log_pvalues(self, col="pval"):
+        return self._log_pvalues[col]
+
+    def get_pvalues(self, col="pval"):
+        return numpy.power(10.0, -self._log_pvalues[col].astype(float))
+
+    def get_stats(self, col):
+        return self._stats[col]
+
+    def with_pvalues(self, col, pvalues):
+        # the new result shares the variant arrays with this one
+        result = GwasResult.__new__(GwasResult)
+        result.variant_table = self.variant_table
+        result.variant_idxs = self.variant_idxs
+        result._log_pvalues = {**self._log_pvalues, col: _calc_log_pvalues(pvalues)}
+        result._stats = self._stats
+        return result
+
+    def get_min_pvalue(self, col="pval"):
+        return float(10.0 ** -numpy.nanmax(self._log_pvalues[col].astype(float)))
+
+    def select_under_threshold(self, pval_threshold, col="pval"):
+        return numpy.nonzero(self._log_pvalues[col] >= -numpy.log10(pval_threshold))[0]
+
+    def to_dframe(self, idxs=None, cols=None):
+        # only the requested rows are expanded to float64 and python strings
+        if idxs is None:
+            idxs = slice(None)
+        variant_idxs = self.variant_idxs[idxs]
+        table = self.variant_table
+        columns = {
+            "chrom": table.chrom_names[table.chrom_codes[variant_idxs]],
+            "pos": table.poss[variant_idxs],
+        }
+        for col in cols if cols is not None else self.pvalue_cols + list(self._stats):
+            if col in self._stats:
+                columns[col] = self._stats[col][idxs]
+            else:
+                columns[col] = numpy.power(
+                    10.0, -self._log_pvalues[col][idxs].astype(float)
+                )
+        return pandas.DataFrame(
+            columns,
+            index=pandas.Index(
+                numpy.char.decode(table.variant_ids[variant_idxs]), name="variant_id"
+            ),
+        )
@@ -0,0 +1,128 @@
+import numpy
+import pandas
+
+from src.plink import ADJUSTED_PVALUES_COL_MAPPING, open_plink_output
+
+
+def _select_top_k(dframe, k, pval_col):
+    if dframe.shape[0] <= k:
+        return dframe
+    idxs = numpy.argpartition(dframe[pval_col].values, k - 1)[:k]
+    return dframe.iloc[idxs]
+
+
+def _stream_trait_hits(chunks, k, pval_threshold, pval_col):
+    # only the current k best rows and the ones under the threshold are
+    # kept in memory, whatever the number of chunks
+    top_hits = None
+    significant_hits = []
+    for chunk in chunks:
+        chunk = chunk.loc[chunk[pval_col].notna()]
+        if pval_threshold is not None:
+            significant_hits.append(chunk.loc[chunk[pval_col] <= pval_threshold])
+        chunk_top_hits = _select_top_k(chunk, k, pval_col)
+        if top_hits is not None:
+            chunk_top_hits = pandas.concat([top_hits, chunk_top_hits])
+        top_hits = _select_top_k(chunk_top_hits, k, pval_col)
+
+    if top_hits is None:
+        return {"top_hits": None, "significant_hits": None}
+    if significant_hits:
+        significant_hits = pandas.concat(significant_hits)
+    else:
+        significant_hits = top_hits.iloc[:0]
+    return {"top_hits": top_hits, "significant_hits": significant_hits}
+
+
+def extract_trait_hits(
+    assoc_path,
+    k=100,
+    pval_threshold=None,
+    pval_col="pval",
+    col_mapping=ADJUSTED_PVALUES_COL_MAPPING,
+    chunk_size=500_000,
+):
+    # an association file written by plink2, or by a previous run, is read
+    # in chunks
+    with open_plink_output(assoc_path) as fhand:
+        chunks = (
+            chunk.rename(columns=col_mapping)
+            for chunk in pandas.read_csv(
+                fhand, sep=r"\s+", chunksize=chunk_size, dtype={"#CHROM": str, "ID": str}
+            )
+        )
+        hits = _stream_trait_hits(chunks, k, pval_threshold, pval_col)
+    if hits["top_hits"] is None:
+        return hits
+    return {
+        name: hits_dframe.sort_values(pval_col, kind="stable")
+        for name, hits_dframe in hits.items()
+    }
+
+
+def _iter_result_pvalue_chunks(gwas_result, pval_col, chunk_size):
+    log_pvalues = gwas_result.get_log_pvalues(pval_col)
+    for start in range(0, gwas_result.n_variants, chunk_size):
+        stop = min(start + chunk_size, gwas_result.n_variants)
+        yield pandas.DataFrame(
+            {
+                "result_idx": numpy.arange(start, stop),
+                pval_col: numpy.power(10.0, -log_pvalues[start:stop].astype(float)),
+            }
+        )
+
+
+def _expand_result_hits(gwas_result, hits_dframe, pval_col):
+    # genome order between equal p-values
+    result_idxs = hits_dframe["result_idx"].values
+    result_idxs = result_idxs[
+        numpy.lexsort((result_idxs, hits_dframe[pval_col].values))
+    ]
+    return gwas_result.to_dframe(result_idxs).reset_index()
+
+
+def extract_trait_hits_from_result(
+    gwas_result, k=100, pval_threshold=None, pval_col="pval", chunk_size=500_000
+):
+    # the selection streams over the compact p-values, only the selected rows
+    # are expanded with all their columns
+    hits = _stream_trait_hits(
+        _iter_result_pvalue_chunks(gwas_result, pval_col, chunk_size),
+        k,
+        pval_threshold,
+        pval_col,
+    )
+    if hits["top_hits"] is None:
+        return hits
+    return {
+        name: _expand_result_hits(gwas_result, hits_dframe, pval_col)
+        for name, hits_dframe in hits.items()
+    }
+
+
+def merge_trait_hits(hits_by_trait, pval_col="pval", id_col="variant_id"):
+    trait_tables = []
+    for trait, hits in hits_by_trait.items():
+        if hits["top_hits"] is None:
+            continue
+        top_hits = hits["top_hits"].assign(is_top_k=True)
+        significant_hits = hits["significant_hits"]
+        significant_hits = significant_hits.loc[
+            ~significant_hits[id_col].isin(top_hits[id_col])
+        ].assign(is_top_k=False)
+        trait_table = pandas.concat([top_hits, significant_hits])
+        trait_table.insert(0, "trait", trait)
+        trait_tables.append(trait_table)
+    if not trait_tables:
+        return pandas.DataFrame(columns=["trait", id_col, pval_col, "is_top_k"])
+    hits = pandas.concat(trait_tables, ignore_index=True)
+    return hits.sort_values(pval_col, kind="stable").reset_index(drop=True)
+
+
+def concat_hits_files(hits_paths, pval_col="pval"):
+    hits = [pandas.read_csv(path) for path in hits_paths]
+    hits = [trait_hits for trait_hits in hits if trait_hits.shape[0]]
+    if not hits:
+        return pandas.DataFrame(columns=["trait", "variant_id", pval_col, "is_top_k"])
+    hits = pandas.concat(hits, ignore_index=True)
+    return hits.sort_values(pval_col, kind="stable").reset_index(drop=True)
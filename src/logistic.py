@@ -0,0 +1,169 @@
+import numpy
+
+from src.bed import impute_missing_with_mean
+
+MAX_ABS_BETA = 15
+MAX_FIRTH_STEP = 5
+
+
+def _expit(eta):
+    return 0.5 * (1 + numpy.tanh(0.5 * eta))
+
+
+def create_null_design(n_samples, covars=None):
+    design = numpy.ones((n_samples, 1))
+    if covars is not None:
+        design = numpy.column_stack([design, numpy.asarray(covars, dtype=float)])
+    return design
+
+
+def fit_null_logistic(phenotypes, design, max_iter=50, tol=1e-8):
+    # covariates only model, its coefficients are the starting point of
+    # every variant fit
+    betas = numpy.zeros(design.shape[1])
+    for _ in range(max_iter):
+        mus = _expit(design @ betas)
+        weights = mus * (1 - mus)
+        hessian = design.T @ (design * weights[:, None])
+        delta = numpy.linalg.solve(hessian, design.T @ (phenotypes - mus))
+        betas += delta
+        if numpy.abs(delta).max() < tol:
+            return betas
+    raise RuntimeError("The covariates only logistic model did not converge")
+
+
+def _build_hessians(design, genotypes, weights):
+    n_variants = genotypes.shape[1]
+    n_covars = design.shape[1]
+    hessians = numpy.empty((n_variants, n_covars + 1, n_covars + 1))
+    hessians[:, :n_covars, :n_covars] = numpy.einsum(
+        "ni,nj,nm->mij", design, design, weights, optimize=True
+    )
+    covar_genotype = (weights * genotypes).T @ design
+    hessians[:, :n_covars, n_covars] = covar_genotype
+    hessians[:, n_covars, :n_covars] = covar_genotype
+    hessians[:, n_covars, n_covars] = (weights * genotypes * genotypes).sum(axis=0)
+    return hessians
+
+
+def _fit_logistic_batch(phenotypes, design, genotypes, null_betas, max_iter, tol):
+    # IRLS for all the variants of the block at once, every variant has its
+    # own (covariates + genotype) model. Converged variants are left out of
+    # the following iterations
+    n_variants = genotypes.shape[1]
+    n_covars = design.shape[1]
+    betas = numpy.zeros((n_variants, n_covars + 1))
+    betas[:, :n_covars] = null_betas
+    failed = numpy.zeros(n_variants, dtype=bool)
+    active = numpy.arange(n_variants)
+    for _ in range(max_iter):
+        if not active.shape[0]:
+            break
+        active_genotypes = genotypes[:, active]
+        etas = (
+            design @ betas[active, :n_covars].T + active_genotypes * betas[active, -1]
+        )
+        mus = _expit(etas)
+        hessians = _build_hessians(design, active_genotypes, mus * (1 - mus))
+        residuals = phenotypes[:, None] - mus
+        scores = numpy.column_stack(
+            [residuals.T @ design, (active_genotypes * residuals).sum(axis=0)]
+        )
+        try:
+            deltas = numpy.linalg.solve(hessians, scores[:, :, None])[:, :, 0]
+        except numpy.linalg.LinAlgError:
+            deltas = numpy.full(scores.shape, numpy.nan)
+            for idx in range(hessians.shape[0]):
+                try:
+                    deltas[idx] = numpy.linalg.solve(hessians[idx], scores[idx])
+                except numpy.linalg.LinAlgError:
+                    pass
+        betas[active] += deltas
+        is_bad = ~numpy.isfinite(deltas).all(axis=1) | (
+            numpy.abs(betas[active, -1]) > MAX_ABS_BETA
+        )
+        failed[active[is_bad]] = True
+        is_done = ~is_bad & (numpy.abs(deltas).max(axis=1) < tol)
+        active = active[~(is_bad | is_done)]
+    failed[active] = True
+
+    ok = numpy.nonzero(~failed)[0]
+    ses = numpy.full(n_variants, numpy.nan)
+    if ok.shape[0]:
+        genotypes_ok = genotypes[:, ok]
+        etas = design @ betas[ok, :n_covars].T + genotypes_ok * betas[ok, -1]
+        mus = _expit(etas)
+        hessians = _build_hessians(design, genotypes_ok, mus * (1 - mus))
+        with numpy.errstate(invalid="ignore"):
+            ses[ok] = numpy.sqrt(numpy.linalg.pinv(hessians)[:, -1, -1])
+    return {"betas": betas[:, -1], "ses": ses, "failed": failed}
+
+
+def fit_firth_logistic(phenotypes, design, max_iter=100, tol=1e-6):
+    # Firth penalized likelihood, finite estimates even under separation
+    betas = numpy.zeros(design.shape[1])
+    for _ in range(max_iter):
+        mus = _expit(design @ betas)
+        weights = mus * (1 - mus)
+        covariance = numpy.linalg.pinv(design.T @ (design * weights[:, None]))
+        leverages = weights * numpy.einsum("ij,jk,ik->i", design, covariance, design)
+        scores = design.T @ (phenotypes - mus + leverages * (0.5 - mus))
+        delta = covariance @ scores
+        max_delta = numpy.abs(delta).max()
+        if max_delta > MAX_FIRTH_STEP:
+            delta *= MAX_FIRTH_STEP / max_delta
+        betas += delta
+        if max_delta < tol:
+            break
+    mus = _expit(design @ betas)
+    covariance = numpy.linalg.pinv(design.T @ (design * (mus * (1 - mus))[:, None]))
+    return {"betas": betas, "covariance": covariance}
+
+
+def fit_logistic_block(phenotypes, design, genotypes, null_betas, max_iter=25, tol=1e-6):
+    # phenotypes are 0/1, genotypes a (samples x variants) dosage block
+    from scipy import stats
+
+    genotypes = impute_missing_with_mean(numpy.array(genotypes, dtype=float))
+    is_polymorphic = genotypes.std(axis=0) > 0
+    n_variants = genotypes.shape[1]
+    betas = numpy.full(n_variants, numpy.nan)
+    ses = numpy.full(n_variants, numpy.nan)
+    firth = numpy.zeros(n_variants, dtype=bool)
+
+    polymorphic_idxs = numpy.nonzero(is_polymorphic)[0]
+    res = _fit_logistic_batch(
+        phenotypes, design, genotypes[:, polymorphic_idxs], null_betas, max_iter, tol
+    )
+    betas[polymorphic_idxs] = res["betas"]
+    ses[polymorphic_idxs] = res["ses"]
+
+    # separated or non converged variants are fitted again with Firth
+    for idx in polymorphic_idxs[res["failed"]]:
+        firth_res = fit_firth_logistic(
+            phenotypes, numpy.column_stack([design, genotypes[:, idx]])
+        )
+        betas[idx] = firth_res["betas"][-1]
+        ses[idx] = numpy.sqrt(firth_res["covariance"][-1, -1])
+        firth[idx] = True
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        z_stats = betas / ses
+    pvalues = stats.chi2.sf(z_stats**2, 1)
+    return {
+        "betas": betas,
+        "ses": ses,
+        "z_stats": z_stats,
+        "pvalues": pvalues,
+        "firth": firth,
+    }
+
+
+def fit_logistic_task(genotypes, start, stop, task):
+    # entry point for the workers of a shared genotype block cache
+    return fit_logistic_block(
+        task["phenotypes"],
+        task["design"],
+        genotypes[task["sample_idxs"]],
+        task["null_betas"],
+    )
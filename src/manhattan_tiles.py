@@ -0,0 +1,367 @@
+import html
+import json
+import math
+import shutil
+from pathlib import Path
+
+import numpy
+
+TILE_N_BINS = 256
+TILES_DIR = "tiles"
+TILE_CALLBACK = "manhattanTile"
+VIEWER_FNAME = "index.html"
+
+# tiles are loaded with <script> tags instead of fetch so the viewer also
+# works when opened from the filesystem
+VIEWER_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { margin: 0; font-family: sans-serif; }
+#info { padding: 4px 8px; font-size: 13px; height: 1.4em; white-space: nowrap; }
+#plot { display: block; width: 100%; height: calc(100vh - 2em); cursor: grab; }
+</style>
+</head>
+<body>
+<div id="info"></div>
+<canvas id="plot"></canvas>
+<script>
+const META = __META__;
+const tiles = {};
+const availableTiles = META.tiles.map((tileIdxs) => new Set(tileIdxs));
+const canvas = document.getElementById("plot");
+const ctx = canvas.getContext("2d");
+const info = document.getElementById("info");
+const margin = {left: 50, right: 10, top: 10, bottom: 30};
+const chromColors = ["#1f4e99", "#6a9ad6"];
+let view = {x0: 0, x1: META.genome_size};
+let drawnPoints = [];
+let drawScheduled = false;
+
+function manhattanTile(tile) {
+  tiles[tile.level + "/" + tile.tile] = tile;
+  scheduleDraw();
+}
+
+function scheduleDraw() {
+  if (drawScheduled) return;
+  drawScheduled = true;
+  requestAnimationFrame(() => { drawScheduled = false; draw(); });
+}
+
+function plotWidth() { return canvas.width - margin.left - margin.right; }
+function plotHeight() { return canvas.height - margin.top - margin.bottom; }
+function toPxX(x) { return margin.left + (x - view.x0) * plotWidth() / (view.x1 - view.x0); }
+function toPxY(y) { return margin.top + plotHeight() * (1 - y / META.max_y); }
+function toGenomeX(px) { return view.x0 + (px - margin.left) * (view.x1 - view.x0) / plotWidth(); }
+
+function findChrom(x) {
+  let lo = 0, hi = META.chroms.length - 1;
+  while (lo < hi) {
+    const mid = (lo + hi + 1) >> 1;
+    if (META.chroms[mid][1] <= x) lo = mid; else hi = mid - 1;
+  }
+  return lo;
+}
+
+function chooseLevel() {
+  // the coarsest level with at least one bin per pixel
+  for (let level = 0; level < META.n_levels; level++) {
+    const binWidth = META.genome_size / (Math.pow(2, level) * META.tile_n_bins);
+    if ((view.x1 - view.x0) / binWidth >= plotWidth()) return level;
+  }
+  return META.n_levels - 1;
+}
+
+function getTile(level, tileIdx) {
+  const key = level + "/" + tileIdx;
+  if (key in tiles) return tiles[key];
+  if (!availableTiles[level].has(tileIdx)) {
+    tiles[key] = {level: level, tile: tileIdx, bins: [[], []], points: [[], [], []]};
+    return tiles[key];
+  }
+  tiles[key] = null;
+  const script = document.createElement("script");
+  script.src = META.tiles_dir + "/" + key + ".js";
+  script.onload = () => script.remove();
+  document.head.appendChild(script);
+  return null;
+}
+
+function drawTile(tile) {
+  const binWidth = META.genome_size / (Math.pow(2, tile.level) * META.tile_n_bins);
+  const tileStart = tile.tile * META.tile_n_bins * binWidth;
+  const [binIdxs, binMaxs] = tile.bins;
+  for (let i = 0; i < binIdxs.length; i++) {
+    const x = tileStart + (binIdxs[i] + 0.5) * binWidth;
+    ctx.fillStyle = chromColors[findChrom(x) % 2];
+    ctx.fillRect(toPxX(x) - 1, toPxY(binMaxs[i]) - 1, 2, 2);
+  }
+}
+
+function drawPoints(baseTile) {
+  // the points over the threshold are only in the base tile, they are
+  // drawn at every zoom level
+  const [xs, ys, labels] = baseTile.points;
+  ctx.fillStyle = "#c0392b";
+  for (let i = 0; i < xs.length; i++) {
+    if (xs[i] < view.x0 || xs[i] > view.x1) continue;
+    const px = toPxX(xs[i]), py = toPxY(ys[i]);
+    ctx.beginPath();
+    ctx.arc(px, py, 2.5, 0, 2 * Math.PI);
+    ctx.fill();
+    drawnPoints.push([px, py, labels[i], ys[i]]);
+  }
+}
+
+function drawAxes() {
+  ctx.strokeStyle = "#888";
+  ctx.fillStyle = "#333";
+  ctx.font = "11px sans-serif";
+  ctx.beginPath();
+  ctx.moveTo(margin.left, margin.top);
+  ctx.lineTo(margin.left, margin.top + plotHeight());
+  ctx.lineTo(margin.left + plotWidth(), margin.top + plotHeight());
+  ctx.stroke();
+  ctx.textAlign = "right";
+  ctx.textBaseline = "middle";
+  const yStep = Math.max(1, Math.ceil(META.max_y / 8));
+  for (let y = 0; y <= META.max_y; y += yStep) {
+    ctx.fillText(y, margin.left - 4, toPxY(y));
+  }
+  ctx.textAlign = "center";
+  ctx.textBaseline = "top";
+  for (const [name, start, end] of META.chroms) {
+    if (end < view.x0 || start > view.x1) continue;
+    const center = (Math.max(start, view.x0) + Math.min(end, view.x1)) / 2;
+    ctx.fillText(name, toPxX(center), margin.top + plotHeight() + 4);
+  }
+  if (META.point_threshold !== null) {
+    ctx.strokeStyle = "#bbb";
+    ctx.setLineDash([4, 4]);
+    ctx.beginPath();
+    ctx.moveTo(margin.left, toPxY(META.point_threshold));
+    ctx.lineTo(margin.left + plotWidth(), toPxY(META.point_threshold));
+    ctx.stroke();
+    ctx.setLineDash([]);
+  }
+}
+
+function draw() {
+  canvas.width = canvas.clientWidth;
+  canvas.height = canvas.clientHeight;
+  ctx.clearRect(0, 0, canvas.width, canvas.height);
+  ctx.save();
+  ctx.beginPath();
+  ctx.rect(margin.left, margin.top, plotWidth(), plotHeight());
+  ctx.clip();
+  const level = chooseLevel();
+  const tileWidth = META.genome_size / Math.pow(2, level);
+  const firstTile = Math.max(0, Math.floor(view.x0 / tileWidth));
+  const lastTile = Math.min(Math.pow(2, level) - 1, Math.floor(view.x1 / tileWidth));
+  const drawn = new Set();
+  drawnPoints = [];
+  for (let tileIdx = firstTile; tileIdx <= lastTile; tileIdx++) {
+    // while a tile loads its already loaded parent is drawn instead
+    let tileLevel = level;
+    let tile = getTile(level, tileIdx);
+    while (!tile && tileLevel > 0) {
+      tileLevel--;
+      tile = tiles[tileLevel + "/" + (tileIdx >> (level - tileLevel))];
+    }
+    if (!tile) continue;
+    const key = tile.level + "/" + tile.tile;
+    if (drawn.has(key)) continue;
+    drawn.add(key);
+    drawTile(tile);
+  }
+  const baseTile = getTile(0, 0);
+  if (baseTile) drawPoints(baseTile);
+  ctx.restore();
+  drawAxes();
+}
+
+function clampView(x0, x1) {
+  const minSpan = META.genome_size / (Math.pow(2, META.n_levels) * META.tile_n_bins);
+  let span = Math.min(Math.max(x1 - x0, minSpan), META.genome_size);
+  x0 = Math.min(Math.max(x0, 0), META.genome_size - span);
+  return {x0: x0, x1: x0 + span};
+}
+
+canvas.addEventListener("wheel", (event) => {
+  event.preventDefault();
+  const x = toGenomeX(event.offsetX);
+  const factor = event.deltaY < 0 ? 0.7 : 1 / 0.7;
+  view = clampView(x - (x - view.x0) * factor, x + (view.x1 - x) * factor);
+  scheduleDraw();
+}, {passive: false});
+
+let dragStart = null;
+canvas.addEventListener("mousedown", (event) => {
+  dragStart = {px: event.offsetX, view: view};
+  canvas.style.cursor = "grabbing";
+});
+window.addEventListener("mouseup", () => { dragStart = null; canvas.style.cursor = "grab"; });
+canvas.addEventListener("mousemove", (event) => {
+  if (dragStart) {
+    const shift = (event.offsetX - dragStart.px) * (dragStart.view.x1 - dragStart.view.x0) / plotWidth();
+    view = clampView(dragStart.view.x0 - shift, dragStart.view.x1 - shift);
+    scheduleDraw();
+    return;
+  }
+  let nearest = null, nearestDist = 36;
+  for (const point of drawnPoints) {
+    const dist = (point[0] - event.offsetX) ** 2 + (point[1] - event.offsetY) ** 2;
+    if (dist < nearestDist) { nearest = point; nearestDist = dist; }
+  }
+  if (nearest) {
+    info.textContent = nearest[2] + "  -log10(p) = " + nearest[3];
+  } else {
+    const x = toGenomeX(event.offsetX);
+    const [name, start] = META.chroms[findChrom(x)];
+    info.textContent = META.title + "  " + name + ":" + Math.round(x - start + 1);
+  }
+});
+canvas.addEventListener("dblclick", () => { view = {x0: 0, x1: META.genome_size}; scheduleDraw(); });
+window.addEventListener("resize", scheduleDraw);
+info.textContent = META.title;
+scheduleDraw();
+</script>
+</body>
+</html>
+"""
+
+
+def calc_genome_xs(chroms, poss, coord_converter):
+    chroms = numpy.asarray(chroms)
+    poss = numpy.asarray(poss, dtype=numpy.int64)
+    genome_xs = numpy.empty(poss.shape[0], dtype=numpy.int64)
+    for chrom in numpy.unique(chroms):
+        mask = chroms == chrom
+        genome_xs[mask] = coord_converter.transform_coordinate(str(chrom), poss[mask])
+    return genome_xs
+
+
+def _calc_n_levels(genome_size, tile_n_bins, min_bin_width):
+    n_deepest_tiles = genome_size / (tile_n_bins * min_bin_width)
+    return max(int(math.ceil(math.log2(max(n_deepest_tiles, 1)))), 0) + 1
+
+
+def _calc_bin_maxs(bin_idxs, values):
+    # bin_idxs are sorted, so every bin is a contiguous run of values
+    bins, first_idxs = numpy.unique(bin_idxs, return_index=True)
+    return bins, numpy.maximum.reduceat(values, first_idxs)
+
+
+def _split_by_tile(tile_idxs):
+    tiles, first_idxs = numpy.unique(tile_idxs, return_index=True)
+    last_idxs = numpy.r_[first_idxs[1:], tile_idxs.shape[0]]
+    return zip(tiles, first_idxs, last_idxs)
+
+
+def _dump_script_json(value):
+    # a name with </script> would close the inline script of the viewer
+    serialized = json.dumps(value)
+    for char, escaped in (("&", "\\u0026"), ("<", "\\u003c"), (">", "\\u003e")):
+        serialized = serialized.replace(char, escaped)
+    return serialized
+
+
+def _write_tile(tiles_dir, level, tile_idx, tile):
+    tile_path = tiles_dir / str(level) / f"{tile_idx}.js"
+    with tile_path.open("wt") as fhand:
+        fhand.write(f"{TILE_CALLBACK}(")
+        json.dump(tile, fhand, separators=(",", ":"))
+        fhand.write(");\n")
+
+
+def create_manhattan_tiles(
+    log_pvalues,
+    genome_xs,
+    out_dir,
+    chrom_spans,
+    labels=None,
+    point_threshold=3,
+    tile_n_bins=TILE_N_BINS,
+    min_bin_width=1000,
+    title="",
+):
+    log_pvalues = numpy.asarray(log_pvalues, dtype=float)
+    genome_xs = numpy.asarray(genome_xs, dtype=numpy.int64)
+    is_finite = numpy.isfinite(log_pvalues)
+    log_pvalues = log_pvalues[is_finite]
+    genome_xs = genome_xs[is_finite]
+    if labels is not None:
+        labels = numpy.asarray(labels, dtype=str)[is_finite]
+
+    order = numpy.argsort(genome_xs, kind="stable")
+    genome_xs = genome_xs[order]
+    log_pvalues = numpy.round(log_pvalues[order], 3)
+    if labels is not None:
+        labels = labels[order]
+
+    genome_size = max(span[1] for span in chrom_spans.values())
+    n_levels = _calc_n_levels(genome_size, tile_n_bins, min_bin_width)
+
+    is_point = log_pvalues >= point_threshold
+    point_xs = genome_xs[is_point]
+    point_ys = log_pvalues[is_point]
+    if labels is None:
+        point_labels = point_xs.astype(str)
+    else:
+        point_labels = labels[is_point]
+
+    out_dir = Path(out_dir)
+    tiles_dir = out_dir / TILES_DIR
+    if tiles_dir.exists():
+        shutil.rmtree(tiles_dir)
+
+    tile_idxs_by_level = []
+    for level in range(n_levels):
+        (tiles_dir / str(level)).mkdir(parents=True)
+        n_tiles = 2**level
+        n_bins = n_tiles * tile_n_bins
+        bin_idxs = numpy.minimum(genome_xs * n_bins // genome_size, n_bins - 1)
+        bins, bin_maxs = _calc_bin_maxs(bin_idxs, log_pvalues)
+
+        level_tile_idxs = []
+        for tile_idx, start, stop in _split_by_tile(bins // tile_n_bins):
+            tile = {
+                "level": level,
+                "tile": int(tile_idx),
+                "bins": [
+                    (bins[start:stop] % tile_n_bins).tolist(),
+                    bin_maxs[start:stop].tolist(),
+                ],
+            }
+            # the points are written once, in the single base level tile
+            if level == 0:
+                tile["points"] = [
+                    point_xs.tolist(),
+                    point_ys.tolist(),
+                    point_labels.tolist(),
+                ]
+            _write_tile(tiles_dir, level, tile_idx, tile)
+            level_tile_idxs.append(int(tile_idx))
+        tile_idxs_by_level.append(level_tile_idxs)
+
+    max_y = float(log_pvalues.max()) if log_pvalues.shape[0] else 1.0
+    chroms = sorted(chrom_spans.items(), key=lambda item: item[1][0])
+    meta = {
+        "title": title,
+        "genome_size": int(genome_size),
+        "n_levels": n_levels,
+        "tile_n_bins": tile_n_bins,
+        "tiles_dir": TILES_DIR,
+        "tiles": tile_idxs_by_level,
+        "chroms": [[chrom, int(start), int(end)] for chrom, (start, end) in chroms],
+        "max_y": math.ceil(max(max_y, point_threshold) * 1.05),
+        "point_threshold": point_threshold,
+    }
+    viewer_html = VIEWER_TEMPLATE.replace("__META__", _dump_script_json(meta))
+    viewer_html = viewer_html.replace("__TITLE__", html.escape(title))
+    html_path = out_dir / VIEWER_FNAME
+    html_path.write_text(viewer_html)
+    return {"html_path": html_path, "n_levels": n_levels}
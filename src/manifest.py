@@ -0,0 +1,103 @@
+import hashlib
+import json
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import pandas
+
+BFILES_SUFFIXES = (".bed", ".bim", ".fam")
+
+
+def fingerprint_bfiles(bfiles_base_path):
+    # size and modification time are enough to detect a rewritten bfileset
+    # without reading the whole .bed
+    fingerprint = []
+    for suffix in BFILES_SUFFIXES:
+        stat = Path(str(bfiles_base_path) + suffix).stat()
+        fingerprint.append([suffix, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def fingerprint_file(path):
+    hasher = hashlib.sha1()
+    with Path(path).open("rb") as fhand:
+        for block in iter(lambda: fhand.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def fingerprint_phenotypes(phenotypes):
+    hasher = hashlib.sha1()
+    hasher.update("\t".join(map(str, phenotypes.index)).encode())
+    hasher.update(phenotypes.values.astype(float).tobytes())
+    return hasher.hexdigest()
+
+
+def create_trait_fingerprint(
+    bfiles_base_path, phenotypes, covars_path=None, keep_path=None, options=None
+):
+    fingerprint = {
+        "bfiles": fingerprint_bfiles(bfiles_base_path),
+        "phenotypes": fingerprint_phenotypes(phenotypes),
+        "covars": fingerprint_file(covars_path) if covars_path else None,
+        "keep": fingerprint_file(keep_path) if keep_path else None,
+        "options": options if options is not None else {},
+    }
+    serialized = json.dumps(fingerprint, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode()).hexdigest()
+
+
+class RunManifest:
+    def __init__(self, manifest_path):
+        self.manifest_path = Path(manifest_path)
+        if self.manifest_path.exists():
+            with self.manifest_path.open("rt") as fhand:
+                self._traits = json.load(fhand)["traits"]
+        else:
+            self._traits = {}
+
+    def is_done(self, trait, fingerprint):
+        record = self._traits.get(trait)
+        return record is not None and record["fingerprint"] == fingerprint
+
+    def get_record(self, trait):
+        return self._traits[trait]
+
+    def mark_done(self, trait, fingerprint, summary=None, **outputs):
+        self._traits[trait] = {
+            "fingerprint": fingerprint,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "outputs": {key: str(value) for key, value in outputs.items()},
+            "summary": summary if summary is not None else {},
+        }
+        self._write()
+
+    def create_summary(self, traits=None):
+        if traits is None:
+            traits = sorted(self._traits)
+        rows = []
+        for trait in traits:
+            record = self._traits[trait]
+            rows.append({"trait": trait, "finished": record["finished"], **record.get("summary", {})})
+        if not rows:
+            return pandas.DataFrame(columns=["trait", "finished"])
+        return pandas.DataFrame(rows)
+
+    def save(self):
+        # a run that finishes without any trait done still leaves its manifest
+        self._write()
+
+    def _write(self):
+        # write and rename so a crash never leaves a truncated manifest
+        tmp_path = Path(str(self.manifest_path) + ".tmp")
+        with tmp_path.open("wt") as fhand:
+            json.dump({"traits": self._traits}, fhand, indent=2, sort_keys=True)
+        tmp_path.replace(self.manifest_path)
+
+
+def remove_partial_trait_dir(trait_out_dir):
+    trait_out_dir = Path(trait_out_dir)
+    if trait_out_dir.exists():
+        print(f"Removing unfinished results: {trait_out_dir}")
+        shutil.rmtree(trait_out_dir)
@@ -0,0 +1,90 @@
+import numpy
+
+ADJUSTED_PVALUE_COLUMNS = (
+    "genomic_control_corrected_pval",
+    "pval_quantile",
+    "bonferroni_pval",
+    "holm_bonferroni_pval",
+    "sidak_single_step_pval",
+    "sidak_step_down_pval",
+    "benjamini_hochberg_pval",
+    "benjamini_yekutieli_pval",
+)
+
+
+# scipy.stats is imported on first use, this module is loaded by every CLI
+# through src.plink
+
+
+def _calc_genomic_inflation_from_chisqs(chisqs):
+    from scipy import stats
+
+    return numpy.median(chisqs) / stats.chi2.median(1)
+
+
+def calc_genomic_inflation(pvalues):
+    from scipy import stats
+
+    return _calc_genomic_inflation_from_chisqs(stats.chi2.isf(pvalues, 1))
+
+
+def calc_genomic_control_pvalues(pvalues):
+    from scipy import stats
+
+    chisqs = stats.chi2.isf(pvalues, 1)
+    # as plink, deflation is never applied
+    genomic_inflation = max(_calc_genomic_inflation_from_chisqs(chisqs), 1)
+    return stats.chi2.sf(chisqs / genomic_inflation, 1)
+
+
+def _adjust_tested_pvalues(pvalues):
+    # every step-wise correction is computed over the same sort and the
+    # results are scattered back to the input order
+    n_tests = pvalues.shape[0]
+    if not n_tests:
+        return {col: numpy.array([], dtype=float) for col in ADJUSTED_PVALUE_COLUMNS}
+    order = numpy.argsort(pvalues, kind="stable")
+    sorted_pvalues = pvalues[order]
+    ranks = numpy.arange(1, n_tests + 1)
+    n_remaining = n_tests - ranks + 1
+
+    sorted_adjusted = {
+        "pval_quantile": (ranks - 0.5) / n_tests,
+        "holm_bonferroni_pval": numpy.minimum(
+            numpy.maximum.accumulate(sorted_pvalues * n_remaining), 1
+        ),
+        "sidak_step_down_pval": numpy.maximum.accumulate(
+            -numpy.expm1(n_remaining * numpy.log1p(-sorted_pvalues))
+        ),
+    }
+    fdr_bh = numpy.minimum.accumulate((sorted_pvalues * n_tests / ranks)[::-1])[::-1]
+    sorted_adjusted["benjamini_hochberg_pval"] = numpy.minimum(fdr_bh, 1)
+    sorted_adjusted["benjamini_yekutieli_pval"] = numpy.minimum(
+        fdr_bh * (1 / ranks).sum(), 1
+    )
+
+    adjusted = {}
+    for col, sorted_values in sorted_adjusted.items():
+        values = numpy.empty(n_tests)
+        values[order] = sorted_values
+        adjusted[col] = values
+    adjusted["genomic_control_corrected_pval"] = calc_genomic_control_pvalues(pvalues)
+    adjusted["bonferroni_pval"] = numpy.minimum(pvalues * n_tests, 1)
+    adjusted["sidak_single_step_pval"] = -numpy.expm1(
+        n_tests * numpy.log1p(-pvalues)
+    )
+    return {col: adjusted[col] for col in ADJUSTED_PVALUE_COLUMNS}
+
+
+def adjust_pvalues(pvalues):
+    # the missing p-values are not tests, as in plink2 they do not count for
+    # the corrections and they stay missing
+    pvalues = numpy.asarray(pvalues, dtype=float)
+    is_tested = ~numpy.isnan(pvalues)
+    tested_adjusted = _adjust_tested_pvalues(pvalues[is_tested])
+    adjusted = {}
+    for col in ADJUSTED_PVALUE_COLUMNS:
+        values = numpy.full(pvalues.shape[0], numpy.nan)
+        values[is_tested] = tested_adjusted[col]
+        adjusted[col] = values
+    return adjusted
@@ -1,8 +1,20 @@
-from sklearn.preprocessing import power_transform, quantile_transform
-from pandas import Series, DataFrame
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import numpy
+
+
+# scipy, scikit-learn and pandas are imported where they are used, so the
+# CLIs can import this module at startup without paying for them
 
 
 def _normalize_series_boxcox(series, method):
+    from pandas import Series
+    from sklearn.preprocessing import power_transform
+
     normed_values = power_transform(series.values.reshape(-1, 1), method=method)
     return Series(normed_values.flat, index=series.index)
 
@@ -13,6 +25,9 @@ def normalize_series(series, method="yeo-johnson"):
 
 
 def normalize_dframe(dframe, method):
+    from pandas import DataFrame
+    from sklearn.preprocessing import power_transform
+
     return DataFrame(
         power_transform(dframe, method=method),
         index=dframe.index,
@@ -21,12 +36,115 @@ def normalize_dframe(dframe, method):
 
 
 def quantile_transform_series(series, n_quantiles):
+    from sklearn.preprocessing import quantile_transform
+
     return quantile_transform(series.values.reshape(-1, 1), n_quantiles=n_quantiles)
 
 
 def quantile_transform_dframe(dframe, n_quantiles):
+    from pandas import DataFrame
+    from sklearn.preprocessing import quantile_transform
+
     return DataFrame(
         quantile_transform(dframe, n_quantiles=n_quantiles),
         index=dframe.index,
         columns=dframe.columns,
-    )
\ No newline at end of file
+    )
+
+
+NORMALIZATION_METHODS = ("yeo-johnson", "box-cox", "quantile", "rank-inverse-normal")
+
+
+def rank_inverse_normal_transform(values, offset=3 / 8):
+    from scipy.stats import norm, rankdata
+
+    ranks = rankdata(values)
+    return norm.ppf((ranks - offset) / (values.shape[0] - 2 * offset + 1))
+
+
+def _normalize_values(values, method, n_quantiles):
+    if method == "rank-inverse-normal":
+        return rank_inverse_normal_transform(values)
+    from sklearn.preprocessing import power_transform, quantile_transform
+
+    values = values.reshape(-1, 1)
+    if method in ("box-cox", "yeo-johnson"):
+        normed_values = power_transform(values, method=method)
+    elif method == "quantile":
+        normed_values = quantile_transform(
+            values, n_quantiles=min(n_quantiles, values.shape[0])
+        )
+    else:
+        raise ValueError(f"Unknown normalization method: {method}")
+    return normed_values[:, 0]
+
+
+def _normalize_trait_values(values, method, n_quantiles):
+    # every trait is transformed using only its own non missing samples
+    normed_values = numpy.full(values.shape[0], numpy.nan)
+    is_present = ~numpy.isnan(values)
+    if is_present.any():
+        normed_values[is_present] = _normalize_values(
+            values[is_present], method, n_quantiles
+        )
+    return normed_values
+
+
+def _get_trait_cache_path(cache_dir, sample_names, values, method, n_quantiles):
+    hasher = hashlib.sha1()
+    hasher.update(f"{method}\t{n_quantiles}\n".encode())
+    hasher.update("\t".join(map(str, sample_names)).encode())
+    hasher.update(values.astype(float).tobytes())
+    return cache_dir / f"{hasher.hexdigest()}.npy"
+
+
+def normalize_traits(
+    dframe,
+    method,
+    traits=None,
+    n_quantiles=10,
+    n_workers=1,
+    cache_dir=None,
+    sample_col="SAMPLE_NAME",
+):
+    if method not in NORMALIZATION_METHODS:
+        raise ValueError(f"Unknown normalization method: {method}")
+    if traits is None:
+        traits = list(dframe.select_dtypes("number").columns)
+    sample_names = dframe[sample_col] if sample_col in dframe else dframe.index
+
+    normed_dframe = dframe.copy()
+    if cache_dir is not None:
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(exist_ok=True, parents=True)
+
+    traits_to_normalize = []
+    cache_paths = {}
+    for trait in traits:
+        if cache_dir is not None:
+            cache_path = _get_trait_cache_path(
+                cache_dir, sample_names, dframe[trait].values, method, n_quantiles
+            )
+            cache_paths[trait] = cache_path
+            if cache_path.exists():
+                normed_dframe[trait] = numpy.load(cache_path)
+                continue
+        traits_to_normalize.append(trait)
+
+    values = [dframe[trait].values.astype(float) for trait in traits_to_normalize]
+    normalize = partial(_normalize_trait_values, method=method, n_quantiles=n_quantiles)
+    if n_workers > 1 and len(traits_to_normalize) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            normed_values = list(executor.map(normalize, values, chunksize=8))
+    else:
+        normed_values = list(map(normalize, values))
+
+    for trait, trait_normed_values in zip(traits_to_normalize, normed_values):
+        normed_dframe[trait] = trait_normed_values
+        if cache_dir is not None:
+            # shards running at once share the cache, the rename is atomic
+            tmp_path = Path(f"{cache_paths[trait]}.{os.getpid()}.tmp")
+            with tmp_path.open("wb") as fhand:
+                numpy.save(fhand, trait_normed_values)
+            tmp_path.replace(cache_paths[trait])
+    return normed_dframe
@@ -0,0 +1,105 @@
+import numpy
+import pandas
+
+from src import association
+from src.bed import BedReader
+from src.gwas_result import GwasResult
+from src.plink import read_covars
+
+DEFAULT_FWER_ALPHAS = (0.05, 0.01)
+
+
+def _create_permuted_phenotypes(phenotypes, n_permutations, rng):
+    phenotypes = numpy.repeat(phenotypes[:, None], n_permutations, axis=1)
+    return rng.permuted(phenotypes, axis=0)
+
+
+def calc_permutation_min_pvalues(
+    bfiles_base_path,
+    phenotypes: pandas.Series,
+    n_permutations=1000,
+    covars_path=None,
+    block_size=2000,
+    seed=None,
+):
+    bed_reader = BedReader(bfiles_base_path)
+    phenotypes = phenotypes.dropna()
+    phenotypes = phenotypes.loc[phenotypes.index.isin(bed_reader.samples["iid"])]
+
+    covars = None
+    if covars_path:
+        covars = read_covars(covars_path)
+        phenotypes = phenotypes.loc[phenotypes.index.isin(covars.index)]
+        covars = covars.loc[phenotypes.index].values
+    sample_idxs = bed_reader.get_sample_idxs(phenotypes.index)
+
+    covariate_basis = association.create_covariate_basis(
+        phenotypes.shape[0], covars=covars
+    )
+    # null model residuals are permuted and projected again so that every
+    # permutation keeps the covariates out of the score
+    residuals = association.residualize(
+        phenotypes.values.astype(float)[:, None], covariate_basis
+    )[:, 0]
+    rng = numpy.random.default_rng(seed)
+    permuted = _create_permuted_phenotypes(residuals, n_permutations, rng)
+    permuted = association.prepare_phenotypes_for_scoring(permuted, covariate_basis)
+    permuted = permuted.astype(numpy.float32)
+
+    max_abs_correlations = numpy.zeros(n_permutations, dtype=numpy.float32)
+    for block in bed_reader.iterate_blocks(block_size, sample_idxs=sample_idxs):
+        genotypes = association.prepare_genotypes_for_scoring(
+            block["genotypes"], covariate_basis
+        )
+        correlations = genotypes.T @ permuted
+        numpy.maximum(
+            max_abs_correlations,
+            numpy.abs(correlations).max(axis=0),
+            out=max_abs_correlations,
+        )
+
+    dof = phenotypes.shape[0] - covariate_basis.shape[1] - 1
+    return association.correlations_to_pvalues(max_abs_correlations, dof)
+
+
+def calc_empirical_thresholds(min_pvalues, alphas=DEFAULT_FWER_ALPHAS):
+    return pandas.Series(
+        [numpy.quantile(min_pvalues, alpha) for alpha in alphas],
+        index=pandas.Index(alphas, name="fwer_alpha"),
+        name="pval_threshold",
+    )
+
+
+def calc_empirical_fwer_pvalues(pvalues, min_pvalues):
+    sorted_min_pvalues = numpy.sort(min_pvalues)
+    n_more_extreme = numpy.searchsorted(sorted_min_pvalues, pvalues, side="right")
+    return (n_more_extreme + 1) / (sorted_min_pvalues.shape[0] + 1)
+
+
+def do_permutation_test(
+    bfiles_base_path,
+    phenotypes: pandas.Series,
+    gwas_result: GwasResult,
+    n_permutations=1000,
+    covars_path=None,
+    block_size=2000,
+    seed=None,
+    alphas=DEFAULT_FWER_ALPHAS,
+):
+    min_pvalues = calc_permutation_min_pvalues(
+        bfiles_base_path,
+        phenotypes,
+        n_permutations=n_permutations,
+        covars_path=covars_path,
+        block_size=block_size,
+        seed=seed,
+    )
+    gwas_result = gwas_result.with_pvalues(
+        "permutation_fwer_pval",
+        calc_empirical_fwer_pvalues(gwas_result.get_pvalues("pval"), min_pvalues),
+    )
+    return {
+        "gwas_result": gwas_result,
+        "empirical_thresholds": calc_empirical_thresholds(min_pvalues, alphas=alphas),
+        "permutation_min_pvalues": min_pvalues,
+    }
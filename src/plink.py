@@ -1,12 +1,29 @@
 from __future__ import annotations
+import hashlib
+import io
+import json
 import os
 import subprocess
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
+import numpy
 import pandas
 
+from src import genotype_cache
+from src import logistic
+from src import multiple_testing
+from src import progress
+from src.manifest import fingerprint_bfiles, fingerprint_file
+from src.bed import BedReader, read_bim, read_fam
 from src.config import EXECUTABLES_REQUIREMENTS as exec_recs
 from src.dependencies import get_executables
+from src.gwas_result import GwasResult, get_variant_table
+
+
+GENO_MAX_MISSING_RATE = 0.1
 
 
 class VariantFilters:
@@ -28,37 +45,82 @@ class VariantFilters:
         if self.max_major_freq is not None:
             args.extend(["--maf", str(self.max_major_freq)])
         if self.max_missing_rate is not None:
-            args.extend(["--geno", "0.1"])
+            args.extend(["--geno", str(GENO_MAX_MISSING_RATE)])
         if self.lists_of_vars_to_keep_paths:
             args.append("--extract")
             args.extend(map(str, self.lists_of_vars_to_keep_paths))
         return args
 
+    def get_qc_thresholds(self):
+        # the thresholds of the --maf and --geno flags
+        return {
+            "min_maf": self.max_major_freq,
+            "max_missing_rate": (
+                GENO_MAX_MISSING_RATE if self.max_missing_rate is not None else None
+            ),
+        }
+
 
-def create_plink_bcfile(vcf_path, base_path):
+def create_plink_bcfile(vcf_path, base_path, progress_callback=None):
     cmd = [get_executables(exec_recs["plink2"])]
     cmd.extend(['--vcf', str(vcf_path)])
     cmd.extend(['--out', str(base_path)])
     cmd.extend(['--allow-extra-chr', '--double-id', '--vcf-half-call', 'missing',
                 '--set-missing-var-ids', '@:# ', '--make-bed'])
     stderr_path = Path(str(base_path) + '.bfiles.stderr')
-    stdout_path = Path(str(base_path) + '.bfiles.stderr')
+    stdout_path = Path(str(base_path) + '.bfiles.stdout')
 
     print('Running: ', ' '.join(cmd))
-    subprocess.run(cmd, stdout=stdout_path.open('wt'),
-                   stderr=stderr_path.open('wt'), check=True)
+    run_cmd(cmd, stdout_path, stderr_path, progress_callback=progress_callback)
 
-def run_cmd(cmd, stdout_path, stderr_path):
-    stdout_fhand = stdout_path.open("wt")
-    stderr_fhand = stderr_path.open("wt")
+def open_plink_output(path):
+    path = Path(path)
+    if path.suffix != ".zst":
+        return path.open("rt")
     try:
-        subprocess.run(
-            cmd,
-            stdout=stdout_fhand,
-            stderr=stderr_fhand,
-            check=True,
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstandard is required to read compressed plink2 outputs")
+    # the file is decompressed as it is read, never fully in memory
+    stream = zstandard.ZstdDecompressor().stream_reader(path.open("rb"), closefd=True)
+    return io.TextIOWrapper(stream)
+
+
+def run_cmd(cmd, stdout_path, stderr_path, progress_callback=None):
+    # the stdout is copied to its file as it arrives and its progress lines
+    # are parsed on the fly
+    if progress_callback is None:
+        progress_callback = progress.get_default_progress_callback()
+    parser = None
+    if progress_callback is not None:
+        parser = progress.PlinkProgressParser(
+            progress_callback, source=Path(stdout_path).stem
         )
-    except subprocess.CalledProcessError:
+    stdout_fhand = stdout_path.open("wb")
+    stderr_fhand = stderr_path.open("wt")
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_fhand)
+    try:
+        while True:
+            chunk = os.read(process.stdout.fileno(), 65536)
+            if not chunk:
+                break
+            stdout_fhand.write(chunk)
+            stdout_fhand.flush()
+            if parser is not None:
+                parser.feed(chunk)
+        if parser is not None:
+            parser.close()
+        returncode = process.wait()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        process.stdout.close()
+        stderr_fhand.close()
+        stdout_fhand.close()
+
+    if returncode:
         print("stdout")
         stdout_fhand = stdout_path.open("rt")
         print(stdout_fhand.read())
@@ -67,9 +129,203 @@ def run_cmd(cmd, stdout_path, stderr_path):
         stderr_fhand = stderr_path.open("rt")
         print(stderr_fhand.read())
         stderr_fhand.close()
-        raise
-    stderr_fhand.close()
-    stdout_fhand.close()
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def get_allele_freqs_path(bfiles_base_path, keep_path=None, cache_dir=None):
+    # frequencies depend on the genotypes and on the samples kept, so both
+    # are part of the cache key
+    hasher = hashlib.sha1()
+    hasher.update(json.dumps(fingerprint_bfiles(bfiles_base_path)).encode())
+    if keep_path:
+        hasher.update(fingerprint_file(keep_path).encode())
+    bfiles_base_path = Path(bfiles_base_path)
+    if cache_dir is None:
+        cache_dir = bfiles_base_path.parent
+    return Path(cache_dir) / f"{bfiles_base_path.name}.freq_{hasher.hexdigest()[:16]}.afreq"
+
+
+def calc_allele_freqs(bfiles_base_path, keep_path=None, cache_dir=None):
+    afreq_path = get_allele_freqs_path(
+        bfiles_base_path, keep_path=keep_path, cache_dir=cache_dir
+    )
+    if afreq_path.exists():
+        return afreq_path
+    afreq_path.parent.mkdir(exist_ok=True, parents=True)
+
+    # several processes could be computing the same frequencies, each one
+    # writes its own file and the rename is atomic
+    tmp_base_path = Path(f"{afreq_path}.{os.getpid()}.tmp")
+    cmd = [get_executables(exec_recs["plink2"])]
+    cmd.extend(["--bfile", str(bfiles_base_path)])
+    if keep_path:
+        cmd.extend(["--keep", str(keep_path)])
+    cmd.append("--allow-extra-chr")
+    cmd.append("--freq")
+    cmd.extend(["--out", str(tmp_base_path)])
+    stderr_path = Path(str(tmp_base_path) + ".stderr")
+    stdout_path = Path(str(tmp_base_path) + ".stdout")
+    run_cmd(cmd, stdout_path, stderr_path)
+    Path(str(tmp_base_path) + ".afreq").replace(afreq_path)
+    for path in (stderr_path, stdout_path, Path(str(tmp_base_path) + ".log")):
+        if path.exists():
+            path.unlink()
+    return afreq_path
+
+
+def _create_read_freq_arg_list(bfiles_base_path, keep_path=None, read_freq=True):
+    if not read_freq:
+        return []
+    afreq_path = calc_allele_freqs(bfiles_base_path, keep_path=keep_path)
+    return ["--read-freq", str(afreq_path)]
+
+
+def write_keep_file(sample_names, bfiles_base_path, keep_path):
+    bfiles_samples = read_fam(bfiles_base_path)
+    is_kept = bfiles_samples["iid"].isin(sample_names)
+    if not is_kept.any():
+        raise ValueError("None of the desired samples are in the bfileset")
+    bfiles_samples.loc[is_kept, ["fid", "iid"]].to_csv(
+        keep_path, sep="\t", index=False, header=False
+    )
+    return Path(keep_path)
+
+
+def _get_subset_hash(bfiles_base_path, sample_names, variant_filters):
+    hasher = hashlib.sha1()
+    hasher.update(str(Path(bfiles_base_path).absolute()).encode())
+    # a bfileset regenerated in place gets a new subset
+    hasher.update(json.dumps(fingerprint_bfiles(bfiles_base_path)).encode())
+    hasher.update("\n".join(sorted(set(map(str, sample_names)))).encode())
+    if variant_filters is not None:
+        hasher.update(" ".join(variant_filters.create_cmd_arg_list()).encode())
+    return hasher.hexdigest()[:16]
+
+
+def create_subset_bfiles(
+    bfiles_base_path,
+    sample_names,
+    cache_dir,
+    variant_filters: VariantFilters | None = None,
+):
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(exist_ok=True, parents=True)
+    subset_hash = _get_subset_hash(bfiles_base_path, sample_names, variant_filters)
+    subset_base_path = cache_dir / f"{Path(bfiles_base_path).name}.subset_{subset_hash}"
+    keep_path = Path(str(subset_base_path) + ".keep")
+    result = {"bfiles_base_path": subset_base_path, "keep_path": keep_path}
+    if Path(str(subset_base_path) + ".bed").exists():
+        return result
+
+    tmp_keep_path = Path(f"{keep_path}.{os.getpid()}.tmp")
+    write_keep_file(sample_names, bfiles_base_path, tmp_keep_path)
+    tmp_keep_path.replace(keep_path)
+    # the filters are applied within the subset, so MAF and missingness are
+    # those of the kept samples
+    _make_bfiles(
+        bfiles_base_path,
+        subset_base_path,
+        keep_path=keep_path,
+        variant_filters=variant_filters,
+        log_suffix=".subset",
+    )
+    return result
+
+
+def _make_bfiles(
+    bfiles_base_path,
+    out_base_path,
+    keep_path=None,
+    variant_filters: VariantFilters | None = None,
+    read_freq_args=None,
+    log_suffix="",
+):
+    # several shards could be writing the same fileset, each process writes
+    # its own temporary files and the renames are atomic
+    tmp_base_path = Path(f"{out_base_path}.{os.getpid()}.tmp")
+    cmd = [get_executables(exec_recs["plink2"])]
+    cmd.extend(["--bfile", str(bfiles_base_path)])
+    if keep_path:
+        cmd.extend(["--keep", str(keep_path)])
+    if read_freq_args:
+        cmd.extend(read_freq_args)
+    cmd.append("--allow-extra-chr")
+    if variant_filters is not None:
+        cmd.extend(variant_filters.create_cmd_arg_list())
+    cmd.append("--make-bed")
+    cmd.extend(["--out", str(tmp_base_path)])
+    stderr_path = Path(str(tmp_base_path) + f"{log_suffix}.stderr")
+    stdout_path = Path(str(tmp_base_path) + f"{log_suffix}.stdout")
+    run_cmd(cmd, stdout_path, stderr_path)
+
+    for log_path in (stderr_path, stdout_path, Path(str(tmp_base_path) + ".log")):
+        if log_path.exists():
+            log_path.replace(
+                str(out_base_path) + log_path.name[len(tmp_base_path.name):]
+            )
+    # the .bed is moved last, its presence marks a finished fileset
+    for suffix in (".bim", ".fam", ".bed"):
+        Path(str(tmp_base_path) + suffix).replace(str(out_base_path) + suffix)
+
+
+def _get_filtered_bfiles_hash(bfiles_base_path, variant_filters, keep_path=None):
+    hasher = hashlib.sha1()
+    hasher.update(json.dumps(fingerprint_bfiles(bfiles_base_path)).encode())
+    hasher.update(" ".join(variant_filters.create_cmd_arg_list()).encode())
+    # the --extract lists are identified by their content, not by their path
+    for path in variant_filters.lists_of_vars_to_keep_paths:
+        hasher.update(fingerprint_file(path).encode())
+    if keep_path:
+        hasher.update(fingerprint_file(keep_path).encode())
+    return hasher.hexdigest()[:16]
+
+
+def create_filtered_bfiles(
+    bfiles_base_path,
+    variant_filters: VariantFilters,
+    cache_dir=None,
+    keep_path=None,
+    read_freq=True,
+):
+    # the filtered or pruned variants are written once, the later plink2
+    # calls read only them instead of filtering the whole .bed again
+    bfiles_base_path = Path(bfiles_base_path)
+    if cache_dir is None:
+        cache_dir = bfiles_base_path.parent
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(exist_ok=True, parents=True)
+    filtered_hash = _get_filtered_bfiles_hash(
+        bfiles_base_path, variant_filters, keep_path=keep_path
+    )
+    filtered_base_path = cache_dir / f"{bfiles_base_path.name}.filtered_{filtered_hash}"
+    result = {"bfiles_base_path": filtered_base_path}
+    if Path(str(filtered_base_path) + ".bed").exists():
+        return result
+
+    # with the cached QC stats of the bfileset, plink2 only has to extract the
+    # variants that pass the maf and missing rate filters
+    from src import qc
+
+    qc_stats = qc.load_cached_qc_stats(bfiles_base_path, keep_path=keep_path)
+    if qc_stats is not None:
+        variant_filters = qc.create_qc_variant_filters(
+            qc_stats, variant_filters, Path(str(filtered_base_path) + ".qc_pass.txt")
+        )
+
+    read_freq_args = None
+    if variant_filters.max_major_freq:
+        read_freq_args = _create_read_freq_arg_list(
+            bfiles_base_path, keep_path, read_freq=read_freq
+        )
+    _make_bfiles(
+        bfiles_base_path,
+        filtered_base_path,
+        keep_path=keep_path,
+        variant_filters=variant_filters,
+        read_freq_args=read_freq_args,
+        log_suffix=".filter",
+    )
+    return result
 
 
 def create_ld_indep_variants_file(
@@ -81,7 +337,9 @@ def create_ld_indep_variants_file(
     step_size=5,
     sizes_are_in_number_of_vars=True,
     r2_threshold=0.5,
-    bad_ld=False
+    bad_ld=False,
+    keep_path=None,
+    read_freq=True,
 ):
 
     pruned_vars_list_path = Path(pruned_vars_list_path)
@@ -89,12 +347,19 @@ def create_ld_indep_variants_file(
     if not variant_filters.max_major_freq:
         raise ValueError("It is really important to filter out the low freq variants")
 
+    read_freq_args = _create_read_freq_arg_list(
+        bfiles_base_path, keep_path, read_freq=read_freq
+    )
+
     current_working_dir = os.getcwd()
     working_dir = out_base_path if out_base_path.is_dir() else out_base_path.parent
     os.chdir(working_dir)
 
     cmd = [get_executables(exec_recs["plink2"])]
     cmd.extend(["--bfile", str(bfiles_base_path)])
+    if keep_path:
+        cmd.extend(["--keep", str(keep_path)])
+    cmd.extend(read_freq_args)
 
     cmd.append("--allow-extra-chr")
     # Note: --allow-no-sex no longer has any effect.  (Missing-sex samples are
@@ -145,13 +410,27 @@ def _read_mds_projections_file(mds_path):
     return projections
 
 
+# the sample ids are compared with the .fam ones, that are strings
+PLINK2_ID_DTYPES = {col: str for col in ("#FID", "FID", "#IID", "IID", "SID")}
+
+
+def read_covars(covars_path):
+    covars = pandas.read_csv(str(covars_path), sep=r"\s+", dtype=PLINK2_ID_DTYPES)
+    covars.columns = [col.lstrip("#") for col in covars.columns]
+    covars = covars.set_index("IID")
+    covars = covars.drop(columns=["FID", "SID"], errors="ignore").astype(float)
+    return covars.dropna()
+
+
 def do_pca(
     bfiles_base_path,
     out_base_path,
     variant_filters: VariantFilters,
     n_dims=10,
     approx=False,
-    freq=False):
+    read_freq=True,
+    keep_path=None,
+    materialize_filters=False):
 
     if not variant_filters.max_major_freq:
         raise ValueError("It is really important to filter out the low freq variants")
@@ -160,26 +439,22 @@ def do_pca(
             "Consider that PCA will fill missing values with mean, so use variants with few missing data"
         )
 
-    out_dir = out_base_path if out_base_path.is_dir() else out_base_path.parent
-
-    if freq:
-        cmd = [get_executables(exec_recs["plink2"])]
-        cmd.append("--freq")
-        cmd.extend(["--bfile", str(bfiles_base_path)])
-        cmd.append("--allow-extra-chr")
-        cmd.extend(["-out", str(out_base_path)])
-        stderr_path = Path(str(out_base_path) + ".freq.stderr")
-        stdout_path = Path(str(out_base_path) + ".freq.stdout")
-        if variant_filters is not None:
-            cmd.extend(variant_filters.create_cmd_arg_list())
-        run_cmd(cmd, stdout_path, stderr_path)
-        print(" ".join(cmd))
-    
+    if materialize_filters:
+        bfiles_base_path = create_filtered_bfiles(
+            bfiles_base_path, variant_filters, keep_path=keep_path, read_freq=read_freq
+        )["bfiles_base_path"]
+        variant_filters = None
+        keep_path = None
 
+    # plink2 refuses to estimate the frequencies for the PCA with few samples,
+    # so they are read from the shared cache
     cmd = [get_executables(exec_recs["plink2"])]
     cmd.extend(["--bfile", str(bfiles_base_path)])
-    if freq:
-        cmd.extend(["--read-freq", "..afreq"])
+    if keep_path:
+        cmd.extend(["--keep", str(keep_path)])
+    cmd.extend(
+        _create_read_freq_arg_list(bfiles_base_path, keep_path, read_freq=read_freq)
+    )
     cmd.append("--allow-extra-chr")
     cmd.extend(["-out", str(out_base_path)])
     cmd.append("--pca")
@@ -197,32 +472,123 @@ def do_pca(
 
     return {"eigenvec_path": eigenvec_path, "projections": projections}
 
-def write_phenotype_file(phenotypes: dict, fhand, quantitative=False):
 
-    for acc, phenotype in phenotypes.items():
-        if quantitative:
-            phenotype = int(phenotype)
-            if phenotype not in (0, 1, 2, -9):
-                raise ValueError(
-                    f"Phenotypes should be 0, 1, 2, -9, but there is: {phenotype} for acc {acc}"
-                )
-        fhand.write(f"{acc}\t{acc}\t{phenotype}\n")
-    fhand.flush()
+QUALITATIVE_PHENOTYPE_CODES = (0, 1, 2, -9)
 
-def do_gwas(
+ADJUSTED_PVALUES_COL_MAPPING = {
+    "#CHROM": "chrom",
+    "ID": "variant_id",
+    "UNADJ": "pval",
+    "GC": "genomic_control_corrected_pval",
+    "QQ": "pval_quantile",
+    "BONF": "bonferroni_pval",
+    "HOLM": "holm_bonferroni_pval",
+    "SIDAK_SS": "sidak_single_step_pval",
+    "SIDAK_SD": "sidak_step_down_pval",
+    "FDR_BH": "benjamini_hochberg_pval",
+    "FDR_BY": "benjamini_yekutieli_pval",
+}
+# the adjusted files can have other columns, like A1, that are not p-values
+ADJUSTED_PVALUE_COLS = tuple(
+    col
+    for col in ADJUSTED_PVALUES_COL_MAPPING.values()
+    if col not in ("chrom", "variant_id", "pval_quantile")
+)
+
+
+def _align_to_bfiles_samples(dframe, bfiles_samples):
+    # the .fam ids are strings, numeric sample names would match nothing
+    dframe = dframe.set_axis(dframe.index.astype(str), axis=0)
+    if dframe.index.has_duplicates:
+        duplicated = dframe.index[dframe.index.duplicated()].unique()
+        raise ValueError(f"Duplicated samples: {list(duplicated)[:10]}")
+    is_in_bfiles = dframe.index.isin(bfiles_samples["iid"].values)
+    if not is_in_bfiles.any():
+        raise ValueError(
+            f"None of the samples are in the bfileset, e.g. {list(dframe.index[:10])}"
+        )
+    if not is_in_bfiles.all():
+        missing = dframe.index[~is_in_bfiles]
+        warnings.warn(
+            f"{len(missing)} samples are not in the bfileset and are ignored: "
+            f"{list(missing[:10])}"
+        )
+    return dframe.reindex(bfiles_samples["iid"].values)
+
+
+def _write_plink2_table(dframe, bfiles_samples, path):
+    dframe = dframe.copy()
+    dframe.insert(0, "IID", bfiles_samples["iid"].values)
+    dframe.insert(0, "#FID", bfiles_samples["fid"].values)
+    dframe.to_csv(path, sep="\t", index=False, na_rep="NA", float_format="%.10g")
+
+
+def write_plink2_pheno_file(
+    phenotype_dframe,
+    bfiles_base_path,
+    pheno_path,
+    traits=None,
+    qualitative=False,
+    sample_col="SAMPLE_NAME",
+):
+    phenotypes = phenotype_dframe.set_index(sample_col)
+    if traits is None:
+        traits = list(phenotypes.columns)
+    bfiles_samples = read_fam(bfiles_base_path)
+    phenotypes = _align_to_bfiles_samples(phenotypes[traits], bfiles_samples)
+    values = phenotypes.to_numpy(dtype=float)
+
+    if qualitative:
+        is_wrong = ~numpy.isnan(values) & ~numpy.isin(values, QUALITATIVE_PHENOTYPE_CODES)
+        if is_wrong.any():
+            row_idx, col_idx = numpy.argwhere(is_wrong)[0]
+            raise ValueError(
+                f"Phenotypes should be 0, 1, 2, -9, but there is: {values[row_idx, col_idx]} "
+                f"for acc {phenotypes.index[row_idx]} in trait {traits[col_idx]}"
+            )
+
+    _write_plink2_table(
+        pandas.DataFrame(values, columns=traits), bfiles_samples, pheno_path
+    )
+    return {"pheno_path": Path(pheno_path), "traits": traits}
+
+
+def write_plink2_covars_file(eigenvec_path, bfiles_base_path, cov_path, n_pcs=None):
+    covars = read_covars(eigenvec_path)
+    if n_pcs is not None:
+        if n_pcs > covars.shape[1]:
+            raise ValueError(
+                f"Asked for {n_pcs} PCs, but {eigenvec_path} only has {covars.shape[1]}"
+            )
+        covars = covars.iloc[:, :n_pcs]
+    bfiles_samples = read_fam(bfiles_base_path)
+    covars = _align_to_bfiles_samples(covars, bfiles_samples)
+    _write_plink2_table(covars.reset_index(drop=True), bfiles_samples, cov_path)
+    return {"cov_path": Path(cov_path), "covars": list(covars.columns)}
+
+
+def _create_gwas_cmd(
     bfiles_base_path,
     phenotypes_path,
     test_type,
-    out_base_path,
     covars_path=None,
     allow_no_covars=False,
     variant_filters: VariantFilters | None = None,
-    ):
-
-    out_base_path = Path(str(out_base_path) + ".gwas")
-
+    pheno_name=None,
+    compress_outputs=False,
+    keep_path=None,
+    adjust=True,
+    read_freq=True,
+):
     cmd = [get_executables(exec_recs["plink2"])]
     cmd.extend(["--bfile", str(bfiles_base_path)])
+    if keep_path:
+        cmd.extend(["--keep", str(keep_path)])
+    # the frequencies are only needed to apply the MAF filter
+    if variant_filters is not None and variant_filters.max_major_freq:
+        cmd.extend(
+            _create_read_freq_arg_list(bfiles_base_path, keep_path, read_freq=read_freq)
+        )
 
     cmd.append("--allow-extra-chr")
 
@@ -231,7 +597,10 @@ def do_gwas(
     # treated normally otherwise.)
     # cmd.append("--allow-no-sex")
 
-    cmd.extend(["--adjust", "cols=+qq"])
+    if adjust:
+        cmd.extend(["--adjust", "cols=+qq"])
+        if compress_outputs:
+            cmd.append("zs")
 
     if test_type == "linear":
         cmd.append("--linear")
@@ -241,6 +610,8 @@ def do_gwas(
         raise ValueError(
             f"Unknown test type ({test_type}, it should be linear (quantitative) or logistic (qualitative))"
         )
+    if compress_outputs:
+        cmd.append("zs")
 
     if covars_path:
         cmd.extend(["--covar", str(covars_path)])
@@ -251,48 +622,414 @@ def do_gwas(
             raise ValueError("If allow_no_covars is False should should provide covars")
 
     cmd.extend(["--pheno", str(phenotypes_path)])
+    if pheno_name is not None:
+        cmd.extend(["--pheno-name", pheno_name])
 
     if variant_filters is not None:
         cmd.extend(variant_filters.create_cmd_arg_list())
+    return cmd
+
+
+def _get_glm_path(out_base_path, test_type, pheno_name, compressed=False):
+    test_str = 'logistic.hybrid' if test_type == 'logistic' else test_type
+    pheno_name = "PHENO1" if pheno_name is None else pheno_name
+    glm_path = Path(str(out_base_path) + f".{pheno_name}.glm.{test_str}")
+    if compressed:
+        glm_path = Path(str(glm_path) + ".zst")
+    return glm_path
+
+
+def _split_chrom_in_pieces(poss, n_pieces):
+    # pieces are cut between distinct positions, so a position is never
+    # tested in two ranges
+    uniq_poss, counts = numpy.unique(poss, return_counts=True)
+    n_per_piece = -(-poss.shape[0] // n_pieces)
+    piece_idxs = (numpy.cumsum(counts) - 1) // n_per_piece
+    first_idxs = numpy.r_[0, numpy.nonzero(numpy.diff(piece_idxs))[0] + 1]
+    last_idxs = numpy.r_[first_idxs[1:] - 1, uniq_poss.shape[0] - 1]
+    return [
+        (int(uniq_poss[first_idx]), int(uniq_poss[last_idx]))
+        for first_idx, last_idx in zip(first_idxs, last_idxs)
+    ]
 
-    cmd.extend(["-out", str(out_base_path)])
 
+def split_genome_in_variant_ranges(bfiles_base_path, n_ranges):
+    # the chromosomes with more than a range worth of variants are cut in
+    # position ranges and the smaller ones, e.g. the scaffolds, are grouped
+    # whole, so there are n_ranges ranges however many contigs there are.
+    # Every range is (chroms, from_bp, to_bp), the positions are None for the
+    # whole chromosome groups
+    variants = read_bim(bfiles_base_path)
+    poss_by_chrom = {
+        chrom: poss.values for chrom, poss in variants.groupby("chrom", sort=False)["pos"]
+    }
+    chroms = list(poss_by_chrom)
+    counts = numpy.array([poss_by_chrom[chrom].shape[0] for chrom in chroms])
+    if not counts.shape[0]:
+        return []
+    quotas = counts * n_ranges / counts.sum()
+    is_big = quotas >= 1
+    n_small_groups = 0
+    if not is_big.all():
+        n_small_groups = min(max(1, round(quotas[~is_big].sum())), (~is_big).sum())
+
+    # the pieces left for the big chromosomes go to the largest remainders
+    big_idxs = numpy.nonzero(is_big)[0]
+    n_pieces = numpy.floor(quotas[big_idxs]).astype(int)
+    n_extra = n_ranges - n_small_groups - n_pieces.sum()
+    extra_idxs = numpy.argsort(-(quotas[big_idxs] - n_pieces), kind="stable")[:n_extra]
+    n_pieces[extra_idxs] += 1
+
+    ranges = []
+    for chrom_idx, chrom_n_pieces in zip(big_idxs, n_pieces):
+        chrom = chroms[chrom_idx]
+        for from_bp, to_bp in _split_chrom_in_pieces(poss_by_chrom[chrom], chrom_n_pieces):
+            ranges.append(((chrom,), from_bp, to_bp))
+
+    small_idxs = numpy.nonzero(~is_big)[0]
+    if small_idxs.shape[0]:
+        # every small chromosome goes to the group that holds its middle variant
+        small_counts = counts[small_idxs]
+        middles = numpy.cumsum(small_counts) - small_counts / 2
+        group_idxs = numpy.minimum(
+            (middles * n_small_groups / small_counts.sum()).astype(int),
+            n_small_groups - 1,
+        )
+        for group_idx in numpy.unique(group_idxs):
+            group_chroms = tuple(
+                chroms[chrom_idx] for chrom_idx in small_idxs[group_idxs == group_idx]
+            )
+            ranges.append((group_chroms, None, None))
+    return ranges
+
+
+def _run_gwas_in_variant_range(cmd, out_base_path, variant_range):
+    chroms, from_bp, to_bp = variant_range
+    cmd = cmd + ["--chr", *chroms]
+    if from_bp is not None:
+        cmd.extend(["--from-bp", str(from_bp), "--to-bp", str(to_bp)])
+    cmd.extend(["-out", str(out_base_path)])
     stderr_path = Path(str(out_base_path) + ".gwas.stderr")
     stdout_path = Path(str(out_base_path) + ".gwas.stdout")
+    try:
+        run_cmd(cmd, stdout_path, stderr_path)
+    except subprocess.CalledProcessError:
+        # a range can be emptied by the variant filters, that is not an error
+        # for the whole genome
+        if "No variants remaining" in stdout_path.read_text():
+            return False
+        raise
+    return True
 
-    run_cmd(cmd, stdout_path, stderr_path)
 
-    stdout_fhand = stdout_path.open("rt")
-    stdout = stdout_fhand.read()
-    stdout_fhand.close()
+def _read_glm_pvalues(glm_path):
+    with open_plink_output(glm_path) as fhand:
+        glm = pandas.read_csv(
+            fhand,
+            sep=r"\s+",
+            usecols=["#CHROM", "ID", "TEST", "P"],
+            dtype={"#CHROM": str, "ID": str, "TEST": str},
+            na_values=["NA"],
+        )
+    glm = glm.loc[(glm["TEST"] == "ADD") & glm["P"].notna()]
+    return glm.drop(columns="TEST").rename(columns={"P": "UNADJ"})
+
 
-    if "Zero valid tests; --adjust skipped." in stdout:
-        pvalues = None
-    else:
-        test_str = 'logistic.hybrid' if test_type == 'logistic' else test_type
-        adjusted_pvalues_path = Path(
-            str(out_base_path) + f".PHENO1.glm.{test_str}.adjusted"
+def _calc_adjusted_pvalues(pvalues):
+    # same columns that plink2 --adjust cols=+qq writes, sorted by p-value
+    pvalues = pvalues.sort_values("UNADJ", kind="stable").reset_index(drop=True)
+    adjusted = multiple_testing.adjust_pvalues(pvalues["UNADJ"].values)
+    plink_cols = {col: plink_col for plink_col, col in ADJUSTED_PVALUES_COL_MAPPING.items()}
+    for col, values in adjusted.items():
+        pvalues[plink_cols[col]] = values
+    return pvalues
+
+
+def _write_adjusted_pvalues(glm_paths, adjusted_pvalues_path, compress_outputs):
+    pvalues = [_read_glm_pvalues(glm_path) for glm_path in glm_paths]
+    pvalues = [glm_pvalues for glm_pvalues in pvalues if glm_pvalues.shape[0]]
+    if not pvalues:
+        return None
+    adjusted_pvalues = _calc_adjusted_pvalues(pandas.concat(pvalues, ignore_index=True))
+    if compress_outputs:
+        adjusted_pvalues_path = Path(str(adjusted_pvalues_path) + ".zst")
+    adjusted_pvalues.to_csv(
+        adjusted_pvalues_path,
+        sep="\t",
+        index=False,
+        compression="zstd" if compress_outputs else None,
+    )
+    return adjusted_pvalues_path
+
+
+def _do_gwas_by_variant_ranges(
+    cmd, out_base_path, bfiles_base_path, test_type, pheno_name, compress_outputs,
+    n_variant_ranges, n_processes
+):
+    variant_ranges = split_genome_in_variant_ranges(bfiles_base_path, n_variant_ranges)
+    range_out_base_paths = [
+        Path(f"{out_base_path}.range{idx}") for idx in range(len(variant_ranges))
+    ]
+    # plink2 uses every cpu by default, the ranges that run at once share them
+    n_cpus = os.cpu_count() or 1
+    if n_processes is None:
+        n_processes = min(len(variant_ranges), n_cpus)
+    cmd = cmd + ["--threads", str(max(n_cpus // n_processes, 1))]
+    with ThreadPoolExecutor(max_workers=n_processes) as executor:
+        have_results = list(
+            executor.map(
+                partial(_run_gwas_in_variant_range, cmd),
+                range_out_base_paths,
+                variant_ranges,
+            )
         )
-        pvalues = pandas.read_csv(
-            str(adjusted_pvalues_path), delim_whitespace=True, index_col="ID"
+
+    glm_paths = []
+    for range_out_base_path, has_results in zip(range_out_base_paths, have_results):
+        glm_path = _get_glm_path(
+            range_out_base_path, test_type, pheno_name, compressed=compress_outputs
         )
+        if has_results and glm_path.exists():
+            glm_paths.append(glm_path)
+
+    # the corrections are only valid genome-wide, so they are computed once
+    # all the ranges have been merged
+    adjusted_pvalues_path = Path(
+        str(_get_glm_path(out_base_path, test_type, pheno_name)) + ".adjusted"
+    )
+    return _write_adjusted_pvalues(glm_paths, adjusted_pvalues_path, compress_outputs)
+
+
+def _read_plink2_case_control_phenotypes(phenotypes_path, pheno_name=None):
+    phenotypes = pandas.read_csv(
+        phenotypes_path, sep="\t", na_values=["NA"], dtype=PLINK2_ID_DTYPES
+    )
+    phenotypes = phenotypes.set_index("IID")
+    trait_cols = [col for col in phenotypes.columns if col != "#FID"]
+    phenotypes = phenotypes[pheno_name if pheno_name is not None else trait_cols[0]]
+    # plink coding: 1 control, 2 case, anything else missing
+    phenotypes = phenotypes.loc[phenotypes.isin([1, 2])]
+    return (phenotypes == 2).astype(float)
+
+
+def _do_native_logistic_gwas(
+    bfiles_base_path,
+    phenotypes_path,
+    out_base_path,
+    pheno_name=None,
+    covars_path=None,
+    keep_path=None,
+    compress_outputs=False,
+    block_size=2000,
+    n_processes=None,
+):
+    bed_reader = BedReader(bfiles_base_path)
+    phenotypes = _read_plink2_case_control_phenotypes(phenotypes_path, pheno_name)
+    phenotypes = phenotypes.loc[phenotypes.index.isin(bed_reader.samples["iid"])]
+    if keep_path:
+        kept = pandas.read_csv(keep_path, sep=r"\s+", header=None, dtype=str)
+        phenotypes = phenotypes.loc[phenotypes.index.isin(kept.iloc[:, -1])]
+    covars = None
+    if covars_path:
+        covars = read_covars(covars_path)
+        phenotypes = phenotypes.loc[phenotypes.index.isin(covars.index)]
+        covars = covars.loc[phenotypes.index].values
+    sample_idxs = bed_reader.get_sample_idxs(phenotypes.index)
+    phenotypes = phenotypes.values
 
-    col_mapping = {
-        "#CHROM": "chrom",
-        "ID": "variant_id",
-        "UNADJ": "pval",
-        "GC": "genomic_control_corrected_pval",
-        "QQ": "pval_quantile",
-        "BONF": "bonferroni_pval",
-        "HOLM": "holm_bonferroni_pval",
-        "SIDAK_SS": "sidak_single_step_pval",
-        "SIDAK_SD": "sidak_step_down_pval",
-        "FDR_BH": "benjamini_hochberg_pval",
-        "FDR_BY": "benjamini_yekutieli_pval",
+    design = logistic.create_null_design(phenotypes.shape[0], covars=covars)
+    null_betas = logistic.fit_null_logistic(phenotypes, design)
+
+    block_results = []
+    if n_processes is not None and n_processes > 1:
+        task = {
+            "phenotypes": phenotypes,
+            "design": design,
+            "null_betas": null_betas,
+            "sample_idxs": sample_idxs,
+        }
+        with genotype_cache.SharedGenotypeBlockCache(
+            bfiles_base_path, block_size=block_size, max_cached_blocks=2 * n_processes
+        ) as block_cache:
+            for _, _, block_res in genotype_cache.map_tasks_over_blocks(
+                logistic.fit_logistic_task, block_cache, [task], n_workers=n_processes
+            ):
+                block_results.append(block_res)
+    else:
+        for block in bed_reader.iterate_blocks(block_size, sample_idxs=sample_idxs):
+            block_results.append(
+                logistic.fit_logistic_block(
+                    phenotypes, design, block["genotypes"], null_betas
+                )
+            )
+
+    variants = bed_reader.variants
+    betas = numpy.concatenate([res["betas"] for res in block_results])
+    glm = pandas.DataFrame(
+        {
+            "#CHROM": variants["chrom"].values,
+            "POS": variants["pos"].values,
+            "ID": variants["variant_id"].values,
+            "A1": variants["allele1"].values,
+            "FIRTH?": numpy.where(
+                numpy.concatenate([res["firth"] for res in block_results]), "Y", "N"
+            ),
+            "TEST": "ADD",
+            "OBS_CT": phenotypes.shape[0],
+            "OR": numpy.exp(betas),
+            "LOG(OR)_SE": numpy.concatenate([res["ses"] for res in block_results]),
+            "Z_STAT": numpy.concatenate([res["z_stats"] for res in block_results]),
+            "P": numpy.concatenate([res["pvalues"] for res in block_results]),
+        }
+    )
+    pheno_name = "PHENO1" if pheno_name is None else pheno_name
+    glm_path = Path(str(out_base_path) + f".{pheno_name}.glm.logistic")
+    if compress_outputs:
+        glm_path = Path(str(glm_path) + ".zst")
+    glm.to_csv(
+        glm_path,
+        sep="\t",
+        index=False,
+        na_rep="NA",
+        compression="zstd" if compress_outputs else None,
+    )
+    adjusted_pvalues_path = Path(
+        str(out_base_path) + f".{pheno_name}.glm.logistic.adjusted"
+    )
+    return _write_adjusted_pvalues([glm_path], adjusted_pvalues_path, compress_outputs)
+
+
+def _read_adjusted_pvalues_chunks(fhand, chunk_size=500_000):
+    for chunk in pandas.read_csv(
+        fhand, sep=r"\s+", chunksize=chunk_size, dtype={"#CHROM": str, "ID": str}
+    ):
+        chunk.columns = [
+            ADJUSTED_PVALUES_COL_MAPPING.get(col, col) for col in chunk.columns
+        ]
+        yield chunk
+
+
+def _read_adjusted_pvalues(adjusted_pvalues_path, has_valid_tests, bfiles_base_path):
+    if not has_valid_tests:
+        return {}
+
+    # the full table is never held in memory, every chunk is compacted
+    with open_plink_output(adjusted_pvalues_path) as fhand:
+        gwas_result = GwasResult.from_pvalue_chunks(
+            get_variant_table(bfiles_base_path),
+            _read_adjusted_pvalues_chunks(fhand),
+            pvalue_cols=ADJUSTED_PVALUE_COLS,
+        )
+    return {
+        "gwas_result": gwas_result,
+        "adjusted_pvalues_path": adjusted_pvalues_path,
     }
-    if pvalues is not None:
-        pvalues.columns = [col_mapping.get(col, col) for col in pvalues.columns]
-        result = {"adjusted_pvalues": pvalues}
+
+
+def do_gwas(
+    bfiles_base_path,
+    phenotypes_path,
+    test_type,
+    out_base_path,
+    covars_path=None,
+    allow_no_covars=False,
+    variant_filters: VariantFilters | None = None,
+    pheno_name=None,
+    compress_outputs=False,
+    keep_path=None,
+    n_variant_ranges=1,
+    n_processes=None,
+    plink_adjust=True,
+    read_freq=True,
+    materialize_filters=False,
+    logistic_engine="plink2",
+    ):
+
+    out_base_path = Path(str(out_base_path) + ".gwas")
+
+    if materialize_filters and variant_filters is not None:
+        bfiles_base_path = create_filtered_bfiles(
+            bfiles_base_path, variant_filters, keep_path=keep_path, read_freq=read_freq
+        )["bfiles_base_path"]
+        variant_filters = None
+        keep_path = None
+
+    if logistic_engine not in ("plink2", "native"):
+        raise ValueError(f"Unknown logistic engine: {logistic_engine}")
+
+    if test_type == "logistic" and logistic_engine == "native":
+        if variant_filters is not None:
+            raise ValueError(
+                "The native logistic engine does not apply variant filters, "
+                "use materialize_filters"
+            )
+        adjusted_pvalues_path = _do_native_logistic_gwas(
+            bfiles_base_path,
+            phenotypes_path,
+            out_base_path,
+            pheno_name=pheno_name,
+            covars_path=covars_path,
+            keep_path=keep_path,
+            compress_outputs=compress_outputs,
+            n_processes=n_processes,
+        )
+        has_valid_tests = adjusted_pvalues_path is not None
+        return _read_adjusted_pvalues(
+            adjusted_pvalues_path, has_valid_tests, bfiles_base_path
+        )
+
+    cmd = _create_gwas_cmd(
+        bfiles_base_path,
+        phenotypes_path,
+        test_type,
+        covars_path=covars_path,
+        allow_no_covars=allow_no_covars,
+        variant_filters=variant_filters,
+        pheno_name=pheno_name,
+        compress_outputs=compress_outputs,
+        keep_path=keep_path,
+        adjust=plink_adjust and n_variant_ranges <= 1,
+        read_freq=read_freq,
+    )
+
+    if n_variant_ranges > 1:
+        adjusted_pvalues_path = _do_gwas_by_variant_ranges(
+            cmd,
+            out_base_path,
+            bfiles_base_path,
+            test_type,
+            pheno_name,
+            compress_outputs,
+            n_variant_ranges=n_variant_ranges,
+            n_processes=n_processes,
+        )
+        has_valid_tests = adjusted_pvalues_path is not None
     else:
-        result = {}
-    return result
\ No newline at end of file
+        cmd.extend(["-out", str(out_base_path)])
+
+        stderr_path = Path(str(out_base_path) + ".gwas.stderr")
+        stdout_path = Path(str(out_base_path) + ".gwas.stdout")
+
+        run_cmd(cmd, stdout_path, stderr_path)
+
+        stdout_fhand = stdout_path.open("rt")
+        stdout = stdout_fhand.read()
+        stdout_fhand.close()
+
+        glm_path = _get_glm_path(out_base_path, test_type, pheno_name)
+        adjusted_pvalues_path = Path(str(glm_path) + ".adjusted")
+        if plink_adjust:
+            has_valid_tests = "Zero valid tests; --adjust skipped." not in stdout
+            if compress_outputs:
+                adjusted_pvalues_path = Path(str(adjusted_pvalues_path) + ".zst")
+        else:
+            adjusted_pvalues_path = _write_adjusted_pvalues(
+                [_get_glm_path(out_base_path, test_type, pheno_name, compress_outputs)],
+                adjusted_pvalues_path,
+                compress_outputs,
+            )
+            has_valid_tests = adjusted_pvalues_path is not None
+
+    return _read_adjusted_pvalues(
+        adjusted_pvalues_path, has_valid_tests, bfiles_base_path
+    )
@@ -148,19 +148,142 @@ class GeneralFigure(_Figure):
         return axes
 
 
+class HistogramAccumulator:
+    # fixed-edge 1D histogram that can be filled chunk by chunk and merged
+    # with the ones filled by other workers
+    def __init__(self, bin_edges):
+        self.bin_edges = numpy.asarray(bin_edges, dtype=float)
+        if self.bin_edges.ndim != 1 or self.bin_edges.shape[0] < 2:
+            raise ValueError("At least two bin edges are required")
+        self.counts = numpy.zeros(self.bin_edges.shape[0] - 1, dtype=numpy.int64)
+        self.n_below = 0
+        self.n_above = 0
+        self.n_nan = 0
+
+    @classmethod
+    def from_range(cls, range_, n_bins=20):
+        return cls(numpy.linspace(range_[0], range_[1], num=n_bins + 1))
+
+    def update(self, values):
+        values = numpy.asarray(values, dtype=float).ravel()
+        is_nan = numpy.isnan(values)
+        self.n_nan += int(is_nan.sum())
+        values = values[~is_nan]
+        is_below = values < self.bin_edges[0]
+        is_above = values > self.bin_edges[-1]
+        self.n_below += int(is_below.sum())
+        self.n_above += int(is_above.sum())
+        values = values[~(is_below | is_above)]
+        # as numpy.histogram, the last bin includes its right edge
+        bin_idxs = numpy.searchsorted(self.bin_edges, values, side="right") - 1
+        bin_idxs = numpy.minimum(bin_idxs, self.counts.shape[0] - 1)
+        self.counts += numpy.bincount(bin_idxs, minlength=self.counts.shape[0])
+        return self
+
+    def merge(self, other):
+        if not numpy.array_equal(self.bin_edges, other.bin_edges):
+            raise ValueError("Only histograms with the same bin edges can be merged")
+        self.counts += other.counts
+        self.n_below += other.n_below
+        self.n_above += other.n_above
+        self.n_nan += other.n_nan
+        return self
+
+    @property
+    def n_values(self):
+        return int(self.counts.sum())
+
+    def plot(self, axes, orientation="vertical"):
+        axes.hist(
+            self.bin_edges[:-1],
+            bins=self.bin_edges,
+            weights=self.counts,
+            orientation=orientation,
+        )
+
+
+class Histogram2DAccumulator:
+    def __init__(self, x_bin_edges, y_bin_edges):
+        self.x_bin_edges = numpy.asarray(x_bin_edges, dtype=float)
+        self.y_bin_edges = numpy.asarray(y_bin_edges, dtype=float)
+        if self.x_bin_edges.shape[0] < 2 or self.y_bin_edges.shape[0] < 2:
+            raise ValueError("At least two bin edges are required")
+        self.counts = numpy.zeros(
+            (self.x_bin_edges.shape[0] - 1, self.y_bin_edges.shape[0] - 1),
+            dtype=numpy.int64,
+        )
+        self.n_outside = 0
+
+    @classmethod
+    def from_ranges(cls, x_range, y_range, x_n_bins=20, y_n_bins=20):
+        return cls(
+            numpy.linspace(x_range[0], x_range[1], num=x_n_bins + 1),
+            numpy.linspace(y_range[0], y_range[1], num=y_n_bins + 1),
+        )
+
+    @staticmethod
+    def _calc_bin_idxs(bin_edges, values):
+        bin_idxs = numpy.searchsorted(bin_edges, values, side="right") - 1
+        return numpy.minimum(bin_idxs, bin_edges.shape[0] - 2)
+
+    def update(self, xvalues, yvalues):
+        xvalues = numpy.asarray(xvalues, dtype=float).ravel()
+        yvalues = numpy.asarray(yvalues, dtype=float).ravel()
+        if xvalues.shape != yvalues.shape:
+            raise ValueError("x and y values should have the same length")
+        # NaNs fail both comparisons, so they are counted as outside
+        is_inside = (
+            (xvalues >= self.x_bin_edges[0])
+            & (xvalues <= self.x_bin_edges[-1])
+            & (yvalues >= self.y_bin_edges[0])
+            & (yvalues <= self.y_bin_edges[-1])
+        )
+        self.n_outside += int(is_inside.shape[0] - is_inside.sum())
+        x_idxs = self._calc_bin_idxs(self.x_bin_edges, xvalues[is_inside])
+        y_idxs = self._calc_bin_idxs(self.y_bin_edges, yvalues[is_inside])
+        n_y_bins = self.counts.shape[1]
+        self.counts += numpy.bincount(
+            x_idxs * n_y_bins + y_idxs, minlength=self.counts.size
+        ).reshape(self.counts.shape)
+        return self
+
+    def merge(self, other):
+        if not (
+            numpy.array_equal(self.x_bin_edges, other.x_bin_edges)
+            and numpy.array_equal(self.y_bin_edges, other.y_bin_edges)
+        ):
+            raise ValueError("Only histograms with the same bin edges can be merged")
+        self.counts += other.counts
+        self.n_outside += other.n_outside
+        return self
+
+    def get_x_histogram(self):
+        hist = HistogramAccumulator(self.x_bin_edges)
+        hist.counts = self.counts.sum(axis=1)
+        return hist
+
+    def get_y_histogram(self):
+        hist = HistogramAccumulator(self.y_bin_edges)
+        hist.counts = self.counts.sum(axis=0)
+        return hist
+
+
 def plot_hist(values, axes, n_bins=20, range_=None):
     if range_ is None:
         range_ = numpy.nanmin(values), numpy.nanmax(values)
 
     bin_edges = numpy.linspace(range_[0], range_[1], num=n_bins)
 
-    axes.hist(values, bins=bin_edges)
+    HistogramAccumulator(bin_edges).update(values).plot(axes)
 
 
 def plot_hist_fig(values, plot_path, n_bins=20, range_=None):
     fig = SimpleFigure()
 
-    plot_hist(values, fig.axes, n_bins=n_bins, range_=range_)
+    if isinstance(values, HistogramAccumulator):
+        values.plot(fig.axes)
+    else:
+        plot_hist(values, fig.axes, n_bins=n_bins, range_=range_)
 
     fig.save_fig(plot_path)
 
@@ -188,16 +311,7 @@ def set_y_axis_log(axes):
     axes.set_yscale("log")
 
 
-def plot_2d_joinplot(
-    xvalues,
-    yvalues,
-    hex_cmap="viridis",
-    hex_map_log=False,
-    x_lim=None,
-    y_lim=None,
-    x_hist_n_bins=20,
-    y_hist_n_bins=20,
-):
+def _create_joinplot_fig():
     fig = GeneralFigure()
 
     hist_axes_width = 0.2
@@ -226,6 +340,20 @@ def plot_2d_joinplot(
         axes_col_widths=axes_col_widths,
         axes_row_heights=axes_row_heights,
     )
+    return fig, hex_axes, xvalues_hist_axes, yvalues_hist_axes
+
+
+def plot_2d_joinplot(
+    xvalues,
+    yvalues,
+    hex_cmap="viridis",
+    hex_map_log=False,
+    x_lim=None,
+    y_lim=None,
+    x_hist_n_bins=20,
+    y_hist_n_bins=20,
+):
+    fig, hex_axes, xvalues_hist_axes, yvalues_hist_axes = _create_joinplot_fig()
     bins = "log" if hex_map_log else None
 
     if x_lim is not None or y_lim is not None:
@@ -249,6 +377,19 @@ def plot_2d_joinplot(
     return fig
 
 
+def plot_2d_joinplot_from_hist(hist2d, cmap="viridis", map_log=False):
+    # the counts are drawn as a mesh, there are no points to hexbin
+    fig, hist2d_axes, xvalues_hist_axes, yvalues_hist_axes = _create_joinplot_fig()
+    counts = numpy.ma.masked_equal(hist2d.counts.T, 0)
+    norm = matplotlib.colors.LogNorm() if map_log else None
+    hist2d_axes.pcolormesh(
+        hist2d.x_bin_edges, hist2d.y_bin_edges, counts, cmap=cmap, norm=norm
+    )
+    hist2d.get_x_histogram().plot(xvalues_hist_axes)
+    hist2d.get_y_histogram().plot(yvalues_hist_axes, orientation="horizontal")
+    return fig
+
+
 def draw_rectangle(axes, x, y, width, height):
     rectangle = matplotlib.patches.Rectangle((x, y), width, height)
     axes.add_patch(rectangle)
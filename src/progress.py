@@ -0,0 +1,121 @@
+import re
+import sys
+import time
+
+# plink2 redraws its percentages in place with backspaces, e.g.
+# "--glm linear regression on phenotype 'X': 0%\b\b1%\b\b2%...\b\bdone."
+PERCENT_RE = re.compile(rb"(\d{1,3})%")
+LINE_END_RE = re.compile(rb"[\r\n]")
+MAX_PENDING_BYTES = 4096
+
+_DEFAULT_CALLBACK = None
+
+
+def set_default_progress_callback(callback):
+    # used by the run_cmd calls that do not get their own callback
+    global _DEFAULT_CALLBACK
+    _DEFAULT_CALLBACK = callback
+
+
+def get_default_progress_callback():
+    return _DEFAULT_CALLBACK
+
+
+def _clean_step_label(text):
+    text = text.decode(errors="replace").replace("\b", "").strip()
+    return text.rstrip(":").strip()
+
+
+class PlinkProgressParser:
+    # the output is fed as it arrives, only the unfinished part of the
+    # current line is kept
+    def __init__(self, callback, source=None, clock=time.monotonic):
+        self._callback = callback
+        self._source = source
+        self._clock = clock
+        self._pending = b""
+        self._step = None
+        self._line_has_step = False
+        self._last_percent = None
+        self._step_start = None
+
+    def feed(self, data):
+        lines = LINE_END_RE.split(self._pending + data)
+        self._pending = lines.pop()
+        for line in lines:
+            self._parse(line)
+            self._line_has_step = False
+        parsed_end = self._parse(self._pending)
+        self._pending = self._pending[parsed_end:][-MAX_PENDING_BYTES:]
+
+    def close(self):
+        self._parse(self._pending)
+        self._pending = b""
+
+    def _parse(self, text):
+        parsed_end = 0
+        for match in PERCENT_RE.finditer(text):
+            if not self._line_has_step:
+                self._start_line(_clean_step_label(text[: match.start()]))
+            self._emit(int(match.group(1)))
+            parsed_end = match.end()
+        return parsed_end
+
+    def _start_line(self, step):
+        # plink2 can redraw a step in a new line, the step keeps its timing
+        self._line_has_step = True
+        if step and step != self._step:
+            self._step = step
+            self._last_percent = None
+            self._step_start = None
+
+    def _emit(self, percent):
+        if percent == self._last_percent or percent > 100:
+            return
+        now = self._clock()
+        if self._step_start is None:
+            self._step_start = (now, percent)
+        start_time, start_percent = self._step_start
+        elapsed = now - start_time
+        rate = (percent - start_percent) / elapsed if elapsed > 0 else None
+        eta = (100 - percent) / rate if rate else None
+        self._last_percent = percent
+        self._callback(
+            {
+                "source": self._source,
+                "step": self._step,
+                "percent": percent,
+                "elapsed": elapsed,
+                "rate": rate,
+                "eta": eta,
+            }
+        )
+
+
+def _format_seconds(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def create_progress_printer(min_interval=10, fhand=None, clock=time.monotonic):
+    # a line per step every min_interval seconds at most, and always the
+    # first and the last percentages
+    last_printed = {}
+
+    def print_progress(event):
+        key = (event["source"], event["step"])
+        now = clock()
+        is_edge = event["percent"] in (0, 100) or key not in last_printed
+        if not is_edge and now - last_printed[key] < min_interval:
+            return
+        last_printed[key] = now
+        eta = "unknown" if event["eta"] is None else _format_seconds(event["eta"])
+        source = f"{event['source']}: " if event["source"] else ""
+        print(
+            f"{source}{event['step']} {event['percent']}% "
+            f"(elapsed {_format_seconds(event['elapsed'])}, ETA {eta})",
+            file=fhand if fhand is not None else sys.stderr,
+            flush=True,
+        )
+
+    return print_progress
@@ -0,0 +1,292 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy
+import pandas
+
+from src.config import EXECUTABLES_REQUIREMENTS as exec_recs
+from src.dependencies import get_executables
+from src.manifest import fingerprint_file
+from src.plink import (
+    VariantFilters,
+    get_allele_freqs_path,
+    open_plink_output,
+    run_cmd,
+)
+
+QC_STATS_SUFFIX = ".variant_qc.npz"
+
+
+def _read_plink2_table(path, columns, dtypes):
+    with open_plink_output(path) as fhand:
+        return pandas.read_csv(
+            fhand,
+            sep="\t",
+            usecols=columns,
+            dtype=dtypes,
+            na_values=["NA", "nan"],
+        )
+
+
+def read_afreq(afreq_path):
+    afreq = _read_plink2_table(
+        afreq_path,
+        ["#CHROM", "ID", "ALT_FREQS", "OBS_CT"],
+        {
+            "#CHROM": str,
+            "ID": str,
+            "ALT_FREQS": numpy.float32,
+            "OBS_CT": numpy.int32,
+        },
+    )
+    return afreq.rename(
+        columns={
+            "#CHROM": "chrom",
+            "ID": "variant_id",
+            "ALT_FREQS": "alt_freq",
+            "OBS_CT": "n_obs_alleles",
+        }
+    )
+
+
+def read_vmiss(vmiss_path):
+    vmiss = _read_plink2_table(
+        vmiss_path,
+        ["#CHROM", "ID", "MISSING_CT", "F_MISS"],
+        {
+            "#CHROM": str,
+            "ID": str,
+            "MISSING_CT": numpy.int32,
+            "F_MISS": numpy.float32,
+        },
+    )
+    return vmiss.rename(
+        columns={
+            "#CHROM": "chrom",
+            "ID": "variant_id",
+            "MISSING_CT": "n_missing",
+            "F_MISS": "missing_rate",
+        }
+    )
+
+
+def read_hardy(hardy_path):
+    hardy = _read_plink2_table(
+        hardy_path,
+        ["#CHROM", "ID", "O(HET_A1)", "E(HET_A1)", "P"],
+        {
+            "#CHROM": str,
+            "ID": str,
+            "O(HET_A1)": numpy.float32,
+            "E(HET_A1)": numpy.float32,
+            "P": numpy.float64,
+        },
+    )
+    return hardy.rename(
+        columns={
+            "#CHROM": "chrom",
+            "ID": "variant_id",
+            "O(HET_A1)": "obs_het",
+            "E(HET_A1)": "exp_het",
+            "P": "hwe_pval",
+        }
+    )
+
+
+def get_qc_base_path(bfiles_base_path, keep_path=None):
+    # the stats of a sample subset are cached apart from the full set ones
+    if keep_path is None:
+        return Path(str(bfiles_base_path) + ".qc")
+    return Path(str(bfiles_base_path) + f".qc_{fingerprint_file(keep_path)[:16]}")
+
+
+def _merge_qc_tables(afreq, vmiss, hardy):
+    # plink2 writes the three reports in the .bim order
+    if not (
+        numpy.array_equal(afreq["variant_id"].values, vmiss["variant_id"].values)
+        and numpy.array_equal(afreq["variant_id"].values, hardy["variant_id"].values)
+    ):
+        raise RuntimeError("The plink2 QC reports do not have the same variants")
+    qc_stats = afreq.set_index("variant_id")
+    alt_freqs = qc_stats["alt_freq"].values
+    qc_stats["maf"] = numpy.minimum(alt_freqs, 1 - alt_freqs)
+    qc_stats["missing_rate"] = vmiss["missing_rate"].values
+    for col in ("obs_het", "exp_het", "hwe_pval"):
+        qc_stats[col] = hardy[col].values
+    return qc_stats
+
+
+def _save_qc_stats(qc_stats, stats_path):
+    arrays = {col: qc_stats[col].values for col in qc_stats.columns}
+    arrays["chrom"] = numpy.asarray(arrays["chrom"], dtype=str)
+    arrays["variant_id"] = numpy.asarray(qc_stats.index, dtype=str)
+    with Path(stats_path).open("wb") as fhand:
+        numpy.savez(fhand, **arrays)
+
+
+def _load_qc_stats(stats_path):
+    with numpy.load(stats_path) as arrays:
+        qc_stats = pandas.DataFrame(
+            {key: arrays[key] for key in arrays.files if key != "variant_id"},
+            index=pandas.Index(arrays["variant_id"], name="variant_id"),
+        )
+    return qc_stats
+
+
+def _is_cache_valid(cache_path, bfiles_base_path):
+    bed_path = Path(str(bfiles_base_path) + ".bed")
+    return (
+        cache_path.exists() and cache_path.stat().st_mtime >= bed_path.stat().st_mtime
+    )
+
+
+def load_cached_qc_stats(bfiles_base_path, keep_path=None):
+    qc_base_path = get_qc_base_path(bfiles_base_path, keep_path=keep_path)
+    stats_path = Path(str(qc_base_path) + QC_STATS_SUFFIX)
+    if not _is_cache_valid(stats_path, bfiles_base_path):
+        return None
+    return _load_qc_stats(stats_path)
+
+
+def run_variant_qc(bfiles_base_path, keep_path=None, overwrite=False):
+    qc_base_path = get_qc_base_path(bfiles_base_path, keep_path=keep_path)
+    stats_path = Path(str(qc_base_path) + QC_STATS_SUFFIX)
+    paths = {
+        "afreq_path": Path(str(qc_base_path) + ".afreq"),
+        "vmiss_path": Path(str(qc_base_path) + ".vmiss"),
+        "hardy_path": Path(str(qc_base_path) + ".hardy"),
+        "stats_path": stats_path,
+    }
+    if not overwrite and _is_cache_valid(stats_path, bfiles_base_path):
+        return {"stats": _load_qc_stats(stats_path), **paths}
+
+    # a single pass over the .bed for the three reports
+    cmd = [get_executables(exec_recs["plink2"])]
+    cmd.extend(["--bfile", str(bfiles_base_path)])
+    if keep_path:
+        cmd.extend(["--keep", str(keep_path)])
+    cmd.append("--allow-extra-chr")
+    cmd.extend(["--freq", "--missing", "variant-only", "--hardy"])
+    cmd.extend(["--out", str(qc_base_path)])
+    stderr_path = Path(str(qc_base_path) + ".stderr")
+    stdout_path = Path(str(qc_base_path) + ".stdout")
+    run_cmd(cmd, stdout_path, stderr_path)
+
+    # the frequencies are shared with the plink2 commands that use --read-freq
+    afreq_cache_path = get_allele_freqs_path(bfiles_base_path, keep_path=keep_path)
+    if not afreq_cache_path.exists():
+        # other processes could be reading it, it is copied apart and renamed
+        tmp_path = Path(f"{afreq_cache_path}.{os.getpid()}.tmp")
+        shutil.copyfile(paths["afreq_path"], tmp_path)
+        tmp_path.replace(afreq_cache_path)
+
+    qc_stats = _merge_qc_tables(
+        read_afreq(paths["afreq_path"]),
+        read_vmiss(paths["vmiss_path"]),
+        read_hardy(paths["hardy_path"]),
+    )
+    _save_qc_stats(qc_stats, stats_path)
+    return {"stats": qc_stats, **paths}
+
+
+def select_variants_passing_qc(
+    qc_stats, min_maf=None, max_missing_rate=None, min_hwe_pval=None
+):
+    passes = numpy.ones(qc_stats.shape[0], dtype=bool)
+    if min_maf is not None:
+        passes &= qc_stats["maf"].values >= min_maf
+    if max_missing_rate is not None:
+        passes &= qc_stats["missing_rate"].values <= max_missing_rate
+    if min_hwe_pval is not None:
+        passes &= qc_stats["hwe_pval"].values >= min_hwe_pval
+    return qc_stats.index[passes]
+
+
+def write_variants_passing_qc(
+    qc_stats, out_path, min_maf=None, max_missing_rate=None, min_hwe_pval=None
+):
+    # an --extract list computed from the cached stats, plink2 does not need
+    # to recompute the frequencies and missingness to apply the filters
+    variant_ids = select_variants_passing_qc(
+        qc_stats,
+        min_maf=min_maf,
+        max_missing_rate=max_missing_rate,
+        min_hwe_pval=min_hwe_pval,
+    )
+    Path(out_path).write_text("".join(f"{variant_id}\n" for variant_id in variant_ids))
+    return {"extract_path": Path(out_path), "n_variants": len(variant_ids)}
+
+
+def create_qc_variant_filters(qc_stats, variant_filters: VariantFilters, extract_path):
+    # the --maf and --geno filters are applied to the cached stats, the
+    # variants kept have to be in the variant filters lists too
+    variant_ids = select_variants_passing_qc(
+        qc_stats, **variant_filters.get_qc_thresholds()
+    )
+    if variant_filters.lists_of_vars_to_keep_paths:
+        listed_ids = set()
+        for path in variant_filters.lists_of_vars_to_keep_paths:
+            listed_ids.update(Path(path).read_text().split())
+        variant_ids = variant_ids[variant_ids.isin(listed_ids)]
+    tmp_path = Path(f"{extract_path}.{os.getpid()}.tmp")
+    tmp_path.write_text("".join(f"{variant_id}\n" for variant_id in variant_ids))
+    tmp_path.replace(extract_path)
+    return VariantFilters(
+        max_major_freq=None,
+        max_missing_rate=None,
+        lists_of_vars_to_keep_paths=[Path(extract_path)],
+    )
+
+
+def summarize_variant_qc(
+    qc_stats, mafs=(0.01, 0.05), missing_rates=(0.1,), hwe_pvals=(1e-6,)
+):
+    summary = {"n_variants": int(qc_stats.shape[0])}
+    for maf in mafs:
+        summary[f"n_maf_under_{maf}"] = int((qc_stats["maf"] < maf).sum())
+    for missing_rate in missing_rates:
+        summary[f"n_missing_over_{missing_rate}"] = int(
+            (qc_stats["missing_rate"] > missing_rate).sum()
+        )
+    for hwe_pval in hwe_pvals:
+        summary[f"n_hwe_pval_under_{hwe_pval}"] = int(
+            (qc_stats["hwe_pval"] < hwe_pval).sum()
+        )
+    return pandas.Series(summary)
+
+
+def plot_variant_qc(qc_stats, out_base_path, n_bins=50, max_log_pval=50):
+    from src import plot
+
+    mafs = qc_stats["maf"].values
+    missing_rates = qc_stats["missing_rate"].values
+    with numpy.errstate(divide="ignore"):
+        log_pvals = numpy.minimum(-numpy.log10(qc_stats["hwe_pval"].values), max_log_pval)
+    maf_hist = plot.HistogramAccumulator.from_range((0, 0.5), n_bins).update(mafs)
+    missing_hist = plot.HistogramAccumulator.from_range((0, 1), n_bins).update(
+        missing_rates
+    )
+    hwe_hist = plot.HistogramAccumulator.from_range((0, max_log_pval), n_bins).update(
+        log_pvals
+    )
+    maf_missing_hist = plot.Histogram2DAccumulator.from_ranges(
+        (0, 0.5), (0, 1), n_bins, n_bins
+    ).update(mafs, missing_rates)
+
+    plot_paths = {}
+    for name, hist, x_label in (
+        ("maf", maf_hist, "MAF"),
+        ("missing_rate", missing_hist, "Variant missing rate"),
+        ("hwe", hwe_hist, "-log10(HWE p-value)"),
+    ):
+        fig = plot.SimpleFigure()
+        hist.plot(fig.axes)
+        plot.set_x_label(fig.axes, x_label)
+        plot.set_y_label(fig.axes, "Num. variants")
+        plot_paths[name] = Path(f"{out_base_path}.{name}_hist.png")
+        fig.save_fig(plot_paths[name])
+    fig = plot.plot_2d_joinplot_from_hist(maf_missing_hist, map_log=True)
+    plot_paths["maf_vs_missing_rate"] = Path(f"{out_base_path}.maf_vs_missing_rate.png")
+    fig.save_fig(plot_paths["maf_vs_missing_rate"])
+    return plot_paths
@@ -0,0 +1,98 @@
+import json
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas
+
+from src.hits import concat_hits_files
+
+
+def parse_shard(shard):
+    try:
+        shard_idx, n_shards = map(int, shard.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard should be given as i/N, but it is: {shard}")
+    if n_shards < 1 or not 0 <= shard_idx < n_shards:
+        raise ValueError(f"Shard index should be between 0 and N - 1: {shard}")
+    return shard_idx, n_shards
+
+
+def select_shard_traits(traits, shard_idx, n_shards):
+    # round robin over the sorted traits, so every invocation gets the same
+    # traits whatever the column order of the traits table
+    return sorted(traits)[shard_idx::n_shards]
+
+
+def get_shard_dir(out_dir, shard_idx, n_shards):
+    return Path(out_dir) / f"shard_{shard_idx}_of_{n_shards}"
+
+
+def _get_shard_dirs(out_dir):
+    shard_dirs = sorted(Path(out_dir).glob("shard_*_of_*"))
+    if not shard_dirs:
+        raise RuntimeError(f"No shard_*_of_N dirs found in {out_dir}")
+    n_shards = {int(shard_dir.name.split("_of_")[1]) for shard_dir in shard_dirs}
+    if len(n_shards) != 1:
+        raise ValueError(f"Shards from different runs found in {out_dir}: {n_shards}")
+    n_shards = n_shards.pop()
+    if len(shard_dirs) != n_shards:
+        raise RuntimeError(f"Only {len(shard_dirs)} of {n_shards} shards found in {out_dir}")
+    return shard_dirs
+
+
+def merge_shards(out_dir, out_base_name):
+    out_dir = Path(out_dir)
+    shard_dirs = _get_shard_dirs(out_dir)
+
+    hits_paths = []
+    summaries = []
+    traits = {}
+    for shard_dir in shard_dirs:
+        manifest_path = shard_dir / f"{out_base_name}.manifest.json"
+        summary_path = shard_dir / f"{out_base_name}_trait_summary.csv"
+        if not manifest_path.exists() or not summary_path.exists():
+            raise RuntimeError(f"Shard not finished: {shard_dir}")
+        with manifest_path.open("rt") as fhand:
+            shard_traits = json.load(fhand)["traits"]
+        for trait, record in shard_traits.items():
+            record["shard"] = shard_dir.name
+            if "hits_path" in record["outputs"]:
+                # relative to the shard, so the shards can be moved before merging
+                hits_name = Path(record["outputs"]["hits_path"]).name
+                hits_paths.append(shard_dir / trait / hits_name)
+        traits.update(shard_traits)
+        summaries.append(pandas.read_csv(summary_path).assign(shard=shard_dir.name))
+
+    genome_wide_hits = concat_hits_files(hits_paths)
+    genome_wide_hits_path = out_dir / f"{out_base_name}_genome_wide_hits.csv"
+    genome_wide_hits.to_csv(genome_wide_hits_path, index=False)
+
+    summary = pandas.concat(summaries, ignore_index=True).sort_values("trait")
+    summary_path = out_dir / f"{out_base_name}_trait_summary.csv"
+    summary.to_csv(summary_path, index=False)
+
+    report_path = out_dir / f"{out_base_name}.manifest.json"
+    with report_path.open("wt") as fhand:
+        json.dump({"traits": traits}, fhand, indent=2, sort_keys=True)
+    return {
+        "genome_wide_hits_path": genome_wide_hits_path,
+        "summary_path": summary_path,
+        "report_path": report_path,
+    }
+
+
+def launch_local_shards(gwas_script_path, gwas_args, n_shards, n_processes):
+    # stand-in for a cluster scheduler, one gwas.py process per shard
+    def run_shard(shard_idx):
+        cmd = [sys.executable, str(gwas_script_path)] + list(gwas_args)
+        cmd.extend(["--shard", f"{shard_idx}/{n_shards}"])
+        print("Running: ", " ".join(cmd))
+        return subprocess.run(cmd).returncode
+
+    with ThreadPoolExecutor(max_workers=n_processes) as executor:
+        return_codes = list(executor.map(run_shard, range(n_shards)))
+    failed = [idx for idx, code in enumerate(return_codes) if code != 0]
+    if failed:
+        raise RuntimeError(f"Shards failed: {failed}")
@@ -0,0 +1,138 @@
+import json
+import sys
+from pathlib import Path
+
+import numpy
+import pandas
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def write_bfiles(base_path, chroms, poss, n_samples=8, seed=0, sample_names=None):
+    # random genotypes, every .bed byte holds 4 samples
+    base_path = Path(base_path)
+    variant_ids = [f"{chrom}:{pos}" for chrom, pos in zip(chroms, poss)]
+    pandas.DataFrame(
+        {"chrom": chroms, "id": variant_ids, "cm": 0, "pos": poss, "a1": "A", "a2": "T"}
+    ).to_csv(str(base_path) + ".bim", sep="\t", header=False, index=False)
+    if sample_names is None:
+        sample_names = [f"s{idx}" for idx in range(n_samples)]
+    n_samples = len(sample_names)
+    pandas.DataFrame(
+        {"fid": sample_names, "iid": sample_names, "f": 0, "m": 0, "s": 0, "p": -9}
+    ).to_csv(str(base_path) + ".fam", sep=" ", header=False, index=False)
+    rng = numpy.random.default_rng(seed)
+    n_bytes = len(variant_ids) * ((n_samples + 3) // 4)
+    genotypes = rng.choice(numpy.array([0, 2, 3], dtype=numpy.uint8), size=n_bytes * 4)
+    packed = genotypes.reshape(-1, 4)
+    packed = packed[:, 0] | (packed[:, 1] << 2) | (packed[:, 2] << 4) | (packed[:, 3] << 6)
+    Path(str(base_path) + ".bed").write_bytes(b"\x6c\x1b\x01" + packed.tobytes())
+    return {"bfiles_base_path": base_path, "variant_ids": variant_ids, "samples": sample_names}
+
+
+@pytest.fixture
+def tiny_bfiles(tmp_path):
+    chroms = ["ch01"] * 3 + ["ch02"] * 2
+    poss = [100, 200, 300, 50, 150]
+    return write_bfiles(tmp_path / "tiny", chroms, poss)
+
+
+FAKE_PLINK2 = """#!{python}
+import json
+import shutil
+import sys
+
+args = sys.argv[1:]
+out = args[args.index("--out") + 1] if "--out" in args else args[args.index("-out") + 1]
+with open({calls_path!r}, "at") as fhand:
+    fhand.write(json.dumps(args) + "\\n")
+if "--make-bed" in args:
+    bfile = args[args.index("--bfile") + 1]
+    for suffix in (".bed", ".bim", ".fam"):
+        shutil.copyfile(bfile + suffix, out + suffix)
+
+
+def write_output(path, text, compressed):
+    if compressed:
+        import zstandard
+
+        with open(path + ".zst", "wb") as fhand:
+            fhand.write(zstandard.ZstdCompressor().compress(text.encode()))
+    else:
+        with open(path, "wt") as fhand:
+            fhand.write(text)
+
+
+if "--linear" in args:
+    # every variant of the .bim gets a p-value, in .bim order
+    bfile = args[args.index("--bfile") + 1]
+    with open(bfile + ".bim") as fhand:
+        variants = [line.split() for line in fhand]
+    if "--chr" in args:
+        chroms = []
+        for arg in args[args.index("--chr") + 1:]:
+            if arg.startswith("-"):
+                break
+            chroms.append(arg)
+        variants = [variant for variant in variants if variant[0] in chroms]
+    if "--from-bp" in args:
+        from_bp = int(args[args.index("--from-bp") + 1])
+        to_bp = int(args[args.index("--to-bp") + 1])
+        variants = [variant for variant in variants if from_bp <= int(variant[3]) <= to_bp]
+    pheno = args[args.index("--pheno-name") + 1] if "--pheno-name" in args else "PHENO1"
+    compressed = "zs" in args[args.index("--linear"):]
+    glm_path = f"{{out}}.{{pheno}}.glm.linear"
+    lines = ["#CHROM\\tPOS\\tID\\tA1\\tTEST\\tP"]
+    adjusted = ["#CHROM\\tID\\tA1\\tUNADJ\\tBONF"]
+    for idx, (chrom, variant_id, _, pos, a1, _) in enumerate(variants):
+        pval = (idx + 1) / (len(variants) + 1)
+        lines.append(f"{{chrom}}\\t{{pos}}\\t{{variant_id}}\\t{{a1}}\\tADD\\t{{pval}}")
+        adjusted.append(
+            f"{{chrom}}\\t{{variant_id}}\\t{{a1}}\\t{{pval}}\\t{{min(pval * len(variants), 1)}}"
+        )
+    write_output(glm_path, "\\n".join(lines) + "\\n", compressed)
+    if "--adjust" in args:
+        write_output(glm_path + ".adjusted", "\\n".join(adjusted) + "\\n", compressed)
+if "--hardy" in args:
+    # the three QC reports, every variant with the same made up stats
+    bfile = args[args.index("--bfile") + 1]
+    with open(bfile + ".bim") as fhand:
+        variants = [line.split() for line in fhand]
+    reports = {{
+        ".afreq": ("#CHROM\\tID\\tREF\\tALT\\tALT_FREQS\\tOBS_CT", "A\\tT\\t0.25\\t16"),
+        ".vmiss": ("#CHROM\\tID\\tMISSING_CT\\tOBS_CT\\tF_MISS", "0\\t8\\t0"),
+        ".hardy": ("#CHROM\\tID\\tA1\\tAX\\tHOM_A1_CT\\tHET_A1AX_CT\\tTWO_AX_CT\\t"
+                   "O(HET_A1)\\tE(HET_A1)\\tP", "A\\tT\\t1\\t2\\t5\\t0.25\\t0.375\\t0.5"),
+    }}
+    for suffix, (header, stats) in reports.items():
+        with open(out + suffix, "wt") as fhand:
+            fhand.write(header + "\\n")
+            for variant in variants:
+                fhand.write(f"{{variant[0]}}\\t{{variant[1]}}\\t{{stats}}\\n")
+with open(out + ".log", "wt") as fhand:
+    fhand.write("fake plink2\\n")
+print("fake plink2 done")
+"""
+
+
+@pytest.fixture
+def fake_plink2(tmp_path, monkeypatch):
+    # a plink2 that records its arguments, copies the --bfile on --make-bed
+    # writes a p-value per variant on --linear and the QC reports on --hardy
+    bin_dir = tmp_path / "fake_bin"
+    bin_dir.mkdir()
+    calls_path = tmp_path / "plink2_calls.jsonl"
+    script_path = bin_dir / "plink2"
+    script_path.write_text(
+        FAKE_PLINK2.format(python=sys.executable, calls_path=str(calls_path))
+    )
+    script_path.chmod(0o755)
+    monkeypatch.setenv("PLINK_PATH", str(bin_dir))
+
+    def get_calls():
+        if not calls_path.exists():
+            return []
+        return [json.loads(line) for line in calls_path.read_text().splitlines()]
+
+    return get_calls
@@ -0,0 +1,32 @@
+from src import annotation
+
+
+def _annotate(gene_index):
+    return list(gene_index.annotate(["ch01", "ch01"], [150, 450])["overlapping_genes"])
+
+
+def test_gene_index_cache_depends_on_the_feature_types_and_the_gff(tmp_path):
+    gff_path = tmp_path / "genes.gff3"
+    gff_path.write_text(
+        "##gff-version 3\n"
+        "ch01\tsrc\tgene\t100\t200\t.\t+\t.\tID=gene1\n"
+        "ch01\tsrc\tmRNA\t400\t500\t.\t+\t.\tID=mrna1\n"
+    )
+    assert _annotate(annotation.load_gene_index(gff_path)) == ["gene1", ""]
+    assert _annotate(annotation.load_gene_index(gff_path, feature_types=("mRNA",))) == [
+        "",
+        "mrna1",
+    ]
+    # the cached index is reused for the same features
+    assert _annotate(annotation.load_gene_index(gff_path, feature_types=("mRNA",))) == [
+        "",
+        "mrna1",
+    ]
+    assert not list(tmp_path.glob("*.tmp"))
+
+    gff_path.write_text(
+        "##gff-version 3\n"
+        "ch01\tsrc\tgene\t100\t200\t.\t+\t.\tID=gene1\n"
+        "ch01\tsrc\tgene\t400\t500\t.\t+\t.\tID=gene2\n"
+    )
+    assert _annotate(annotation.load_gene_index(gff_path)) == ["gene1", "gene2"]
@@ -0,0 +1,100 @@
+import numpy
+import pandas
+import pytest
+from scipy import stats
+
+from src import burden
+from src.bed import BedReader
+
+from conftest import write_bfiles
+
+
+def test_liu_pvalues_are_exact_for_equal_eigenvalues():
+    # k equal eigenvalues l: Q / l is a chi2 with k degrees of freedom
+    q_stats = numpy.array([0.5, 3.0, 12.0, 40.0])
+    for n_eigenvals, eigenval in [(1, 2.0), (3, 0.5), (10, 4.0)]:
+        cumulants = [n_eigenvals * eigenval**power for power in (1, 2, 3, 4)]
+        assert numpy.allclose(
+            burden.calc_liu_pvalues(q_stats, cumulants),
+            stats.chi2.sf(q_stats / eigenval, n_eigenvals),
+        )
+
+
+def test_window_groups():
+    variants = pandas.DataFrame(
+        {"chrom": ["ch01"] * 4 + ["ch02"] * 2, "pos": [10, 900, 2500, 2600, 1500, 1700]}
+    )
+    groups = burden.create_window_groups(variants, window_kb=1)
+    assert groups[["group_id", "variant_start", "variant_stop"]].values.tolist() == [
+        ["ch01:1-1000", 0, 2],
+        ["ch01:2001-3000", 2, 4],
+        ["ch02:1001-2000", 4, 6],
+    ]
+
+    unsorted = variants.assign(pos=[10, 900, 2600, 2500, 1500, 1700])
+    with pytest.raises(ValueError):
+        burden.create_window_groups(unsorted)
+
+
+def _calc_score_test(genotypes, phenotypes, design):
+    # chi2 score test of the burden of the genotypes in a linear model,
+    # with the variance estimated under the null
+    hat = design @ numpy.linalg.solve(design.T @ design, design.T)
+    residuals = phenotypes - hat @ phenotypes
+    variance = residuals @ residuals / (design.shape[0] - design.shape[1])
+    projected = genotypes - hat @ genotypes
+    return (genotypes @ residuals) ** 2 / (variance * (projected @ genotypes))
+
+
+def test_region_tests_match_the_score_test(tmp_path):
+    n_samples = 60
+    bfiles = write_bfiles(
+        tmp_path / "geno", ["ch01"] * 5, [100, 200, 300, 5100, 5200], n_samples=n_samples
+    )
+    rng = numpy.random.default_rng(1)
+    genotypes = BedReader(bfiles["bfiles_base_path"]).read_genotypes().astype(float)
+    covars = rng.normal(size=n_samples)
+    values = 0.4 * covars + 0.3 * genotypes[:, 0] + rng.normal(size=n_samples)
+    phenotypes = pandas.Series(values, index=bfiles["samples"])
+    covars_path = tmp_path / "geno.cov"
+    pandas.DataFrame(
+        {"#FID": bfiles["samples"], "IID": bfiles["samples"], "PC1": covars}
+    ).to_csv(covars_path, sep="\t", index=False)
+
+    variants = BedReader(bfiles["bfiles_base_path"]).variants
+    groups = pandas.concat(
+        [
+            burden.create_window_groups(variants, window_kb=1),
+            # a group with a single variant
+            pandas.DataFrame(
+                [["single", "ch01", 5200, 5200, 4, 5]], columns=burden.GROUP_COLUMNS
+            ),
+        ],
+        ignore_index=True,
+    )
+    res = burden.do_region_tests(
+        bfiles["bfiles_base_path"],
+        phenotypes,
+        groups,
+        covars_path=covars_path,
+        max_maf=0.5,
+    ).set_index("group_id")
+
+    # dosages of the minor allele, with the SKAT beta weights
+    freqs = genotypes.mean(axis=0) / 2
+    genotypes[:, freqs > 0.5] = 2 - genotypes[:, freqs > 0.5]
+    weights = stats.beta.pdf(numpy.minimum(freqs, 1 - freqs), 1, 25)
+    design = numpy.column_stack([numpy.ones(n_samples), covars])
+    for group_id, start, stop in [
+        ("ch01:1-1000", 0, 3),
+        ("ch01:5001-6000", 3, 5),
+        ("single", 4, 5),
+    ]:
+        burden_genotypes = genotypes[:, start:stop] @ weights[start:stop]
+        chi2 = _calc_score_test(burden_genotypes, values, design)
+        assert res.loc[group_id, "n_rare_variants"] == stop - start
+        assert numpy.isclose(res.loc[group_id, "burden_pval"], stats.chi2.sf(chi2, 1))
+
+    # with a single variant the SKAT statistic is the squared burden score
+    assert numpy.isclose(res.loc["single", "skat_pval"], res.loc["single", "burden_pval"])
+    assert res["skat_pval"].is_monotonic_increasing
@@ -0,0 +1,96 @@
+import numpy
+from scipy import stats
+
+from src import association
+from src import conditional
+
+
+def _calc_ols_pvalue(phenotypes, design):
+    # the t-test of the last column of the design
+    betas, _, _, _ = numpy.linalg.lstsq(design, phenotypes, rcond=None)
+    residuals = phenotypes - design @ betas
+    dof = design.shape[0] - design.shape[1]
+    covariance = numpy.linalg.inv(design.T @ design) * (residuals @ residuals) / dof
+    t_stat = betas[-1] / numpy.sqrt(covariance[-1, -1])
+    return 2 * stats.t.sf(abs(t_stat), dof)
+
+
+def _create_data(n_samples=200, n_variants=12, seed=0):
+    rng = numpy.random.default_rng(seed)
+    covars = rng.normal(size=(n_samples, 2))
+    genotypes = rng.integers(0, 3, size=(n_samples, n_variants)).astype(float)
+    # a variant in LD with the first signal
+    genotypes[:, 4] = numpy.where(rng.random(n_samples) < 0.9, genotypes[:, 2], 0)
+    phenotypes = (
+        0.5 * covars[:, 0]
+        + 1.0 * genotypes[:, 2]
+        + 0.6 * genotypes[:, 7]
+        + rng.normal(size=n_samples)
+    )
+    return {"covars": covars, "genotypes": genotypes, "phenotypes": phenotypes}
+
+
+def test_conditional_steps_match_an_ols_refit():
+    data = _create_data()
+    genotypes, phenotypes = data["genotypes"], data["phenotypes"]
+    n_samples, n_variants = genotypes.shape
+    covariate_basis = association.create_covariate_basis(n_samples, covars=data["covars"])
+    res = conditional.condition_region(
+        genotypes, phenotypes, covariate_basis, pval_threshold=1e-4
+    )
+
+    base_design = numpy.column_stack([numpy.ones(n_samples), data["covars"]])
+    marginal_pvalues = [
+        _calc_ols_pvalue(phenotypes, numpy.column_stack([base_design, genotypes[:, idx]]))
+        for idx in range(n_variants)
+    ]
+    assert numpy.allclose(res["marginal_pvalues"], marginal_pvalues, rtol=1e-6)
+
+    assert [step["variant_idx"] for step in res["steps"]] == [2, 7]
+    selected_idxs = []
+    for step in res["steps"]:
+        # every step is the best variant of the model with the covariates
+        # plus the variants already selected
+        design = numpy.column_stack([base_design, genotypes[:, selected_idxs]])
+        conditional_pvalues = numpy.array(
+            [
+                _calc_ols_pvalue(phenotypes, numpy.column_stack([design, genotypes[:, idx]]))
+                if idx not in selected_idxs
+                else numpy.nan
+                for idx in range(n_variants)
+            ]
+        )
+        assert step["variant_idx"] == numpy.nanargmin(conditional_pvalues)
+        assert numpy.isclose(
+            step["conditional_pval"], conditional_pvalues[step["variant_idx"]], rtol=1e-6
+        )
+        selected_idxs.append(step["variant_idx"])
+
+
+def test_collinear_variants_are_not_selected():
+    data = _create_data()
+    genotypes = data["genotypes"]
+    # an exact copy of the lead variant
+    genotypes[:, 5] = genotypes[:, 2]
+    covariate_basis = association.create_covariate_basis(
+        genotypes.shape[0], covars=data["covars"]
+    )
+    res = conditional.condition_region(
+        genotypes, data["phenotypes"], covariate_basis, pval_threshold=1e-4
+    )
+    selected_idxs = [step["variant_idx"] for step in res["steps"]]
+    assert selected_idxs[1:] == [7]
+    assert not {2, 5}.issubset(selected_idxs)
+
+
+def test_overlapping_regions_are_merged():
+    regions = conditional.create_regions(
+        ["ch02", "ch01", "ch01", "ch01"],
+        [100_000, 1_200_000, 100_000, 500_000],
+        window_kb=250,
+    )
+    assert regions.values.tolist() == [
+        ["ch01", 0, 750_000],
+        ["ch01", 950_000, 1_450_000],
+        ["ch02", 0, 350_000],
+    ]
@@ -0,0 +1,81 @@
+import numpy
+import pytest
+
+from src import genotype_cache
+from src.bed import BedReader
+
+from conftest import write_bfiles
+
+
+def _write_random_bfiles(base_path, n_variants=10):
+    return write_bfiles(
+        base_path, ["ch01"] * n_variants, list(range(1, n_variants + 1)), n_samples=6
+    )
+
+
+def _read_block(block_ref):
+    with genotype_cache.attach_genotype_block(block_ref) as genotypes:
+        return genotypes.copy()
+
+
+def _sum_block(genotypes, start, stop, task):
+    return task * genotypes.sum(axis=0)
+
+
+def test_blocks_are_evicted_in_lru_order(tmp_path):
+    bfiles_base_path = _write_random_bfiles(tmp_path / "geno")["bfiles_base_path"]
+    genotypes = BedReader(bfiles_base_path).read_genotypes()
+
+    with genotype_cache.SharedGenotypeBlockCache(
+        bfiles_base_path, block_size=4, max_cached_blocks=2
+    ) as cache:
+        assert cache.n_blocks == 3
+        block_refs = [cache.get_block(block_idx) for block_idx in (0, 1)]
+        # the block 0 is used again, so the block 1 is the oldest one
+        cache.get_block(0)
+        block_refs.append(cache.get_block(2))
+
+        assert numpy.array_equal(_read_block(block_refs[0]), genotypes[:, 0:4])
+        assert numpy.array_equal(_read_block(block_refs[2]), genotypes[:, 8:10])
+        with pytest.raises(FileNotFoundError):
+            _read_block(block_refs[1])
+
+        # an evicted block is decoded again
+        block_ref = cache.get_block(1)
+        assert block_ref["name"] == block_refs[1]["name"]
+        assert numpy.array_equal(_read_block(block_ref), genotypes[:, 4:8])
+        with pytest.raises(IndexError):
+            cache.get_block(3)
+
+    # closing the cache unlinks every segment
+    for block_ref in block_refs:
+        with pytest.raises(FileNotFoundError):
+            _read_block(block_ref)
+
+
+def test_tasks_are_mapped_over_the_blocks(tmp_path):
+    bfiles_base_path = _write_random_bfiles(tmp_path / "geno")["bfiles_base_path"]
+    genotypes = BedReader(bfiles_base_path).read_genotypes()
+
+    with genotype_cache.SharedGenotypeBlockCache(
+        bfiles_base_path, block_size=3, max_cached_blocks=2
+    ) as cache:
+        results = list(
+            genotype_cache.map_tasks_over_blocks(_sum_block, cache, [1, 2], n_workers=2)
+        )
+        block_names = [cache.get_block(block_idx)["name"] for block_idx in range(4)]
+
+    assert [(block_idx, task_idx) for block_idx, task_idx, _ in results] == [
+        (block_idx, task_idx) for block_idx in range(4) for task_idx in range(2)
+    ]
+    sums = numpy.concatenate(
+        [result for _, task_idx, result in results if task_idx == 0]
+    )
+    assert numpy.array_equal(sums, genotypes.sum(axis=0))
+    doubled = numpy.concatenate(
+        [result for _, task_idx, result in results if task_idx == 1]
+    )
+    assert numpy.array_equal(doubled, 2 * genotypes.sum(axis=0))
+    for name in block_names:
+        with pytest.raises(FileNotFoundError):
+            _read_block({"name": name, "shape": (6, 1)})
@@ -0,0 +1,122 @@
+import numpy
+import pandas
+from scipy import optimize
+
+from src import grm
+from src.bed import BedReader
+
+from conftest import write_bfiles
+
+
+def _calc_dense_grm(bfiles_base_path, sample_idxs=None, min_maf=0.01):
+    genotypes = BedReader(bfiles_base_path).read_genotypes(sample_idxs=sample_idxs)
+    genotypes = numpy.array(genotypes, dtype=float)
+    freqs = genotypes.mean(axis=0) / 2
+    is_used = numpy.minimum(freqs, 1 - freqs) >= min_maf
+    genotypes = genotypes[:, is_used]
+    freqs = freqs[is_used]
+    genotypes = (genotypes - 2 * freqs) / numpy.sqrt(2 * freqs * (1 - freqs))
+    return genotypes @ genotypes.T / genotypes.shape[1]
+
+
+def _write_random_bfiles(base_path, n_variants=60, n_samples=20, seed=0):
+    return write_bfiles(
+        base_path, ["ch01"] * n_variants, list(range(1, n_variants + 1)),
+        n_samples=n_samples, seed=seed,
+    )
+
+
+def test_grm_matches_the_dense_product(tmp_path):
+    bfiles_base_path = _write_random_bfiles(tmp_path / "geno")["bfiles_base_path"]
+    res = grm.build_grm(bfiles_base_path, tmp_path / "geno.grm.npy", block_size=7)
+    assert numpy.allclose(res["grm"], _calc_dense_grm(bfiles_base_path), atol=1e-5)
+
+    # the variant ranges of the workers add up to the same matrix
+    res = grm.build_grm(
+        bfiles_base_path, tmp_path / "geno.parallel.grm.npy", n_workers=3, block_size=7
+    )
+    assert numpy.allclose(res["grm"], _calc_dense_grm(bfiles_base_path), atol=1e-5)
+
+
+def test_grm_is_rebuilt_when_its_inputs_change(tmp_path):
+    base_path = tmp_path / "geno"
+    bfiles = _write_random_bfiles(base_path)
+    grm_path = tmp_path / "geno.grm.npy"
+    res = grm.build_grm(bfiles["bfiles_base_path"], grm_path)
+    assert res["sample_names"] == bfiles["samples"]
+
+    # other samples
+    res = grm.build_grm(bfiles["bfiles_base_path"], grm_path, sample_names=["s3", "s1"])
+    assert res["sample_names"] == ["s3", "s1"]
+    assert numpy.allclose(
+        res["grm"], _calc_dense_grm(bfiles["bfiles_base_path"], [3, 1]), atol=1e-5
+    )
+
+    # other genotypes written over the same bfileset
+    _write_random_bfiles(base_path, seed=1)
+    res = grm.build_grm(bfiles["bfiles_base_path"], grm_path)
+    assert numpy.allclose(res["grm"], _calc_dense_grm(bfiles["bfiles_base_path"]), atol=1e-5)
+
+
+def _calc_dense_reml_log_likelihood(log_delta, kinship, phenotypes, design):
+    # the REML likelihood with the total variance profiled out, computed
+    # with the full covariance matrix
+    n_samples, n_covars = design.shape
+    covariance = kinship + numpy.exp(log_delta) * numpy.eye(n_samples)
+    inv_covariance = numpy.linalg.inv(covariance)
+    xtvx = design.T @ inv_covariance @ design
+    projection = inv_covariance - inv_covariance @ design @ numpy.linalg.solve(
+        xtvx, design.T @ inv_covariance
+    )
+    dof = n_samples - n_covars
+    sigma2 = phenotypes @ projection @ phenotypes / dof
+    return -0.5 * (
+        numpy.linalg.slogdet(covariance)[1]
+        + numpy.linalg.slogdet(xtvx)[1]
+        + dof * numpy.log(sigma2)
+    )
+
+
+def test_reml_matches_a_dense_fit():
+    rng = numpy.random.default_rng(3)
+    n_samples = 120
+    genotypes = rng.integers(0, 3, size=(n_samples, 400)).astype(float)
+    genotypes = (genotypes - genotypes.mean(axis=0)) / genotypes.std(axis=0)
+    kinship = genotypes @ genotypes.T / genotypes.shape[1]
+    genetic_values = rng.multivariate_normal(numpy.zeros(n_samples), kinship)
+    covars = rng.normal(size=n_samples)
+    phenotypes = 1 + 0.5 * covars + genetic_values + rng.normal(size=n_samples)
+    design = numpy.column_stack([numpy.ones(n_samples), covars])
+
+    eigenvals, eigenvecs = numpy.linalg.eigh(kinship)
+    eigenvals = numpy.clip(eigenvals, 0, None)
+    res = grm._fit_reml(eigenvals, eigenvecs.T @ phenotypes, eigenvecs.T @ design)
+
+    reference = optimize.minimize_scalar(
+        lambda log_delta: -_calc_dense_reml_log_likelihood(
+            log_delta, kinship, phenotypes, design
+        ),
+        bounds=(-10, 10),
+        method="bounded",
+    )
+    assert numpy.isclose(res["h2"], 1 / (1 + numpy.exp(reference.x)), atol=1e-3)
+    assert numpy.isclose(
+        res["residual_variance"] / res["genetic_variance"], numpy.exp(reference.x), rtol=1e-2
+    )
+
+
+def test_heritability_of_the_traits(tmp_path):
+    bfiles = _write_random_bfiles(tmp_path / "geno", n_samples=40)
+    grm_res = grm.build_grm(bfiles["bfiles_base_path"], tmp_path / "geno.grm.npy")
+    rng = numpy.random.default_rng(4)
+    phenotype_dframe = pandas.DataFrame(
+        {
+            "SAMPLE_NAME": bfiles["samples"],
+            "height": rng.normal(size=40),
+            "weight": numpy.r_[rng.normal(size=30), [numpy.nan] * 10],
+        }
+    )
+    res = grm.estimate_heritability(grm_res, phenotype_dframe)
+    assert list(res.index) == ["height", "weight"]
+    assert list(res["n_samples"]) == [40, 30]
+    assert ((res["h2"] >= 0) & (res["h2"] <= 1)).all()
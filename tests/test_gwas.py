@@ -0,0 +1,103 @@
+from pathlib import Path
+
+import numpy
+import pandas
+import pytest
+
+from src.annotation import GeneIndex
+from src.gwas import _create_top_pvalues_table, clump_hits, do_gwas_analysis
+from src.gwas_result import GwasResult, VariantTable
+
+from conftest import write_bfiles
+
+
+def test_top_pvalues_are_annotated_with_non_positional_ids(tmp_path):
+    gff_path = tmp_path / "genes.gff3"
+    gff_path.write_text(
+        "##gff-version 3\n"
+        "ch01\tsrc\tgene\t100\t200\t.\t+\t.\tID=gene1;Name=G1\n"
+        "ch02\tsrc\tgene\t1000\t2000\t.\t+\t.\tID=gene2\n"
+    )
+    top_hits = pandas.DataFrame(
+        {
+            "variant_id": ["rs1", "ch02:1500:A:T"],
+            "chrom": ["ch01", "ch02"],
+            "pos": [150, 1500],
+            "pval": [1e-10, 1e-9],
+            "bonferroni_pval": [1e-8, 1e-7],
+        }
+    )
+    table = _create_top_pvalues_table(
+        top_hits, ["pval"], gene_index=GeneIndex.from_gff3(gff_path)
+    )
+    assert list(table.index) == ["rs1", "ch02:1500:A:T"]
+    assert list(table["overlapping_genes"]) == ["gene1", "gene2"]
+    assert list(table["pos"]) == [150, 1500]
+    assert "bonferroni_pval" not in table.columns
+
+
+def test_permutations_are_rejected_for_qualitative_traits(tmp_path, tiny_bfiles):
+    phenotype_dframe = pandas.DataFrame(
+        {"SAMPLE_NAME": tiny_bfiles["samples"], "disease": [1, 2] * 4}
+    )
+    with pytest.raises(ValueError, match="quantitative traits"):
+        do_gwas_analysis(
+            tiny_bfiles["bfiles_base_path"],
+            phenotype_dframe,
+            out_base_name="run",
+            out_dir=tmp_path / "gwas",
+            genome_fai_path=None,
+            qualitative=True,
+            n_permutations=10,
+            plots=False,
+        )
+
+
+def _copy_bed_variant(bfiles_base_path, n_samples, from_idx, to_idxs):
+    # the copies are in perfect LD with the original variant
+    bed_path = Path(str(bfiles_base_path) + ".bed")
+    bed = bytearray(bed_path.read_bytes())
+    n_bytes = (n_samples + 3) // 4
+    variant = bed[3 + from_idx * n_bytes : 3 + (from_idx + 1) * n_bytes]
+    for to_idx in to_idxs:
+        bed[3 + to_idx * n_bytes : 3 + (to_idx + 1) * n_bytes] = variant
+    bed_path.write_bytes(bytes(bed))
+
+
+def _create_gwas_result(chroms, poss, pvalues):
+    table = VariantTable(chroms, poss, [f"{chrom}:{pos}" for chrom, pos in zip(chroms, poss)])
+    return GwasResult(
+        table, numpy.arange(len(chroms)), {"pval": -numpy.log10(numpy.array(pvalues))}
+    )
+
+
+def test_hits_are_clumped_into_independent_loci(tmp_path):
+    chroms = ["ch01"] * 5 + ["ch02"]
+    poss = [100, 200, 300, 400, 900_000, 100]
+    n_samples = 40
+    bfiles = write_bfiles(tmp_path / "geno", chroms, poss, n_samples=n_samples)
+    _copy_bed_variant(bfiles["bfiles_base_path"], n_samples, 0, [1, 3, 4, 5])
+    gwas_result = _create_gwas_result(
+        chroms, poss, [1e-10, 1e-9, 1e-12, 0.5, 1e-11, 1e-9]
+    )
+
+    loci = clump_hits(
+        gwas_result, bfiles["bfiles_base_path"], r2_threshold=0.5, window_kb=250
+    )
+    # the leads are taken by p-value, the copies in other chromosomes or
+    # out of the window and the non significant ones are not clumped
+    assert list(loci["variant_id"]) == ["ch01:300", "ch01:900000", "ch01:100", "ch02:100"]
+    assert list(loci["n_clumped_variants"]) == [0, 0, 1, 0]
+    assert loci.loc[2, "clumped_variant_ids"] == "ch01:200"
+    assert list(loci.loc[2, ["locus_start", "locus_end"]]) == [100, 200]
+    assert numpy.allclose(loci["pval"], [1e-12, 1e-11, 1e-10, 1e-9])
+
+    # without LD every significant variant is its own locus
+    loci = clump_hits(gwas_result, bfiles["bfiles_base_path"], r2_threshold=1.1)
+    assert loci.shape[0] == 5
+
+
+def test_clumping_needs_the_gwas_bfileset(tmp_path, tiny_bfiles):
+    gwas_result = _create_gwas_result(["ch01"] * 2, [100, 200], [1e-10, 1e-9])
+    with pytest.raises(ValueError):
+        clump_hits(gwas_result, tiny_bfiles["bfiles_base_path"])
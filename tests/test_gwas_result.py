@@ -0,0 +1,35 @@
+import numpy
+
+from src import plink
+
+
+def test_adjusted_pvalues_with_allele_column(tmp_path, tiny_bfiles):
+    # plink2 --adjust writes an A1 column by default
+    adjusted_path = tmp_path / "tiny.adjusted"
+    adjusted_path.write_text(
+        "#CHROM\tID\tA1\tUNADJ\tGC\tQQ\tBONF\tFDR_BH\n"
+        "ch02\tch02:50\tA\t1e-60\t1e-50\t0.2\t5e-60\t5e-60\n"
+        "ch01\tch01:200\tA\t0.01\t0.02\t0.4\t0.05\t0.025\n"
+        "ch01\tch01:100\tT\t0.5\t0.6\t0.6\t1\t0.6\n"
+        "ch01\tch01:300\tA\tNA\tNA\tNA\tNA\tNA\n"
+    )
+    res = plink._read_adjusted_pvalues(
+        adjusted_path, True, tiny_bfiles["bfiles_base_path"]
+    )
+    gwas_result = res["gwas_result"]
+
+    assert gwas_result.n_variants == 3
+    assert "A1" not in gwas_result.pvalue_cols
+    assert set(gwas_result.pvalue_cols) == {
+        "pval",
+        "genomic_control_corrected_pval",
+        "bonferroni_pval",
+        "benjamini_hochberg_pval",
+    }
+    assert list(gwas_result.variant_ids) == ["ch01:100", "ch01:200", "ch02:50"]
+    assert numpy.allclose(gwas_result.get_pvalues("pval"), [0.5, 0.01, 1e-60])
+    assert numpy.isclose(gwas_result.get_min_pvalue(), 1e-60)
+    dframe = gwas_result.to_dframe()
+    assert list(dframe.columns[:2]) == ["chrom", "pos"]
+    assert numpy.isclose(dframe.loc["ch02:50", "pval"], 1e-60)
+    assert numpy.isclose(dframe.loc["ch01:200", "pval_quantile"], 0.4)
@@ -0,0 +1,59 @@
+import numpy
+import pandas
+
+from src import hits
+from src.gwas_result import GwasResult, VariantTable
+
+
+def _create_pvalues(n_variants=60, seed=0):
+    rng = numpy.random.default_rng(seed)
+    pvalues = rng.random(n_variants) ** 4
+    pvalues[[3, 17]] = numpy.nan
+    return pandas.DataFrame(
+        {
+            "chrom": "ch01",
+            "pos": numpy.arange(1, n_variants + 1) * 10,
+            "variant_id": [f"ch01:{pos}" for pos in numpy.arange(1, n_variants + 1) * 10],
+            "pval": pvalues,
+        }
+    )
+
+
+def test_trait_hits_are_streamed_from_the_association_file(tmp_path):
+    pvalues = _create_pvalues()
+    assoc_path = tmp_path / "trait.adjusted"
+    pvalues.rename(columns={"chrom": "#CHROM", "variant_id": "ID", "pval": "UNADJ"}).drop(
+        columns="pos"
+    ).to_csv(assoc_path, sep="\t", index=False, na_rep="NA")
+
+    res = hits.extract_trait_hits(assoc_path, k=5, pval_threshold=0.01, chunk_size=7)
+
+    expected = pvalues.dropna().sort_values("pval")
+    assert list(res["top_hits"]["variant_id"]) == list(expected["variant_id"][:5])
+    assert list(res["significant_hits"]["variant_id"]) == list(
+        expected.loc[expected["pval"] <= 0.01, "variant_id"]
+    )
+
+
+def test_trait_hits_from_a_result():
+    pvalues = _create_pvalues().dropna()
+    table = VariantTable(pvalues["chrom"], pvalues["pos"], pvalues["variant_id"])
+    # two variants with the same p-value, they are sorted in genome order
+    pvalues.loc[pvalues.index[[30, 10]], "pval"] = 1e-30
+    gwas_result = GwasResult(
+        table,
+        numpy.arange(table.n_variants),
+        {
+            "pval": -numpy.log10(pvalues["pval"].values),
+            "permutation_fwer_pval": -numpy.log10(pvalues["pval"].values * 2),
+        },
+    )
+
+    res = hits.extract_trait_hits_from_result(gwas_result, k=4, chunk_size=9)
+    expected = pvalues.sort_values(["pval", "pos"])
+    top_hits = res["top_hits"]
+    assert list(top_hits["variant_id"]) == list(expected["variant_id"][:4])
+    assert top_hits["variant_id"].iloc[0] == pvalues["variant_id"].iloc[10]
+    # the columns of the result come along, the permutation ones too
+    assert numpy.allclose(top_hits["permutation_fwer_pval"], top_hits["pval"] * 2, rtol=1e-5)
+    assert res["significant_hits"].shape[0] == 0
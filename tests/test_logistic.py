@@ -0,0 +1,125 @@
+import numpy
+import pandas
+from scipy import optimize
+
+from src import logistic
+from src import plink
+from src.bed import BedReader
+
+from conftest import write_bfiles
+
+
+def _expit(etas):
+    return 1 / (1 + numpy.exp(-etas))
+
+
+def _fit_reference(phenotypes, design, firth=False):
+    # direct maximization of the (penalized) log-likelihood
+    def minus_log_likelihood(betas):
+        etas = design @ betas
+        log_likelihood = (phenotypes * etas - numpy.logaddexp(0, etas)).sum()
+        if firth:
+            mus = _expit(etas)
+            information = design.T @ (design * (mus * (1 - mus))[:, None])
+            log_likelihood += 0.5 * numpy.linalg.slogdet(information)[1]
+        return -log_likelihood
+
+    res = optimize.minimize(
+        minus_log_likelihood, numpy.zeros(design.shape[1]), method="BFGS",
+        options={"gtol": 1e-10},
+    )
+    mus = _expit(design @ res.x)
+    covariance = numpy.linalg.inv(design.T @ (design * (mus * (1 - mus))[:, None]))
+    return {"betas": res.x, "ses": numpy.sqrt(numpy.diag(covariance))}
+
+
+def _create_data(n_samples=300, n_variants=4, seed=1):
+    rng = numpy.random.default_rng(seed)
+    covars = rng.normal(size=(n_samples, 1))
+    genotypes = rng.integers(0, 3, size=(n_samples, n_variants)).astype(float)
+    etas = -0.3 + 0.8 * covars[:, 0] + 0.5 * genotypes[:, 0]
+    phenotypes = (rng.random(n_samples) < _expit(etas)).astype(float)
+    return {"covars": covars, "genotypes": genotypes, "phenotypes": phenotypes}
+
+
+def test_logistic_block_matches_a_reference_fit():
+    data = _create_data()
+    design = logistic.create_null_design(data["phenotypes"].shape[0], data["covars"])
+    null_betas = logistic.fit_null_logistic(data["phenotypes"], design)
+    assert numpy.allclose(
+        null_betas, _fit_reference(data["phenotypes"], design)["betas"], atol=1e-5
+    )
+
+    res = logistic.fit_logistic_block(
+        data["phenotypes"], design, data["genotypes"], null_betas
+    )
+    assert not res["firth"].any()
+    for idx in range(data["genotypes"].shape[1]):
+        reference = _fit_reference(
+            data["phenotypes"], numpy.column_stack([design, data["genotypes"][:, idx]])
+        )
+        assert numpy.isclose(res["betas"][idx], reference["betas"][-1], atol=1e-5)
+        assert numpy.isclose(res["ses"][idx], reference["ses"][-1], rtol=1e-4)
+
+
+def test_separated_variants_are_fitted_with_firth():
+    data = _create_data()
+    phenotypes = data["phenotypes"]
+    # the alternative homozygotes are all cases
+    genotypes = numpy.where(phenotypes == 1, 2.0, data["genotypes"][:, 1] % 2)[:, None]
+    design = logistic.create_null_design(phenotypes.shape[0], data["covars"])
+    null_betas = logistic.fit_null_logistic(phenotypes, design)
+
+    res = logistic.fit_logistic_block(phenotypes, design, genotypes, null_betas)
+    assert res["firth"][0]
+    reference = _fit_reference(
+        phenotypes, numpy.column_stack([design, genotypes[:, 0]]), firth=True
+    )
+    assert numpy.isfinite(res["betas"][0])
+    assert numpy.isclose(res["betas"][0], reference["betas"][-1], rtol=1e-4)
+
+
+def test_native_logistic_gwas_with_numeric_sample_names(tmp_path):
+    sample_names = [str(1000 + idx) for idx in range(40)]
+    bfiles = write_bfiles(
+        tmp_path / "numeric", ["ch01"] * 4, [100, 200, 300, 400], sample_names=sample_names
+    )
+    bfiles_base_path = bfiles["bfiles_base_path"]
+    rng = numpy.random.default_rng(2)
+    # pandas parses the accessions as ints
+    phenotype_dframe = pandas.DataFrame(
+        {"SAMPLE_NAME": numpy.arange(1000, 1040), "disease": rng.integers(1, 3, size=40)}
+    )
+    pheno_path = tmp_path / "traits.pheno"
+    plink.write_plink2_pheno_file(
+        phenotype_dframe, bfiles_base_path, pheno_path, qualitative=True
+    )
+    covars = rng.normal(size=40)
+    covars_path = tmp_path / "traits.cov"
+    pandas.DataFrame(
+        {"#FID": sample_names, "IID": sample_names, "PC1": covars}
+    ).to_csv(covars_path, sep="\t", index=False)
+
+    res = plink.do_gwas(
+        bfiles_base_path,
+        pheno_path,
+        "logistic",
+        tmp_path / "out",
+        covars_path=covars_path,
+        pheno_name="disease",
+        logistic_engine="native",
+        read_freq=False,
+    )
+
+    # every sample is used, with its own phenotype and covariate
+    phenotypes = (phenotype_dframe["disease"].values == 2).astype(float)
+    design = logistic.create_null_design(40, covars[:, None])
+    expected = logistic.fit_logistic_block(
+        phenotypes,
+        design,
+        BedReader(bfiles_base_path).read_genotypes(slice(0, 4)),
+        logistic.fit_null_logistic(phenotypes, design),
+    )
+    gwas_result = res["gwas_result"]
+    assert gwas_result.n_variants == 4
+    assert numpy.allclose(gwas_result.get_pvalues(), expected["pvalues"], rtol=1e-5)
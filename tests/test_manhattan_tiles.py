@@ -0,0 +1,70 @@
+import json
+
+import numpy
+
+from src import manhattan_tiles
+
+
+def _read_tile(tile_path):
+    text = tile_path.read_text()
+    prefix = manhattan_tiles.TILE_CALLBACK + "("
+    assert text.startswith(prefix) and text.endswith(");\n")
+    return json.loads(text[len(prefix) : -3])
+
+
+def _read_meta(html_path):
+    html = html_path.read_text()
+    start = html.index("const META = ") + len("const META = ")
+    return html, json.loads(html[start : html.index(";\n", start)])
+
+
+def _create_tiles(out_dir, chrom_spans, title="height"):
+    rng = numpy.random.default_rng(0)
+    genome_xs = numpy.sort(rng.integers(0, 400_000, size=500))
+    log_pvalues = rng.uniform(0, 3, size=500)
+    log_pvalues[[10, 200, 450]] = [8.0, 12.5, 6.0]
+    res = manhattan_tiles.create_manhattan_tiles(
+        log_pvalues,
+        genome_xs,
+        out_dir,
+        chrom_spans=chrom_spans,
+        labels=[f"var{idx}" for idx in range(500)],
+        point_threshold=5,
+        tile_n_bins=16,
+        min_bin_width=1000,
+        title=title,
+    )
+    return {"res": res, "genome_xs": genome_xs, "log_pvalues": log_pvalues}
+
+
+def test_points_are_only_in_the_base_tile(tmp_path):
+    chrom_spans = {"ch01": (0, 250_000), "ch02": (250_000, 400_000)}
+    tiles = _create_tiles(tmp_path, chrom_spans)
+    assert tiles["res"]["n_levels"] > 2
+
+    tiles_dir = tmp_path / manhattan_tiles.TILES_DIR
+    base_tile = _read_tile(tiles_dir / "0" / "0.js")
+    xs, ys, labels = base_tile["points"]
+    assert labels == ["var10", "var200", "var450"]
+    assert ys == [8.0, 12.5, 6.0]
+    assert xs == tiles["genome_xs"][[10, 200, 450]].tolist()
+    assert max(base_tile["bins"][1]) == 12.5
+
+    for level in range(1, tiles["res"]["n_levels"]):
+        level_tiles = [_read_tile(path) for path in (tiles_dir / str(level)).glob("*.js")]
+        assert level_tiles
+        assert not any("points" in tile for tile in level_tiles)
+        # every level keeps the maximum of the whole genome
+        assert max(max(tile["bins"][1]) for tile in level_tiles) == 12.5
+
+
+def test_names_are_escaped_in_the_viewer(tmp_path):
+    chrom_name = "ch</script><b>&1"
+    chrom_spans = {chrom_name: (0, 400_000)}
+    tiles = _create_tiles(tmp_path, chrom_spans, title="</script>trait")
+
+    html, meta = _read_meta(tiles["res"]["html_path"])
+    assert html.count("</script>") == 1
+    assert "<b>" not in html
+    assert meta["chroms"] == [[chrom_name, 0, 400_000]]
+    assert meta["title"] == "</script>trait"
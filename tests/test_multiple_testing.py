@@ -0,0 +1,23 @@
+import numpy
+
+from src.multiple_testing import ADJUSTED_PVALUE_COLUMNS, adjust_pvalues
+
+
+def test_missing_pvalues_are_not_tests():
+    pvalues = numpy.array([0.01, numpy.nan, 0.04, 0.03, 0.5])
+    adjusted = adjust_pvalues(pvalues)
+    expected = adjust_pvalues(pvalues[[0, 2, 3, 4]])
+    for col in ADJUSTED_PVALUE_COLUMNS:
+        assert numpy.isnan(adjusted[col][1])
+        assert numpy.allclose(adjusted[col][[0, 2, 3, 4]], expected[col])
+    assert numpy.allclose(adjusted["bonferroni_pval"][[0, 2, 3, 4]], [0.04, 0.16, 0.12, 1])
+    assert numpy.allclose(
+        adjusted["benjamini_hochberg_pval"][[0, 2, 3, 4]], [0.04, 0.04 * 4 / 3, 0.04 * 4 / 3, 0.5]
+    )
+    assert numpy.all(numpy.isfinite(adjusted["genomic_control_corrected_pval"][[0, 2, 3, 4]]))
+
+
+def test_all_missing_pvalues():
+    adjusted = adjust_pvalues([numpy.nan, numpy.nan])
+    for col in ADJUSTED_PVALUE_COLUMNS:
+        assert numpy.all(numpy.isnan(adjusted[col]))
@@ -0,0 +1,84 @@
+import numpy
+import pandas
+import pytest
+
+from src import normalization
+
+
+def test_normalized_traits_are_cached(tmp_path, monkeypatch):
+    rng = numpy.random.default_rng(0)
+    dframe = pandas.DataFrame(
+        {
+            "SAMPLE_NAME": [f"s{idx}" for idx in range(30)],
+            "height": rng.normal(size=30),
+            "weight": rng.exponential(size=30),
+        }
+    )
+    cache_dir = tmp_path / "cache"
+    normed = normalization.normalize_traits(
+        dframe, "rank-inverse-normal", cache_dir=cache_dir
+    )
+    assert len(list(cache_dir.glob("*.npy"))) == 2
+    assert not list(cache_dir.glob("*.tmp"))
+    # the ranks are kept
+    assert numpy.array_equal(
+        numpy.argsort(normed["weight"].values), numpy.argsort(dframe["weight"].values)
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The cached traits should not be normalized again")
+
+    monkeypatch.setattr(normalization, "_normalize_trait_values", fail)
+    cached = normalization.normalize_traits(
+        dframe, "rank-inverse-normal", cache_dir=cache_dir
+    )
+    assert cached.equals(normed)
+
+
+def _create_traits(n_samples=40, seed=1):
+    rng = numpy.random.default_rng(seed)
+    dframe = pandas.DataFrame(
+        {
+            "SAMPLE_NAME": [f"s{idx}" for idx in range(n_samples)],
+            "height": rng.normal(size=n_samples),
+            "weight": rng.exponential(size=n_samples),
+            "yield": rng.gamma(2, size=n_samples),
+        }
+    )
+    dframe.loc[[3, 7, 11], "weight"] = numpy.nan
+    dframe.loc[[0], "yield"] = numpy.nan
+    return dframe
+
+
+def test_every_trait_is_normalized_over_its_own_samples():
+    dframe = _create_traits()
+    normed = normalization.normalize_traits(dframe, "rank-inverse-normal")
+    assert list(normed["SAMPLE_NAME"]) == list(dframe["SAMPLE_NAME"])
+    # the missing values of a trait do not drop the samples of the others
+    assert not normed["height"].isna().any()
+    assert list(numpy.nonzero(normed["weight"].isna().values)[0]) == [3, 7, 11]
+
+    weights = dframe["weight"].dropna()
+    assert numpy.allclose(
+        normed["weight"].dropna(),
+        normalization.rank_inverse_normal_transform(weights.values),
+    )
+    # without ties the transformed values are symmetric around 0
+    assert numpy.isclose(normed["weight"].mean(), 0)
+
+
+def test_traits_are_normalized_in_parallel():
+    dframe = _create_traits()
+    for method in ("yeo-johnson", "quantile"):
+        serial = normalization.normalize_traits(dframe, method, n_quantiles=20)
+        parallel = normalization.normalize_traits(
+            dframe, method, n_quantiles=20, n_workers=2
+        )
+        assert numpy.allclose(
+            serial[["height", "weight", "yield"]],
+            parallel[["height", "weight", "yield"]],
+            equal_nan=True,
+        )
+
+    with pytest.raises(ValueError):
+        normalization.normalize_traits(dframe, "log")
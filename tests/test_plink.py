@@ -0,0 +1,179 @@
+import os
+from pathlib import Path
+
+import numpy
+import pandas
+import pytest
+
+from src import plink
+
+from conftest import write_bfiles
+
+
+def test_filtered_bfiles_use_a_per_process_tmp_base(tmp_path, tiny_bfiles, fake_plink2):
+    variant_filters = plink.VariantFilters(max_major_freq=None, max_missing_rate=0.1)
+    res = plink.create_filtered_bfiles(
+        tiny_bfiles["bfiles_base_path"], variant_filters, cache_dir=tmp_path / "cache"
+    )
+    filtered_base_path = res["bfiles_base_path"]
+
+    (call,) = fake_plink2()
+    tmp_base_path = call[call.index("--out") + 1]
+    assert tmp_base_path == f"{filtered_base_path}.{os.getpid()}.tmp"
+    for suffix in (".bed", ".bim", ".fam", ".log", ".filter.stdout", ".filter.stderr"):
+        assert Path(str(filtered_base_path) + suffix).exists()
+    assert not list(filtered_base_path.parent.glob("*.tmp*"))
+
+    # a finished fileset is reused
+    plink.create_filtered_bfiles(
+        tiny_bfiles["bfiles_base_path"], variant_filters, cache_dir=tmp_path / "cache"
+    )
+    assert len(fake_plink2()) == 1
+
+
+def test_subset_bfiles_use_a_per_process_tmp_base(tmp_path, tiny_bfiles, fake_plink2):
+    res = plink.create_subset_bfiles(
+        tiny_bfiles["bfiles_base_path"], ["s0", "s1", "s2"], cache_dir=tmp_path / "cache"
+    )
+    (call,) = fake_plink2()
+    assert call[call.index("--out") + 1] == f"{res['bfiles_base_path']}.{os.getpid()}.tmp"
+    assert res["keep_path"].read_text().split() == ["s0", "s0", "s1", "s1", "s2", "s2"]
+    assert Path(str(res["bfiles_base_path"]) + ".bed").exists()
+    assert not list(res["bfiles_base_path"].parent.glob("*.tmp*"))
+
+
+def test_subset_is_rebuilt_when_the_bfiles_change(tmp_path, tiny_bfiles, fake_plink2):
+    bfiles_base_path = tiny_bfiles["bfiles_base_path"]
+    first = plink.create_subset_bfiles(bfiles_base_path, ["s0", "s1"], tmp_path / "cache")
+    same = plink.create_subset_bfiles(bfiles_base_path, ["s1", "s0"], tmp_path / "cache")
+    assert same["bfiles_base_path"] == first["bfiles_base_path"]
+
+    # the bfileset is regenerated in place
+    bim_path = Path(str(bfiles_base_path) + ".bim")
+    bim_path.write_text(bim_path.read_text().replace("ch02", "ch03"))
+    rebuilt = plink.create_subset_bfiles(bfiles_base_path, ["s0", "s1"], tmp_path / "cache")
+    assert rebuilt["bfiles_base_path"] != first["bfiles_base_path"]
+    assert len(fake_plink2()) == 2
+
+
+def _write_pheno_file(tiny_bfiles, path):
+    plink.write_plink2_pheno_file(
+        pandas.DataFrame({"SAMPLE_NAME": tiny_bfiles["samples"], "height": range(8)}),
+        tiny_bfiles["bfiles_base_path"],
+        path,
+    )
+    return path
+
+
+def test_compressed_gwas_outputs(tmp_path, tiny_bfiles, fake_plink2):
+    pheno_path = _write_pheno_file(tiny_bfiles, tmp_path / "traits.pheno")
+    res = plink.do_gwas(
+        tiny_bfiles["bfiles_base_path"],
+        pheno_path,
+        "linear",
+        tmp_path / "out",
+        allow_no_covars=True,
+        pheno_name="height",
+        compress_outputs=True,
+        read_freq=False,
+    )
+    (call,) = fake_plink2()
+    assert call[call.index("--linear") + 1] == "zs"
+    assert call[call.index("--adjust") + 2] == "zs"
+
+    # plink2 only writes the compressed outputs, they are read from there
+    glm_path = tmp_path / "out.gwas.height.glm.linear"
+    assert res["adjusted_pvalues_path"] == Path(str(glm_path) + ".adjusted.zst")
+    assert res["adjusted_pvalues_path"].exists()
+    assert not glm_path.exists()
+    assert res["gwas_result"].n_variants == 5
+    assert numpy.isclose(res["gwas_result"].get_min_pvalue(), 1 / 6)
+
+
+def test_variant_ranges_share_the_cpus(tmp_path, tiny_bfiles, fake_plink2, monkeypatch):
+    monkeypatch.setattr(plink.os, "cpu_count", lambda: 4)
+    pheno_path = _write_pheno_file(tiny_bfiles, tmp_path / "traits.pheno")
+    res = plink.do_gwas(
+        tiny_bfiles["bfiles_base_path"],
+        pheno_path,
+        "linear",
+        tmp_path / "out",
+        allow_no_covars=True,
+        pheno_name="height",
+        n_variant_ranges=2,
+        read_freq=False,
+    )
+    calls = fake_plink2()
+    assert len(calls) == 2
+    # two ranges at once, each one with half of the cpus
+    assert all(call[call.index("--threads") + 1] == "2" for call in calls)
+    assert res["gwas_result"].n_variants == 5
+
+
+def test_pheno_file_with_numeric_sample_names(tmp_path):
+    bfiles = write_bfiles(
+        tmp_path / "numeric", ["ch01"] * 2, [100, 200], sample_names=["1000", "1001", "1002"]
+    )
+    traits_path = tmp_path / "traits.tsv"
+    traits_path.write_text("SAMPLE_NAME\theight\n1001\t1.5\n1000\t2.5\n1002\t3.5\n")
+    # pandas reads the accessions as ints
+    phenotype_dframe = pandas.read_csv(traits_path, sep="\t")
+    pheno_path = tmp_path / "traits.pheno"
+    plink.write_plink2_pheno_file(phenotype_dframe, bfiles["bfiles_base_path"], pheno_path)
+
+    pheno = pandas.read_csv(pheno_path, sep="\t", dtype={"IID": str})
+    assert list(pheno["IID"]) == ["1000", "1001", "1002"]
+    assert list(pheno["height"]) == [2.5, 1.5, 3.5]
+
+
+def test_pheno_file_samples_not_in_the_bfiles(tmp_path, tiny_bfiles):
+    bfiles_base_path = tiny_bfiles["bfiles_base_path"]
+    with pytest.raises(ValueError, match="None of the samples"):
+        plink.write_plink2_pheno_file(
+            pandas.DataFrame({"SAMPLE_NAME": [1, 2], "height": [1.0, 2.0]}),
+            bfiles_base_path,
+            tmp_path / "traits.pheno",
+        )
+    with pytest.warns(UserWarning, match="1 samples are not in the bfileset"):
+        plink.write_plink2_pheno_file(
+            pandas.DataFrame({"SAMPLE_NAME": ["s0", "x1"], "height": [1.0, 2.0]}),
+            bfiles_base_path,
+            tmp_path / "traits.pheno",
+        )
+
+
+def _count_range_variants(bfiles, variant_range):
+    chroms, from_bp, to_bp = variant_range
+    variants = pandas.DataFrame(
+        {"chrom": [variant_id.split(":")[0] for variant_id in bfiles["variant_ids"]],
+         "pos": [int(variant_id.split(":")[1]) for variant_id in bfiles["variant_ids"]]}
+    )
+    in_range = variants["chrom"].isin(chroms)
+    if from_bp is not None:
+        in_range &= variants["pos"].between(from_bp, to_bp)
+    return int(in_range.sum())
+
+
+def test_many_small_contigs_are_grouped_in_the_variant_ranges(tmp_path):
+    # two chromosomes and 300 scaffolds with a couple of variants each
+    chroms = ["ch01"] * 400 + ["ch02"] * 200
+    poss = list(range(1, 401)) + list(range(1, 201))
+    for idx in range(300):
+        chroms.extend([f"scaffold{idx}"] * 2)
+        poss.extend([10, 20])
+    bfiles = write_bfiles(tmp_path / "scaffolds", chroms, poss)
+
+    ranges = plink.split_genome_in_variant_ranges(bfiles["bfiles_base_path"], 4)
+    assert len(ranges) == 4
+    n_variants = [_count_range_variants(bfiles, variant_range) for variant_range in ranges]
+    # every variant is tested once and no range is much larger than the others
+    assert sum(n_variants) == len(chroms)
+    assert max(n_variants) < 2 * len(chroms) / 4
+    range_chroms = [chrom for chroms, _, _ in ranges for chrom in chroms]
+    assert sorted(range_chroms) == sorted(set(chroms))
+
+
+def test_a_single_chromosome_is_cut_in_variant_ranges(tmp_path):
+    bfiles = write_bfiles(tmp_path / "chrom", ["ch01"] * 10, list(range(1, 11)))
+    ranges = plink.split_genome_in_variant_ranges(bfiles["bfiles_base_path"], 3)
+    assert ranges == [(("ch01",), 1, 4), (("ch01",), 5, 8), (("ch01",), 9, 10)]
@@ -0,0 +1,72 @@
+import numpy
+import pytest
+
+from src import plot
+
+
+def _create_values(n_values=1000, seed=0):
+    rng = numpy.random.default_rng(seed)
+    values = rng.normal(size=n_values)
+    values[::50] = numpy.nan
+    return values
+
+
+def test_histogram_is_accumulated_by_chunks():
+    values = _create_values()
+    bin_edges = numpy.linspace(-2, 2, num=11)
+
+    # every worker fills the histogram of its chunks
+    hists = [plot.HistogramAccumulator(bin_edges) for _ in range(3)]
+    for chunk_idx, chunk in enumerate(numpy.array_split(values, 10)):
+        hists[chunk_idx % 3].update(chunk)
+    hist = hists[0].merge(hists[1]).merge(hists[2])
+
+    expected, _ = numpy.histogram(values[~numpy.isnan(values)], bins=bin_edges)
+    assert numpy.array_equal(hist.counts, expected)
+    assert hist.n_nan == 20
+    assert hist.n_below == numpy.sum(values < -2)
+    assert hist.n_above == numpy.sum(values > 2)
+    assert hist.n_values + hist.n_below + hist.n_above + hist.n_nan == values.shape[0]
+
+    # the right edge belongs to the last bin
+    edge_hist = plot.HistogramAccumulator.from_range((0, 1), n_bins=2).update([0, 0.5, 1])
+    assert list(edge_hist.counts) == [1, 2]
+
+    with pytest.raises(ValueError):
+        hist.merge(plot.HistogramAccumulator.from_range((-2, 2), n_bins=5))
+
+
+def test_2d_histogram_is_accumulated_by_chunks():
+    xvalues = _create_values(seed=1)
+    yvalues = _create_values(seed=2)[::-1]
+    hist2d, other = [
+        plot.Histogram2DAccumulator.from_ranges((-2, 2), (-1, 3), x_n_bins=8, y_n_bins=5)
+        for _ in range(2)
+    ]
+    hist2d.update(xvalues[:400], yvalues[:400])
+    other.update(xvalues[400:], yvalues[400:])
+    hist2d.merge(other)
+
+    expected, _, _ = numpy.histogram2d(
+        xvalues, yvalues, bins=[hist2d.x_bin_edges, hist2d.y_bin_edges]
+    )
+    assert numpy.array_equal(hist2d.counts, expected)
+    assert hist2d.n_outside == xvalues.shape[0] - expected.sum()
+    assert numpy.array_equal(hist2d.get_x_histogram().counts, expected.sum(axis=1))
+    assert numpy.array_equal(hist2d.get_y_histogram().counts, expected.sum(axis=0))
+
+    with pytest.raises(ValueError):
+        hist2d.update(xvalues, yvalues[:10])
+
+
+def test_figures_are_drawn_from_the_counts(tmp_path):
+    values = _create_values()
+    hist = plot.HistogramAccumulator.from_range((-3, 3)).update(values)
+    plot.plot_hist_fig(hist, tmp_path / "hist.png")
+    assert (tmp_path / "hist.png").stat().st_size
+
+    hist2d = plot.Histogram2DAccumulator.from_ranges((-3, 3), (-3, 3))
+    hist2d.update(values, _create_values(seed=1))
+    fig = plot.plot_2d_joinplot_from_hist(hist2d, map_log=True)
+    fig.save_fig(tmp_path / "joinplot.png")
+    assert (tmp_path / "joinplot.png").stat().st_size
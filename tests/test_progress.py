@@ -0,0 +1,53 @@
+import io
+
+from src import progress
+
+
+def _create_clock(times):
+    times = iter(times)
+    return lambda: next(times)
+
+
+def test_backspace_percentages_are_parsed():
+    events = []
+    parser = progress.PlinkProgressParser(
+        events.append, source="height", clock=_create_clock([10.0, 12.0, 20.0, 30.0])
+    )
+    # a percentage can be split between two reads
+    parser.feed(b"Start time: now\n--glm linear regression on phenotype 'X': 0%\b\b1")
+    parser.feed(b"0%\b\b\b10%\b\b\b50%\b\b\bdone.\n")
+    parser.feed(b"--make-bed: 100%")
+    parser.close()
+
+    assert [event["percent"] for event in events] == [0, 10, 50, 100]
+    assert [event["step"] for event in events] == [
+        "--glm linear regression on phenotype 'X'",
+    ] * 3 + ["--make-bed"]
+    assert all(event["source"] == "height" for event in events)
+
+    first, second, third, last = events
+    assert first["elapsed"] == 0 and first["rate"] is None and first["eta"] is None
+    assert second["elapsed"] == 2.0
+    assert second["rate"] == 5.0
+    assert second["eta"] == 18.0
+    assert third["rate"] == 5.0
+    assert third["eta"] == 10.0
+    # a new step starts its own timing
+    assert last["elapsed"] == 0
+
+
+def test_progress_is_printed_at_most_every_interval():
+    fhand = io.StringIO()
+    print_progress = progress.create_progress_printer(
+        min_interval=10, fhand=fhand, clock=_create_clock([0, 5, 12, 13, 14])
+    )
+    event = {"source": "height", "step": "--glm", "elapsed": 0, "eta": None}
+    updates = [(0, 0, None), (20, 5, 20), (40, 12, 18), (60, 13, 9), (100, 14, 0)]
+    for percent, elapsed, eta in updates:
+        print_progress(dict(event, percent=percent, elapsed=elapsed, eta=eta))
+
+    assert fhand.getvalue().splitlines() == [
+        "height: --glm 0% (elapsed 0:00:00, ETA unknown)",
+        "height: --glm 40% (elapsed 0:00:12, ETA 0:00:18)",
+        "height: --glm 100% (elapsed 0:00:14, ETA 0:00:00)",
+    ]
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import numpy
+import pandas
+
+from src import plink
+from src import qc
+
+
+def test_variant_qc_seeds_the_allele_freqs_cache(tiny_bfiles, fake_plink2):
+    bfiles_base_path = tiny_bfiles["bfiles_base_path"]
+    res = qc.run_variant_qc(bfiles_base_path)
+    assert len(fake_plink2()) == 1
+    assert list(res["stats"].index) == tiny_bfiles["variant_ids"]
+    assert numpy.allclose(res["stats"]["maf"], 0.25)
+
+    afreq_path = plink.get_allele_freqs_path(bfiles_base_path)
+    assert afreq_path.read_text() == res["afreq_path"].read_text()
+    assert not list(afreq_path.parent.glob("*.tmp"))
+
+    # the frequencies and the stats are not computed again
+    plink.calc_allele_freqs(bfiles_base_path)
+    assert qc.run_variant_qc(bfiles_base_path)["stats"].equals(res["stats"])
+    assert len(fake_plink2()) == 1
+
+
+def test_filters_use_the_cached_qc_stats(tmp_path, tiny_bfiles, fake_plink2):
+    bfiles_base_path = tiny_bfiles["bfiles_base_path"]
+    variant_ids = tiny_bfiles["variant_ids"]
+    qc_stats = pandas.DataFrame(
+        {
+            "chrom": [variant_id.split(":")[0] for variant_id in variant_ids],
+            "maf": [0.3, 0.001, 0.2, 0.4, 0.1],
+            "missing_rate": [0.0, 0.0, 0.5, 0.05, 0.0],
+            "hwe_pval": 1.0,
+        },
+        index=pandas.Index(variant_ids, name="variant_id"),
+    )
+    qc_base_path = qc.get_qc_base_path(bfiles_base_path)
+    qc._save_qc_stats(qc_stats, str(qc_base_path) + qc.QC_STATS_SUFFIX)
+    listed_path = tmp_path / "listed.txt"
+    listed_path.write_text("\n".join(variant_ids[:4]) + "\n")
+
+    variant_filters = plink.VariantFilters(
+        max_major_freq=0.01, max_missing_rate=0.1, lists_of_vars_to_keep_paths=[listed_path]
+    )
+    res = plink.create_filtered_bfiles(
+        bfiles_base_path, variant_filters, cache_dir=tmp_path / "cache"
+    )
+
+    # plink2 does not compute the frequencies nor the missingness again
+    (call,) = fake_plink2()
+    assert "--maf" not in call and "--geno" not in call and "--read-freq" not in call
+    extract_path = Path(call[call.index("--extract") + 1])
+    assert extract_path == Path(str(res["bfiles_base_path"]) + ".qc_pass.txt")
+    assert extract_path.read_text().split() == [variant_ids[0], variant_ids[3]]
@@ -0,0 +1,48 @@
+import pandas
+import pytest
+
+from src import manifest, shards
+from src.gwas import do_gwas_analysis
+
+
+def test_merge_shards_with_an_empty_shard(tmp_path, tiny_bfiles):
+    out_dir = tmp_path / "gwas"
+    phenotype_dframe = pandas.DataFrame(
+        {"SAMPLE_NAME": tiny_bfiles["samples"], "height": range(8)}
+    )
+    # shard 0 gets no traits, it never runs a GWAS
+    do_gwas_analysis(
+        tiny_bfiles["bfiles_base_path"],
+        phenotype_dframe,
+        out_base_name="run",
+        out_dir=shards.get_shard_dir(out_dir, 0, 2),
+        genome_fai_path=None,
+        qualitative=False,
+        traits=[],
+        plots=False,
+    )
+
+    # shard 1 finished one trait
+    shard_dir = shards.get_shard_dir(out_dir, 1, 2)
+    (shard_dir / "height").mkdir(parents=True)
+    hits_path = shard_dir / "height" / "run_height_hits.csv"
+    pandas.DataFrame(
+        {"trait": ["height"], "variant_id": ["ch01:100"], "pval": [1e-9], "is_top_k": [True]}
+    ).to_csv(hits_path, index=False)
+    run_manifest = manifest.RunManifest(shard_dir / "run.manifest.json")
+    run_manifest.mark_done(
+        "height", "fingerprint", summary={"status": "done"}, hits_path=hits_path
+    )
+    run_manifest.create_summary(["height"]).to_csv(
+        shard_dir / "run_trait_summary.csv", index=False
+    )
+
+    res = shards.merge_shards(out_dir, "run")
+    assert list(pandas.read_csv(res["summary_path"])["trait"]) == ["height"]
+    hits = pandas.read_csv(res["genome_wide_hits_path"])
+    assert list(hits["variant_id"]) == ["ch01:100"]
+
+
+def test_merge_shards_without_shard_dirs(tmp_path):
+    with pytest.raises(RuntimeError, match="No shard_\\*_of_N dirs found"):
+        shards.merge_shards(tmp_path, "run")
@@ -0,0 +1,73 @@
+import argparse
+from pathlib import Path
+
+from src.qc import (
+    plot_variant_qc,
+    run_variant_qc,
+    summarize_variant_qc,
+    write_variants_passing_qc,
+)
+
+
+def parse_arguments():
+    desc = "Compute variant frequency, missingness and HWE stats in a single plink2 pass"
+    parser = argparse.ArgumentParser(description=desc)
+    help_plink_input = "(Required) PLINK basename path"
+    parser.add_argument("--plink",
+                        "-i", type=str,
+                        help=help_plink_input,
+                        required=True)
+    help_output = "(Required) QC report output base path"
+    parser.add_argument("--out", "-o",
+                        type=str, help=help_output,
+                        required=True)
+    help_keep = "(Optional) plink2 --keep file with the samples to use"
+    parser.add_argument("--keep", "-k",
+                        type=str, help=help_keep,
+                        default=None)
+    help_min_maf = "(Optional) minimum MAF of the variants written to the passing list"
+    parser.add_argument("--min_maf",
+                        type=float, help=help_min_maf,
+                        default=None)
+    help_max_missing_rate = "(Optional) maximum missing rate of the variants written to the passing list"
+    parser.add_argument("--max_missing_rate", "-m",
+                        type=float, help=help_max_missing_rate,
+                        default=None)
+    help_min_hwe_pval = "(Optional) minimum HWE p-value of the variants written to the passing list"
+    parser.add_argument("--min_hwe_pval",
+                        type=float, help=help_min_hwe_pval,
+                        default=None)
+    help_overwrite = "(Optional) recompute the cached stats"
+    parser.add_argument("--overwrite",
+                        action="store_true", help=help_overwrite)
+    return parser
+
+
+def get_options():
+    parser = parse_arguments()
+    options = parser.parse_args()
+    return {"base_plink_path": Path(options.plink),
+            "out_base_path": Path(options.out),
+            "keep_path": Path(options.keep) if options.keep else None,
+            "min_maf": options.min_maf,
+            "max_missing_rate": options.max_missing_rate,
+            "min_hwe_pval": options.min_hwe_pval,
+            "overwrite": options.overwrite}
+
+
+if __name__ == "__main__":
+    options = get_options()
+    qc_res = run_variant_qc(options["base_plink_path"],
+                            keep_path=options["keep_path"],
+                            overwrite=options["overwrite"])
+    out_base_path = options["out_base_path"]
+    summary = summarize_variant_qc(qc_res["stats"])
+    summary.to_csv(f"{out_base_path}.variant_qc_summary.tsv", sep="\t", header=False)
+    plot_variant_qc(qc_res["stats"], out_base_path)
+    if any(options[key] is not None
+           for key in ("min_maf", "max_missing_rate", "min_hwe_pval")):
+        write_variants_passing_qc(qc_res["stats"],
+                                  f"{out_base_path}.qc_pass.txt",
+                                  min_maf=options["min_maf"],
+                                  max_missing_rate=options["max_missing_rate"],
+                                  min_hwe_pval=options["min_hwe_pval"])